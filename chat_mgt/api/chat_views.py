@@ -19,7 +19,7 @@ from zhiqing_server.utils.db_utils import (
     check_record_exists, get_record_by_id, get_last_insert_id,
     dict_fetchall, execute_query_sql, execute_sql
 )
-from knowledge_mgt.utils.vector_store import VectorStore
+from knowledge_mgt.utils.vector_store import VectorStore, normalize_search_filters
 from account_mgt.utils.jwt_token_utils import parse_jwt_token
 
 logger = logging.getLogger(__name__)
@@ -60,6 +60,15 @@ def retrieve_and_chat(request):
         similarity_threshold = data.get('similarity_threshold', 0.7)
         diversity = data.get('diversity', 0.7)
         conversation_id = data.get('conversation_id')
+        # 按文档、文件类型、上传时间过滤检索范围
+        filters = normalize_search_filters(data.get('filters'))
+        # IVF索引的检索聚类数、HNSW索引的检索候选集大小，为空时使用知识库配置
+        nprobe = data.get('nprobe')
+        ef_search = data.get('ef_search')
+        if nprobe is not None and (not isinstance(nprobe, int) or nprobe <= 0):
+            return create_error_response('nprobe必须是正整数')
+        if ef_search is not None and (not isinstance(ef_search, int) or ef_search <= 0):
+            return create_error_response('ef_search必须是正整数')
 
         # 获取用户信息
         user_info = get_user_from_request(request)
@@ -157,7 +166,8 @@ def retrieve_and_chat(request):
             logger.debug("使用当前加载的本地嵌入模型进行向量检索")
 
             # 2. 将查询转换为向量
-            query_vector = embedding_model.embed_text(query)
+            from knowledge_mgt.utils.query_embedding_cache import embed_query
+            query_vector = embed_query(embedding_model, query)
 
             # 获取嵌入模型的实际维度
             actual_dimension = embedding_model.get_dimension()
@@ -167,7 +177,8 @@ def retrieve_and_chat(request):
             vector_store = VectorStore(vector_dimension=actual_dimension, index_type=index_type)
 
             # 4. 在向量数据库中搜索相似文档
-            similar_chunks = vector_store.search(knowledge_id, query_vector, top_k=retrieve_count)
+            similar_chunks = vector_store.search(knowledge_id, query_vector, top_k=retrieve_count, filters=filters,
+                                                 nprobe=nprobe, ef_search=ef_search)
 
             # 5. 根据相似度阈值过滤结果
             filtered_chunks = []
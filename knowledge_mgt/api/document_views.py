@@ -226,7 +226,10 @@ def upload_document(request):
                                     chunk_ids = [row[0] for row in chunk_rows]
                                     
                                     # 添加向量到索引（包含权限验证）
-                                    vector_ids = vector_store.add_vectors(int(database_id), chunk_ids, vectors, user_id=user_id, role_id=role_id)
+                                    vector_ids = vector_store.add_vectors(
+                                        int(database_id), chunk_ids, vectors, user_id=user_id, role_id=role_id,
+                                        chunk_attributes={'document_id': document_id, 'file_type': file_extension}
+                                    )
                                     
                                     # 更新分块的向量ID
                                     if vector_ids:
@@ -20,7 +20,9 @@ from django.conf import settings
 from zhiqing_server.utils.response_code import ResponseCode
 from zhiqing_server.utils.auth_utils import jwt_required, get_user_from_request
 from ..utils.embeddings import local_embedding_manager
+from ..utils.query_embedding_cache import embed_query
 from ..utils.vector_store import VectorStore
+from ..utils.federated_search import federated_search, get_chunk_details_bulk
 
 logger = logging.getLogger(__name__)
 
@@ -85,7 +87,7 @@ def check_duplicate_content(request):
             )
         
         # 将查询内容转换为向量
-        query_vector = embedding_model.embed_text(content)
+        query_vector = embed_query(embedding_model, content)
         
         # 初始化向量存储
         vector_store = VectorStore(
@@ -228,6 +230,8 @@ def batch_check_duplicates(request):
         # 获取嵌入模型 - 优先使用知识库绑定的模型
         logger.info("获取嵌入模型...")
         embedding_model = None
+        # 从本地模型池取得的模型ID，查重结束后释放引用
+        acquired_model_id = None
         
         # 检查知识库是否绑定了嵌入模型
         with connection.cursor() as cursor:
@@ -284,7 +288,8 @@ def batch_check_duplicates(request):
                         try:
                             local_model_config = get_embedding_model_by_id(local_model_id)
                             if local_model_config:
-                                embedding_model = local_embedding_manager.load_model(local_model_id, local_model_config)
+                                embedding_model = local_embedding_manager.acquire(local_model_id, local_model_config)
+                                acquired_model_id = local_model_id
                                 logger.info(f"成功加载本地嵌入模型: {local_model_name}")
                             else:
                                 logger.warning("本地模型配置获取失败")
@@ -305,12 +310,16 @@ def batch_check_duplicates(request):
         
         # 批量检查重复
         logger.info("开始批量查重...")
-        duplicate_groups = find_duplicate_groups(
-            chunks, 
-            embedding_model, 
-            similarity_threshold,
-            max_results
-        )
+        try:
+            duplicate_groups = find_duplicate_groups(
+                chunks, 
+                embedding_model, 
+                similarity_threshold,
+                max_results
+            )
+        finally:
+            if acquired_model_id is not None:
+                local_embedding_manager.release(acquired_model_id)
         
         # 统计信息
         total_duplicate_chunks = sum(len(group) for group in duplicate_groups)
@@ -772,74 +781,45 @@ def trace_content_sources(content: str, knowledge_id: int, search_scope: str, us
             return []
         
         # 将查询内容转换为向量
-        query_vector = embedding_model.embed_text(content)
-        
-        # 根据搜索范围确定搜索的知识库
-        search_kb_ids = [knowledge_id]
-        
-        if search_scope == 'all':
-            # 搜索所有有权限的知识库
-            with connection.cursor() as cursor:
-                if role_id == 1:  # 管理员
-                    cursor.execute("SELECT id FROM knowledge_database")
-                else:  # 普通用户
-                    cursor.execute("SELECT id FROM knowledge_database WHERE user_id = %s", [user_id])
-                
-                search_kb_ids = [row[0] for row in cursor.fetchall()]
+        query_vector = embed_query(embedding_model, content)
         
-        # 在所有相关知识库中搜索
+        # 根据搜索范围确定搜索的知识库，all时检索全部有权限的知识库
+        search_kb_ids = None if search_scope == 'all' else [knowledge_id]
+
+        # 在线程池中并发检索各知识库，合并各知识库的top-5结果
+        similar_chunks = federated_search(
+            query_vector,
+            knowledge_db_ids=search_kb_ids,
+            top_k=20,
+            per_kb_top_k=5,
+            user_id=user_id,
+            role_id=role_id
+        )
+
+        # 批量获取分块详细信息
+        chunk_details = get_chunk_details_bulk(
+            [chunk['chunk_id'] for chunk in similar_chunks], user_id, role_id
+        )
+
         all_sources = []
-        for kb_id in search_kb_ids:
-            try:
-                # 获取知识库信息
-                with connection.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT id, name, vector_dimension, index_type 
-                        FROM knowledge_database 
-                        WHERE id = %s
-                    """, [kb_id])
-                    
-                    kb_info = cursor.fetchone()
-                    if not kb_info:
-                        continue
-                
-                # 初始化向量存储
-                vector_store = VectorStore(
-                    vector_dimension=embedding_model.get_dimension(), 
-                    index_type=kb_info[3]
-                )
-                
-                # 搜索相似内容
-                similar_chunks = vector_store.search(
-                    kb_id, 
-                    query_vector, 
-                    top_k=5,
-                    user_id=user_id,
-                    role_id=role_id
-                )
-                
-                # 处理搜索结果
-                for chunk in similar_chunks:
-                    distance = chunk['distance']
-                    similarity_score = 1.0 / (1.0 + distance) if distance >= 0 else 0.0
-                    
-                    if similarity_score >= 0.6:  # 降低阈值以获取更多溯源信息
-                        chunk_info = get_chunk_details(chunk['chunk_id'], user_id, role_id)
-                        if chunk_info:
-                            all_sources.append({
-                                'knowledge_base_id': kb_id,
-                                'knowledge_base_name': kb_info[1],
-                                'chunk_id': chunk['chunk_id'],
-                                'similarity_score': round(similarity_score, 4),
-                                'content': chunk_info['content'],
-                                'document_info': chunk_info['document_info'],
-                                'source_type': 'internal' if kb_id == knowledge_id else 'external'
-                            })
-            
-            except Exception as e:
-                logger.error(f"在知识库 {kb_id} 中搜索溯源失败: {str(e)}")
-                continue
-        
+        for chunk in similar_chunks:
+            distance = chunk['distance']
+            similarity_score = 1.0 / (1.0 + distance) if distance >= 0 else 0.0
+
+            if similarity_score >= 0.6:  # 降低阈值以获取更多溯源信息
+                chunk_info = chunk_details.get(chunk['chunk_id'])
+                if chunk_info:
+                    kb_id = chunk['knowledge_db_id']
+                    all_sources.append({
+                        'knowledge_base_id': kb_id,
+                        'knowledge_base_name': chunk['knowledge_db_name'],
+                        'chunk_id': chunk['chunk_id'],
+                        'similarity_score': round(similarity_score, 4),
+                        'content': chunk_info['content'],
+                        'document_info': chunk_info['document_info'],
+                        'source_type': 'internal' if str(kb_id) == str(knowledge_id) else 'external'
+                    })
+
         # 按相似度排序
         all_sources.sort(key=lambda x: x['similarity_score'], reverse=True)
         
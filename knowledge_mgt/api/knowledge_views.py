@@ -12,6 +12,9 @@ import json
 
 from zhiqing_server.utils.response_code import ResponseCode
 from zhiqing_server.utils.auth_utils import jwt_required, get_user_from_request
+from knowledge_mgt.utils.vector_store import (
+    VectorStore, SUPPORTED_INDEX_TYPES, METRIC_L2, normalize_index_type, metric_for_embedding_model
+)
 
 logger = logging.getLogger(__name__)
 
@@ -172,8 +175,10 @@ def create_knowledge_database(request):
         data = json.loads(request.body)
         logger.info(f"创建知识库请求数据: {data}")
         
-        # 验证必填字段
-        required_fields = ['name', 'description', 'vector_dimension', 'index_type']
+        # 验证必填字段，绑定嵌入模型时向量维度由模型决定，可以不传
+        required_fields = ['name', 'description', 'index_type']
+        if not data.get('embedding_model_id') or data.get('embedding_model_id') == 'null':
+            required_fields.append('vector_dimension')
         for field in required_fields:
             if not data.get(field):
                 logger.error(f"缺少必填字段: {field}")
@@ -184,14 +189,66 @@ def create_knowledge_database(request):
         
         name = data.get('name', '').strip()
         description = data.get('description', '').strip()
-        vector_dimension = int(data.get('vector_dimension', 1536))
+        vector_dimension = data.get('vector_dimension')
+        if vector_dimension is not None:
+            try:
+                vector_dimension = int(vector_dimension)
+            except (TypeError, ValueError):
+                vector_dimension = 0
+            if vector_dimension <= 0:
+                return JsonResponse(
+                    ResponseCode.ERROR.to_dict(message="vector_dimension必须是正整数"),
+                    status=400
+                )
         index_type = data.get('index_type', 'faiss')
         embedding_model_id = data.get('embedding_model_id')
+        # 是否在磁盘保留全精度向量用于重排序，为空时压缩索引类型（IVFPQ、SQ8、HNSW_SQ）默认开启
+        rerank = data.get('rerank')
         
         # 如果embedding_model_id为null或空字符串，设置为None
         if embedding_model_id == '' or embedding_model_id == 'null':
             embedding_model_id = None
         
+        if normalize_index_type(index_type) not in SUPPORTED_INDEX_TYPES:
+            logger.error(f"不支持的索引类型: {index_type}")
+            return JsonResponse(
+                ResponseCode.ERROR.to_dict(message=f"不支持的索引类型: {index_type}，可选: {', '.join(SUPPORTED_INDEX_TYPES)}"),
+                status=400
+            )
+        
+        if rerank is not None and not isinstance(rerank, bool):
+            return JsonResponse(
+                ResponseCode.ERROR.to_dict(message="rerank必须是布尔值"),
+                status=400
+            )
+        
+        # 向量维度和度量方式由绑定的嵌入模型决定，请求中的维度与模型不一致时拒绝创建
+        metric = METRIC_L2
+        if embedding_model_id:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT api_type, name, vector_dimension FROM embedding_model WHERE id = %s",
+                    [embedding_model_id]
+                )
+                model_row = cursor.fetchone()
+            if not model_row:
+                logger.error(f"嵌入模型不存在: {embedding_model_id}")
+                return JsonResponse(
+                    ResponseCode.ERROR.to_dict(message="嵌入模型不存在"),
+                    status=400
+                )
+            metric = metric_for_embedding_model(model_row[0], model_row[1])
+            model_dimension = int(model_row[2])
+            if vector_dimension is not None and vector_dimension != model_dimension:
+                logger.error(f"向量维度 {vector_dimension} 与嵌入模型维度 {model_dimension} 不一致")
+                return JsonResponse(
+                    ResponseCode.ERROR.to_dict(
+                        message=f"向量维度 {vector_dimension} 与嵌入模型 {model_row[1]} 的维度 {model_dimension} 不一致"
+                    ),
+                    status=400
+                )
+            vector_dimension = model_dimension
+        
         logger.info(f"处理后的数据: name={name}, description={description}, vector_dimension={vector_dimension}, index_type={index_type}, embedding_model_id={embedding_model_id}")
         
         # 获取用户信息
@@ -233,6 +290,15 @@ def create_knowledge_database(request):
             
             logger.info(f"知识库创建成功，ID: {knowledge_id}")
         
+        # 绑定了嵌入模型时按模型维度和所选索引类型创建向量索引，重排序选项记录在索引元数据中；
+        # 未绑定时无法确定向量维度，索引在首次写入向量时按实际维度创建
+        if embedding_model_id:
+            try:
+                vector_store = VectorStore(vector_dimension=vector_dimension, index_type=index_type, metric=metric)
+                vector_store.create_index(knowledge_id, rerank=rerank)
+            except ImportError as e:
+                logger.warning(f"跳过创建向量索引: {str(e)}")
+        
         return JsonResponse(
             ResponseCode.SUCCESS.to_dict(
                 message="知识库创建成功",
@@ -14,7 +14,9 @@ from zhiqing_server.utils.db_utils import (
     execute_query_with_params
 )
 
-from knowledge_mgt.utils.vector_store import VectorStore
+from knowledge_mgt.utils.vector_store import (
+    VectorStore, METRIC_COSINE, metric_for_embedding_model, normalize_search_filters
+)
 
 # 获取模块日志记录器
 logger = logging.getLogger('knowledge_mgt')
@@ -47,6 +49,15 @@ def recall_test(request):
         query = request_data.get('query')
         retrieve_count = request_data.get('retrieve_count', 5)
         similarity_threshold = request_data.get('similarity_threshold', 0.3)
+        # IVF索引的检索聚类数、HNSW索引的检索候选集大小，为空时使用知识库配置
+        nprobe = request_data.get('nprobe')
+        ef_search = request_data.get('ef_search')
+        if nprobe is not None and (not isinstance(nprobe, int) or nprobe <= 0):
+            return create_error_response('nprobe必须是正整数')
+        if ef_search is not None and (not isinstance(ef_search, int) or ef_search <= 0):
+            return create_error_response('ef_search必须是正整数')
+        # 按文档、文件类型、上传时间过滤检索范围
+        filters = normalize_search_filters(request_data.get('filters'))
         
         logger.debug(f"召回检索测试参数: knowledge_id={knowledge_id}, query='{query}', retrieve_count={retrieve_count}, similarity_threshold={similarity_threshold}")
         
@@ -80,6 +91,7 @@ def recall_test(request):
         try:
             # 1. 按知识库选择并加载对应嵌入模型
             from knowledge_mgt.utils.embeddings import local_embedding_manager, get_embedding_model_by_id
+            from knowledge_mgt.utils.query_embedding_cache import embed_query
             from system_mgt.utils.llms_manager import llms_manager
 
             embedding_model = None
@@ -97,17 +109,18 @@ def recall_test(request):
                 model_type = model_cfg.get('model_type')
 
                 if api_type == 'local':
-                    # 使用本地模型
-                    embedding_model = local_embedding_manager.load_model(embedding_model_id, model_cfg)
-                    logger.debug(f"已加载本地模型: id={embedding_model_id}, name={model_cfg.get('name')}")
-                    # 将查询转换为向量
-                    query_vector = embedding_model.embed_text(query)
-                    actual_dimension = embedding_model.get_dimension()
+                    # 使用本地模型，模型常驻在模型池中，使用期间不会被其他请求卸载
+                    with local_embedding_manager.use_model(embedding_model_id, model_cfg) as embedding_model:
+                        logger.debug(f"已加载本地模型: id={embedding_model_id}, name={model_cfg.get('name')}")
+                        # 将查询转换为向量
+                        query_vector = embed_query(embedding_model, query)
+                        actual_dimension = embedding_model.get_dimension()
                 else:
                     # 使用LlamaIndex在线/兼容模型
                     use_llamaindex = True
                     # 确保为该知识库加载对应模型
                     ok = llms_manager.ensure_knowledge_base_model_loaded(knowledge_id, {
+                        'id': embedding_model_id,
                         'name': model_cfg.get('name'),
                         'model_type': model_type,
                         'api_type': api_type,
@@ -124,7 +137,7 @@ def recall_test(request):
                         return create_error_response('在线嵌入模型未激活', 500)
                     # 生成查询向量（LlamaIndex接口）
                     try:
-                        query_vector = embed.get_text_embedding(query)
+                        query_vector = embed_query(embed, query, model_cfg)
                         actual_dimension = len(query_vector)
                     except Exception as e:
                         logger.error(f"在线模型生成向量失败: {e}")
@@ -135,7 +148,7 @@ def recall_test(request):
                 if embedding_model is None:
                     return create_error_response('没有加载的嵌入模型，请先在系统管理中加载嵌入模型', 500)
                 logger.debug("使用当前加载的本地嵌入模型进行向量检索（知识库未绑定模型）")
-                query_vector = embedding_model.embed_text(query)
+                query_vector = embed_query(embedding_model, query)
                 actual_dimension = embedding_model.get_dimension()
 
             # 2. query_vector 与 actual_dimension 已在上方生成
@@ -151,11 +164,11 @@ def recall_test(request):
                 with connection.cursor() as cursor:
                     cursor.execute("SELECT api_type, name FROM embedding_model WHERE id = %s", [embedding_model_id])
                     model_row = cursor.fetchone()
-                    if model_row and (model_row[0] == 'online' or 'dashscope' in model_row[1].lower()):
+                    if model_row and metric_for_embedding_model(model_row[0], model_row[1]) == METRIC_COSINE:
                         use_cosine = True  # 通义千问等在线模型通常用余弦相似度
             
             logger.info(f"调用向量存储搜索: knowledge_id={knowledge_id}, user_id={user_id}, role_id={role_id}, use_cosine={use_cosine}")
-            similar_chunks = vector_store.search(knowledge_id, query_vector, top_k=retrieve_count, user_id=user_id, role_id=role_id, use_cosine=use_cosine)
+            similar_chunks = vector_store.search(knowledge_id, query_vector, top_k=retrieve_count, user_id=user_id, role_id=role_id, use_cosine=use_cosine, nprobe=nprobe, filters=filters, ef_search=ef_search)
             logger.info(f"向量存储返回结果数量: {len(similar_chunks)}")
 
             # 5. 根据相似度阈值过滤结果
@@ -238,4 +251,200 @@ def recall_test(request):
         return create_error_response(str(e))
     except Exception as e:
         logger.error(f"召回检索测试异常: {str(e)}", exc_info=True)
-        return create_error_response(str(e), 500)
\ No newline at end of file
+        return create_error_response(str(e), 500)
+
+def _embed_queries(knowledge_id, embedding_model_id, queries):
+    """使用知识库绑定的嵌入模型批量生成查询向量
+
+    返回 (查询向量列表, 错误信息)，成功时错误信息为None。
+    """
+    from knowledge_mgt.utils.embeddings import local_embedding_manager, get_embedding_model_by_id
+    from system_mgt.utils.llms_manager import llms_manager
+
+    if not embedding_model_id:
+        # 未绑定则回退到当前本地模型
+        embedding_model = local_embedding_manager.get_current_model()
+        if embedding_model is None:
+            return None, '没有加载的嵌入模型，请先在系统管理中加载嵌入模型'
+        return list(embedding_model.embed_texts(queries, use_cache=False)), None
+
+    model_cfg = get_embedding_model_by_id(embedding_model_id)
+    if not model_cfg:
+        logger.error(f"嵌入模型不存在或不可用: id={embedding_model_id}")
+        return None, '知识库绑定的嵌入模型不存在或未启用'
+
+    if model_cfg.get('api_type') == 'local':
+        with local_embedding_manager.use_model(embedding_model_id, model_cfg) as embedding_model:
+            return list(embedding_model.embed_texts(queries, use_cache=False)), None
+
+    # 使用LlamaIndex在线/兼容模型
+    ok = llms_manager.ensure_knowledge_base_model_loaded(knowledge_id, {
+        'id': embedding_model_id,
+        'name': model_cfg.get('name'),
+        'model_type': model_cfg.get('model_type'),
+        'api_type': model_cfg.get('api_type'),
+        'api_key': model_cfg.get('api_key'),
+        'api_url': model_cfg.get('api_url'),
+        'model_name': model_cfg.get('model_name')
+    })
+    if not ok:
+        return None, '在线嵌入模型初始化失败，请检查配置或密钥'
+    llms_manager.set_active_knowledge_base(knowledge_id)
+    embed = llms_manager.get_current_embed_model()
+    if not embed:
+        return None, '在线嵌入模型未激活'
+    try:
+        # 查询文本不写入持久化嵌入缓存，绕过 CachedEmbedding 直接调用原模型
+        return getattr(embed, 'inner', embed).get_text_embedding_batch(queries), None
+    except Exception as e:
+        logger.error(f"在线模型生成向量失败: {e}")
+        return None, '在线模型生成向量失败'
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@jwt_required()
+def recall_batch_test(request):
+    """批量召回检索测试API，多个查询合并为一次向量检索"""
+    logger.info("批量召回检索测试请求")
+
+    try:
+        request_data = parse_json_body(request)
+
+        required_fields = ['knowledge_id', 'queries']
+        is_valid, missing_fields = validate_required_fields(request_data, required_fields)
+        if not is_valid:
+            logger.warning(f"批量召回检索测试失败: 缺少必填字段 - {missing_fields}")
+            return create_error_response(f"缺少必填字段: {', '.join(missing_fields)}")
+
+        queries = request_data.get('queries')
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(q, str) and q.strip() for q in queries):
+            return create_error_response('queries必须是非空字符串组成的列表')
+
+        user_info = get_user_from_request(request)
+        user_id = user_info.get('user_id')
+        role_id = user_info.get('role_id')
+
+        knowledge_id = request_data.get('knowledge_id')
+        retrieve_count = request_data.get('retrieve_count', 5)
+        similarity_threshold = request_data.get('similarity_threshold', 0.3)
+        nprobe = request_data.get('nprobe')
+        ef_search = request_data.get('ef_search')
+        if nprobe is not None and (not isinstance(nprobe, int) or nprobe <= 0):
+            return create_error_response('nprobe必须是正整数')
+        if ef_search is not None and (not isinstance(ef_search, int) or ef_search <= 0):
+            return create_error_response('ef_search必须是正整数')
+        filters = normalize_search_filters(request_data.get('filters'))
+
+        kb_sql = """
+            SELECT id, name, index_type, embedding_model_id
+            FROM knowledge_database
+            WHERE id = %s
+        """
+        kb_params = [knowledge_id]
+        if role_id != 1:
+            kb_sql += " AND user_id = %s"
+            kb_params.append(user_id)
+
+        kb_result = execute_query_with_params(kb_sql, kb_params)
+        if not kb_result:
+            logger.warning(f"批量召回检索测试失败: 知识库{knowledge_id}不存在或无权限访问")
+            return create_error_response('知识库不存在或无权限访问', 404)
+
+        knowledge_info = kb_result[0]
+        knowledge_name = knowledge_info['name']
+        embedding_model_id = knowledge_info.get('embedding_model_id')
+
+        try:
+            query_vectors, error = _embed_queries(knowledge_id, embedding_model_id, queries)
+            if error:
+                return create_error_response(error, 500)
+
+            use_cosine = False
+            if embedding_model_id:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT api_type, name FROM embedding_model WHERE id = %s", [embedding_model_id])
+                    model_row = cursor.fetchone()
+                    if model_row and metric_for_embedding_model(model_row[0], model_row[1]) == METRIC_COSINE:
+                        use_cosine = True
+
+            vector_store = VectorStore(vector_dimension=len(query_vectors[0]), index_type=knowledge_info['index_type'])
+            batch_chunks = vector_store.search_batch(knowledge_id, query_vectors, top_k=retrieve_count,
+                                                     user_id=user_id, role_id=role_id, use_cosine=use_cosine,
+                                                     nprobe=nprobe, filters=filters, ef_search=ef_search)
+            if not batch_chunks:
+                batch_chunks = [[] for _ in queries]
+
+            # 按相似度阈值过滤每个查询的结果
+            filtered_batches = []
+            for similar_chunks in batch_chunks:
+                filtered_chunks = []
+                for chunk in similar_chunks:
+                    distance = chunk['distance']
+                    if use_cosine:
+                        similarity_score = distance
+                    else:
+                        similarity_score = 1.0 / (1.0 + distance) if distance >= 0 else 0.0
+                    if similarity_score >= similarity_threshold:
+                        chunk['similarity'] = similarity_score
+                        filtered_chunks.append(chunk)
+                filtered_batches.append(filtered_chunks)
+
+            # 所有查询命中的分块通过一次IN查询取回内容
+            chunk_dict = {}
+            chunk_ids = sorted({chunk['chunk_id'] for chunks in filtered_batches for chunk in chunks})
+            if chunk_ids:
+                placeholders = ','.join(['%s'] * len(chunk_ids))
+                chunk_sql = f"""
+                    SELECT dc.id, dc.content, d.filename
+                    FROM knowledge_document_chunk dc
+                    JOIN knowledge_document d ON dc.document_id = d.id
+                    WHERE dc.id IN ({placeholders}) AND d.database_id = %s
+                """
+                chunk_params = chunk_ids + [knowledge_id]
+                if role_id != 1:
+                    chunk_sql += " AND d.user_id = %s"
+                    chunk_params.append(user_id)
+                chunk_dict = {chunk['id']: chunk for chunk in execute_query_with_params(chunk_sql, chunk_params)}
+
+            query_results = []
+            for query, similar_chunks, filtered_chunks in zip(queries, batch_chunks, filtered_batches):
+                results = []
+                for filtered_chunk in filtered_chunks:
+                    chunk_data = chunk_dict.get(filtered_chunk['chunk_id'])
+                    if chunk_data:
+                        results.append({
+                            'chunk_id': filtered_chunk['chunk_id'],
+                            'content': chunk_data['content'],
+                            'filename': chunk_data['filename'],
+                            'similarity': filtered_chunk['similarity'],
+                            'distance': filtered_chunk['distance'],
+                            'metadata': None
+                        })
+                query_results.append({
+                    'query': query,
+                    'results': results,
+                    'total_found': len(similar_chunks),
+                    'filtered_count': len(filtered_chunks)
+                })
+
+            logger.info(f"批量召回检索测试完成，共 {len(queries)} 个查询")
+
+            return create_success_response({
+                'queries': query_results,
+                'knowledge_base': knowledge_name,
+                'retrieve_count': retrieve_count,
+                'similarity_threshold': similarity_threshold
+            })
+
+        except Exception as vector_error:
+            logger.error(f"批量向量检索失败: {str(vector_error)}", exc_info=True)
+            return create_error_response(f"向量检索失败: {str(vector_error)}", 500)
+
+    except ValueError as e:
+        logger.error(f"批量召回检索测试数据解析错误: {str(e)}", exc_info=True)
+        return create_error_response(str(e))
+    except Exception as e:
+        logger.error(f"批量召回检索测试异常: {str(e)}", exc_info=True)
+        return create_error_response(str(e), 500)
@@ -24,7 +24,7 @@ from zhiqing_server.utils.auth_utils import (
 )
 from zhiqing_server.utils.db_utils import execute_query_with_params
 from knowledge_mgt.utils.document_processor import get_document_processor, get_supported_formats
-from knowledge_mgt.utils.vector_store import VectorStore
+from knowledge_mgt.utils.vector_store import VectorStore, metric_for_embedding_model
 from knowledge_mgt.utils.text_filter import TextFilter
 from knowledge_mgt.models import StopWord, SensitiveWord
 
@@ -701,6 +701,46 @@ def get_queue_status(request):
         return create_error_response(str(e), 500)
 
 
+def embed_texts_in_batches(embedding_model, texts, batch_size, progress_callback=None):
+    """按batch_size分批生成向量，返回与texts一一对应的向量列表，生成失败的位置为None
+
+    LlamaIndex嵌入模型使用 _get_text_embeddings，本地 EmbeddingModel 使用 embed_texts，
+    本地模型每批做一次前向计算，在线模型每批一次请求。整批失败时逐条重试，单个分块出错不影响同批其他分块。
+    progress_callback(已完成数, 总数) 在每批完成后调用。
+    """
+    batch_size = max(1, int(batch_size or 32))
+    # get_text_embedding_batch 会按模型的 embed_batch_size 再次切分，而模型实例由多个知识库共享，
+    # 不能修改该属性；这里已按batch_size切分，每批直接交给模型的批量实现
+    batch_embed = getattr(embedding_model, '_get_text_embeddings', None)
+    single_embed = getattr(embedding_model, 'get_text_embedding', None) or embedding_model.embed_text
+    return _embed_batches(embedding_model, texts, batch_size, batch_embed, single_embed, progress_callback)
+
+
+def _embed_batches(embedding_model, texts, batch_size, batch_embed, single_embed, progress_callback):
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        try:
+            if batch_embed is not None:
+                batch_vectors = batch_embed(batch)
+            else:
+                batch_vectors = embedding_model.embed_texts(batch, batch_size=batch_size)
+            if len(batch_vectors) != len(batch):
+                raise ValueError(f"返回 {len(batch_vectors)} 个向量，预期 {len(batch)} 个")
+            vectors.extend(batch_vectors)
+        except Exception as e:
+            logger.warning(f"分块 {start + 1}-{start + len(batch)} 批量生成向量失败，逐条重试: {e}")
+            for offset, text in enumerate(batch):
+                try:
+                    vectors.append(single_embed(text))
+                except Exception as item_error:
+                    logger.error(f"分块 {start + offset + 1} 生成向量失败: {item_error}")
+                    vectors.append(None)
+        if progress_callback:
+            progress_callback(len(vectors), len(texts))
+    return vectors
+
+
 def process_upload_task(task_id):
     """处理上传任务的后台函数 - 优化版本，支持连贯进度更新"""
     global current_processing_task
@@ -776,7 +816,7 @@ def process_upload_task(task_id):
             with connection.cursor() as cursor:
                 cursor.execute("""
                     SELECT em.id, em.name, em.model_type, em.api_type, em.api_key, em.api_url, 
-                           em.model_name, em.local_path, em.vector_dimension
+                           em.model_name, em.local_path, em.vector_dimension, em.batch_size
                     FROM embedding_model em
                     INNER JOIN knowledge_database kb ON kb.embedding_model_id = em.id
                     WHERE kb.id = %s
@@ -796,7 +836,8 @@ def process_upload_task(task_id):
                     'api_url': model_config[5],
                     'model_name': model_config[6],
                     'local_path': model_config[7],
-                    'vector_dimension': model_config[8]
+                    'vector_dimension': model_config[8],
+                    'batch_size': model_config[9]
                 }
             
             # 按需加载知识库对应的embedding模型
@@ -821,7 +862,12 @@ def process_upload_task(task_id):
             # 初始化向量存储
             # 从模型配置获取向量维度
             actual_dimension = model_config_dict['vector_dimension']
-            vector_store = VectorStore(vector_dimension=actual_dimension, index_type=kb_info['index_type'])
+            # 度量方式仅在首次创建索引时生效，已有索引沿用原配置
+            vector_store = VectorStore(
+                vector_dimension=actual_dimension,
+                index_type=kb_info['index_type'],
+                metric=metric_for_embedding_model(model_config_dict['api_type'], model_config_dict['name'])
+            )
             
             # 更新进度：向量存储初始化完成 (55%)
             update_task_status(task_id, 'processing', 55, 
@@ -939,28 +985,39 @@ def process_upload_task(task_id):
                 update_task_status(task_id, 'processing', 88, 
                                  status_message=f"正在为 {len(filtered_chunks)} 个分块生成向量...")
                 
-                # 使用LlamaIndex的embedding模型生成向量（基于过滤后的内容）
-                vectors = []
-                for i, chunk_text in enumerate(filtered_chunks):
-                    try:
-                        vector = embedding_model.get_text_embedding(chunk_text)
-                        vectors.append(vector)
-                        
-                        # 实时更新进度：每处理5个分块更新一次
-                        if (i + 1) % 5 == 0 or i == len(filtered_chunks) - 1:
-                            progress = 88 + int((i + 1) / len(filtered_chunks) * 8)
-                            update_task_status(task_id, 'processing', progress, 
-                                             status_message=f"向量生成进度: {i + 1}/{len(filtered_chunks)} 分块")
-                        
-                    except Exception as e:
-                        logger.error(f"生成向量失败: {str(e)}")
-                        raise Exception(f"生成向量失败: {str(e)}")
+                # 按模型配置的batch_size分批生成向量（基于过滤后的内容）
+                def report_embedding_progress(done, total):
+                    progress = 88 + int(done / total * 8)
+                    update_task_status(task_id, 'processing', progress,
+                                       status_message=f"向量生成进度: {done}/{total} 分块")
+
+                vectors = embed_texts_in_batches(embedding_model, filtered_chunks,
+                                                 model_config_dict['batch_size'], report_embedding_progress)
+
+                # 逐条重试后仍失败的分块不写入向量索引，分块记录保留但没有向量ID
+                failed_positions = [i for i, vector in enumerate(vectors) if vector is None]
+                if len(failed_positions) == len(vectors):
+                    raise Exception("生成向量失败: 全部分块都未能生成向量")
+                if failed_positions:
+                    logger.warning(f"任务 {task_id} 有 {len(failed_positions)} 个分块生成向量失败，已跳过: "
+                                   f"{[i + 1 for i in failed_positions]}")
+                embedded_chunk_ids = [chunk_id for chunk_id, vector in zip(chunk_ids, vectors) if vector is not None]
+                vectors = [vector for vector in vectors if vector is not None]
                 
                 # 更新进度：向量生成完成 (96%)
                 update_task_status(task_id, 'processing', 96, 
                                  status_message="向量生成完成，正在存储到向量数据库...")
                 
-                vector_ids = vector_store.add_vectors(task_info['database_id'], chunk_ids, vectors)
+                vector_ids = vector_store.add_vectors(
+                    task_info['database_id'], embedded_chunk_ids, vectors,
+                    chunk_attributes={
+                        'document_id': document_id,
+                        'file_type': os.path.splitext(task_info['filename'])[1]
+                    }
+                )
+                if not vector_ids:
+                    # 例如向量维度与知识库索引不一致，回滚本次上传的文档记录
+                    raise Exception("写入向量索引失败，请检查嵌入模型维度是否与知识库一致")
                 
                 # 更新进度：向量存储完成 (98%)
                 update_task_status(task_id, 'processing', 98, 
@@ -968,8 +1025,8 @@ def process_upload_task(task_id):
                 
                 # 4. 更新分块的向量ID
                 if vector_ids:
-                    for i, chunk_id in enumerate(chunk_ids):
-                        vector_id = i if i < len(vector_ids) else None
+                    for i, chunk_id in enumerate(embedded_chunk_ids):
+                        vector_id = vector_ids[i] if i < len(vector_ids) else None
                         if vector_id is not None:
                             with connection.cursor() as cursor:
                                 cursor.execute("""
@@ -15,9 +15,9 @@ from zhiqing_server.utils.auth_utils import (
     create_error_response, create_success_response
 )
 from zhiqing_server.utils.db_utils import (
-    execute_query_with_params
+    execute_query_with_params, execute_update_with_params
 )
-from knowledge_mgt.utils.vector_store import VectorStore
+from knowledge_mgt.utils.vector_store import VectorStore, SUPPORTED_INDEX_TYPES, normalize_index_type
 
 # 获取模块日志记录器
 logger = logging.getLogger('knowledge_mgt')
@@ -43,8 +43,10 @@ def get_vector_index_info(request):
         # 初始化向量存储
         vector_store = VectorStore()
         
-        # 获取索引信息（包含权限验证）
-        index_info = vector_store.get_index_info(knowledge_db_id, user_id=user_id, role_id=role_id)
+        # 获取索引信息（包含权限验证），estimate_recall=1时抽样估计召回率
+        estimate_recall = request.GET.get('estimate_recall') in ('1', 'true', 'True')
+        index_info = vector_store.get_index_info(knowledge_db_id, user_id=user_id, role_id=role_id,
+                                                 estimate_recall=estimate_recall)
         
         if index_info is None:
             return create_error_response('索引不存在或无权限访问', 404)
@@ -133,7 +135,11 @@ def list_user_vector_indexes(request):
 @csrf_exempt
 @jwt_required()
 def rebuild_vector_index(request):
-    """重建向量索引"""
+    """重建向量索引
+
+    默认直接读取磁盘上保存的向量重建，可同时通过index_type更换索引类型；
+    磁盘上没有可用向量或reembed为true时，才用当前嵌入模型重新生成全部分块的向量。
+    """
     try:
         # 解析请求数据
         request_data = parse_json_body(request)
@@ -150,6 +156,12 @@ def rebuild_vector_index(request):
         role_id = user_info.get('role_id')
         
         knowledge_db_id = request_data.get('knowledge_db_id')
+        reembed = bool(request_data.get('reembed', False))
+        index_type = request_data.get('index_type')
+        if index_type is not None:
+            index_type = normalize_index_type(index_type)
+            if index_type not in SUPPORTED_INDEX_TYPES:
+                return create_error_response(f"不支持的索引类型，可选: {', '.join(SUPPORTED_INDEX_TYPES)}")
         
         # 获取知识库信息
         kb_sql = """
@@ -170,6 +182,26 @@ def rebuild_vector_index(request):
         
         kb_info = kb_result[0]
         
+        # 优先使用磁盘上保存的向量重建，无需重新生成embedding
+        vector_store = VectorStore(vector_dimension=kb_info['vector_dimension'], index_type=kb_info['index_type'])
+        if not reembed and vector_store.has_stored_vectors(knowledge_db_id):
+            success = vector_store.rebuild_from_disk(knowledge_db_id, index_type=index_type, user_id=user_id,
+                                                     role_id=role_id)
+            if not success:
+                return create_error_response('向量索引重建失败', 500)
+            if index_type and index_type != kb_info['index_type']:
+                execute_update_with_params(
+                    "UPDATE knowledge_database SET index_type = %s WHERE id = %s", [index_type, knowledge_db_id]
+                )
+            info = vector_store.get_index_info(knowledge_db_id) or {}
+            return create_success_response({
+                'message': '向量索引重建成功',
+                'knowledge_db_id': knowledge_db_id,
+                'index_type': index_type or kb_info['index_type'],
+                'total_vectors': info.get('total_vectors'),
+                'reembedded': False
+            })
+        
         # 获取所有文档分块
         chunks_sql = """
             SELECT dc.id, dc.content
@@ -204,21 +236,28 @@ def rebuild_vector_index(request):
         # 重建索引
         vector_store = VectorStore(
             vector_dimension=embedding_model.get_dimension(),
-            index_type=kb_info['index_type']
+            index_type=index_type or kb_info['index_type']
         )
         
         success = vector_store.rebuild_index(
             knowledge_db_id, 
             vectors, 
             user_id=user_id, 
-            role_id=role_id
+            role_id=role_id,
+            chunk_ids=[chunk['id'] for chunk in chunks_result]
         )
         
         if success:
+            if index_type and index_type != kb_info['index_type']:
+                execute_update_with_params(
+                    "UPDATE knowledge_database SET index_type = %s WHERE id = %s", [index_type, knowledge_db_id]
+                )
             return create_success_response({
                 'message': '向量索引重建成功',
                 'knowledge_db_id': knowledge_db_id,
-                'total_vectors': len(vectors)
+                'index_type': index_type or kb_info['index_type'],
+                'total_vectors': len(vectors),
+                'reembedded': True
             })
         else:
             return create_error_response('向量索引重建失败', 500)
@@ -228,6 +267,68 @@ def rebuild_vector_index(request):
         return create_error_response(f"重建向量索引失败: {str(e)}", 500)
 
 
+@require_http_methods(["POST"])
+@csrf_exempt
+@jwt_required()
+def migrate_vector_index(request):
+    """在后台把知识库索引迁移为指定类型，迁移期间原索引继续提供检索"""
+    try:
+        # 解析请求数据
+        request_data = parse_json_body(request)
+        
+        # 验证必填字段
+        required_fields = ['knowledge_db_id', 'index_type']
+        is_valid, missing_fields = validate_required_fields(request_data, required_fields)
+        if not is_valid:
+            return create_error_response(f"缺少必填字段: {', '.join(missing_fields)}")
+        
+        # 获取用户信息
+        user_info = get_user_from_request(request)
+        user_id = user_info.get('user_id')
+        role_id = user_info.get('role_id')
+        
+        knowledge_db_id = request_data.get('knowledge_db_id')
+        index_type = normalize_index_type(request_data.get('index_type'))
+        if index_type not in SUPPORTED_INDEX_TYPES:
+            return create_error_response(f"不支持的索引类型，可选: {', '.join(SUPPORTED_INDEX_TYPES)}")
+        
+        # 获取知识库信息
+        kb_sql = """
+            SELECT id, name, vector_dimension, index_type
+            FROM knowledge_database 
+            WHERE id = %s AND status = 1
+        """
+        kb_params = [knowledge_db_id]
+        
+        # 普通用户只能访问自己的知识库
+        if role_id != 1:
+            kb_sql += " AND user_id = %s"
+            kb_params.append(user_id)
+        
+        kb_result = execute_query_with_params(kb_sql, kb_params)
+        if not kb_result:
+            return create_error_response('知识库不存在或无权限访问', 404)
+        
+        kb_info = kb_result[0]
+        if normalize_index_type(kb_info['index_type']) == index_type:
+            return create_error_response(f'知识库索引已是 {index_type}')
+        
+        vector_store = VectorStore(vector_dimension=kb_info['vector_dimension'], index_type=kb_info['index_type'])
+        started = vector_store.schedule_migration(knowledge_db_id, index_type)
+        
+        return create_success_response({
+            'message': '索引迁移已在后台启动' if started else '该知识库已有正在进行的索引迁移',
+            'knowledge_db_id': knowledge_db_id,
+            'from_index_type': kb_info['index_type'],
+            'index_type': index_type,
+            'started': started
+        })
+        
+    except Exception as e:
+        logger.error(f"启动索引迁移失败: {str(e)}", exc_info=True)
+        return create_error_response(f"启动索引迁移失败: {str(e)}", 500)
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
 @jwt_required()
@@ -315,6 +416,111 @@ def delete_vectors(request):
         return create_error_response(f"删除向量失败: {str(e)}", 500)
 
 
+@require_http_methods(["POST"])
+@csrf_exempt
+@jwt_required()
+def update_vector_search_config(request):
+    """更新知识库的向量检索参数（IVF索引的nprobe、HNSW索引的ef_search）"""
+    try:
+        # 解析请求数据
+        request_data = parse_json_body(request)
+        
+        # 验证必填字段
+        required_fields = ['knowledge_db_id']
+        is_valid, missing_fields = validate_required_fields(request_data, required_fields)
+        if not is_valid:
+            return create_error_response(f"缺少必填字段: {', '.join(missing_fields)}")
+        
+        # 获取用户信息
+        user_info = get_user_from_request(request)
+        user_id = user_info.get('user_id')
+        role_id = user_info.get('role_id')
+        
+        knowledge_db_id = request_data.get('knowledge_db_id')
+        nprobe = request_data.get('nprobe')
+        ef_search = request_data.get('ef_search')
+        
+        if nprobe is None and ef_search is None:
+            return create_error_response('nprobe和ef_search至少需要提供一个')
+        if nprobe is not None and (not isinstance(nprobe, int) or nprobe <= 0):
+            return create_error_response('nprobe必须是正整数')
+        if ef_search is not None and (not isinstance(ef_search, int) or ef_search <= 0):
+            return create_error_response('ef_search必须是正整数')
+        
+        # 初始化向量存储
+        vector_store = VectorStore()
+        
+        # 更新检索参数（包含权限验证）
+        success = vector_store.update_search_config(knowledge_db_id, nprobe=nprobe, user_id=user_id, role_id=role_id,
+                                                    ef_search=ef_search)
+        
+        if success:
+            return create_success_response({
+                'message': '检索参数更新成功',
+                'knowledge_db_id': knowledge_db_id,
+                'nprobe': nprobe,
+                'ef_search': ef_search
+            })
+        else:
+            return create_error_response('检索参数更新失败', 500)
+        
+    except Exception as e:
+        logger.error(f"更新检索参数失败: {str(e)}", exc_info=True)
+        return create_error_response(f"更新检索参数失败: {str(e)}", 500)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@jwt_required()
+def tune_vector_search_config(request):
+    """按目标召回率自动调优知识库的检索参数并保存"""
+    try:
+        # 解析请求数据
+        request_data = parse_json_body(request)
+        
+        # 验证必填字段
+        required_fields = ['knowledge_db_id']
+        is_valid, missing_fields = validate_required_fields(request_data, required_fields)
+        if not is_valid:
+            return create_error_response(f"缺少必填字段: {', '.join(missing_fields)}")
+        
+        # 获取用户信息
+        user_info = get_user_from_request(request)
+        user_id = user_info.get('user_id')
+        role_id = user_info.get('role_id')
+        
+        knowledge_db_id = request_data.get('knowledge_db_id')
+        target_recall = request_data.get('target_recall', 0.95)
+        sample_size = request_data.get('sample_size', 200)
+        top_k = request_data.get('top_k', 10)
+        
+        if not isinstance(target_recall, (int, float)) or not 0 < target_recall <= 1:
+            return create_error_response('target_recall必须在(0, 1]之间')
+        if not isinstance(sample_size, int) or not 0 < sample_size <= 10000:
+            return create_error_response('sample_size必须是1到10000之间的整数')
+        if not isinstance(top_k, int) or top_k <= 0:
+            return create_error_response('top_k必须是正整数')
+        
+        # 初始化向量存储
+        vector_store = VectorStore()
+        
+        # 调优检索参数（包含权限验证）
+        result = vector_store.tune_search_params(knowledge_db_id, target_recall=target_recall, sample_size=sample_size,
+                                                 k=top_k, user_id=user_id, role_id=role_id)
+        
+        if result is None:
+            return create_error_response('检索参数调优失败', 500)
+        if result['value'] is None:
+            result['message'] = '该索引为精确检索或尚未训练，无需调优'
+        else:
+            result['message'] = '检索参数调优完成'
+        return create_success_response(result)
+        
+    except Exception as e:
+        logger.error(f"检索参数调优失败: {str(e)}", exc_info=True)
+        return create_error_response(f"检索参数调优失败: {str(e)}", 500)
+
+
 @require_http_methods(["GET"])
 @csrf_exempt
 @jwt_required()
@@ -0,0 +1,57 @@
+"""
+将已有知识库的向量索引离线转换为指定度量方式（默认转换为余弦内积索引）
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_mgt.utils.vector_store import VectorStore, METRIC_L2, METRIC_COSINE
+
+
+class Command(BaseCommand):
+    help = '将向量索引转换为余弦（归一化内积）或L2度量，转换期间向量ID保持不变'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--knowledge-db-id',
+            type=int,
+            action='append',
+            help='要转换的知识库ID，可重复指定'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='转换全部知识库'
+        )
+        parser.add_argument(
+            '--metric',
+            choices=[METRIC_COSINE, METRIC_L2],
+            default=METRIC_COSINE,
+            help='目标度量方式，默认cosine'
+        )
+
+    def handle(self, *args, **options):
+        vector_dir = os.path.join(settings.MEDIA_ROOT, 'vector_indexes')
+        if options.get('knowledge_db_id'):
+            kb_dirs = [str(kb_id) for kb_id in options['knowledge_db_id']]
+        elif options.get('all'):
+            kb_dirs = sorted(os.listdir(vector_dir)) if os.path.isdir(vector_dir) else []
+        else:
+            raise CommandError('请通过 --knowledge-db-id 指定知识库，或使用 --all 转换全部知识库')
+
+        metric = options['metric']
+        vector_store = VectorStore()
+        converted = 0
+        for kb_dir in kb_dirs:
+            if not os.path.isdir(os.path.join(vector_dir, kb_dir)):
+                self.stderr.write(f'知识库 {kb_dir}: 索引目录不存在')
+                continue
+            if vector_store.convert_metric(kb_dir, metric):
+                converted += 1
+                self.stdout.write(f'知识库 {kb_dir}: 已转换为 {metric}')
+            else:
+                self.stderr.write(f'知识库 {kb_dir}: 转换失败，详见日志')
+
+        self.stdout.write(self.style.SUCCESS(f'共处理 {converted} 个知识库'))
@@ -0,0 +1,46 @@
+"""
+将旧版 media/vector_indexes/<知识库ID>/id_mapping.json 一次性迁移为 id_mapping.npy
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from knowledge_mgt.utils.vector_store import migrate_id_mapping
+
+
+class Command(BaseCommand):
+    help = '将向量索引的JSON格式ID映射迁移为int64数组格式（id_mapping.npy）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--knowledge-db-id',
+            type=int,
+            help='只迁移指定知识库，默认迁移全部知识库'
+        )
+
+    def handle(self, *args, **options):
+        vector_dir = os.path.join(settings.MEDIA_ROOT, 'vector_indexes')
+        if not os.path.isdir(vector_dir):
+            self.stdout.write('向量索引目录不存在，无需迁移')
+            return
+
+        if options.get('knowledge_db_id') is not None:
+            kb_dirs = [str(options['knowledge_db_id'])]
+        else:
+            kb_dirs = sorted(os.listdir(vector_dir))
+
+        migrated = 0
+        for kb_dir in kb_dirs:
+            db_vector_dir = os.path.join(vector_dir, kb_dir)
+            if not os.path.isdir(db_vector_dir):
+                continue
+            try:
+                if migrate_id_mapping(db_vector_dir):
+                    migrated += 1
+                    self.stdout.write(f'知识库 {kb_dir}: 迁移完成')
+            except Exception as e:
+                self.stderr.write(f'知识库 {kb_dir}: 迁移失败 - {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'共迁移 {migrated} 个知识库的ID映射'))
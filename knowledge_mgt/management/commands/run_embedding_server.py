@@ -0,0 +1,62 @@
+"""
+启动本机嵌入服务：由本进程持有本地嵌入模型，工作进程通过OpenAI兼容的 /v1/embeddings 接口推理
+"""
+
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_mgt.utils.embedding_server import create_server
+
+
+class Command(BaseCommand):
+    help = '启动本机嵌入服务，配置 EMBEDDING_SERVER_URL 后各进程的本地嵌入模型推理都经由该服务执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind',
+            help='监听地址，http://主机:端口 或 unix:///socket路径，默认使用 EMBEDDING_SERVER_URL'
+        )
+        parser.add_argument(
+            '--preload',
+            type=int,
+            nargs='*',
+            default=[],
+            help='启动时预先加载的嵌入模型ID'
+        )
+
+    def handle(self, *args, **options):
+        url = options.get('bind') or getattr(settings, 'EMBEDDING_SERVER_URL', '')
+        if not url:
+            raise CommandError('请通过 --bind 或 EMBEDDING_SERVER_URL 指定监听地址')
+
+        try:
+            server = create_server(url)
+        except (RuntimeError, OSError) as e:
+            raise CommandError(str(e))
+
+        from knowledge_mgt.utils.embeddings import local_embedding_manager, get_embedding_model_by_id
+        for model_id in options.get('preload') or []:
+            model_config = get_embedding_model_by_id(model_id)
+            if not model_config or model_config.get('api_type') != 'local':
+                self.stdout.write(self.style.WARNING(f'嵌入模型 {model_id} 不存在或不是本地模型，跳过预加载'))
+                continue
+            with local_embedding_manager.use_model(model_id, model_config) as embedding_model:
+                embedding_model.embed_text('预热')
+            self.stdout.write(f'已预加载嵌入模型 {model_id}')
+
+        def stop(signum, frame):
+            # shutdown会等待serve_forever退出，不能在同一线程中调用
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        self.stdout.write(self.style.SUCCESS(f'嵌入服务已启动: {url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('嵌入服务已停止')
@@ -0,0 +1,45 @@
+"""
+启动本机向量服务：由本进程持有全部知识库索引并串行化写入，工作进程通过Unix socket访问
+"""
+
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_mgt.utils.vector_service import VectorServiceServer
+
+
+class Command(BaseCommand):
+    help = '启动本机向量服务，配置 VECTOR_SERVICE_SOCKET 后web工作进程的向量检索与写入都经由该服务执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            help='Unix socket路径，默认使用 VECTOR_SERVICE_SOCKET'
+        )
+
+    def handle(self, *args, **options):
+        socket_path = options.get('socket') or getattr(settings, 'VECTOR_SERVICE_SOCKET', '')
+        if not socket_path:
+            raise CommandError('请通过 --socket 或 VECTOR_SERVICE_SOCKET 指定Unix socket路径')
+
+        try:
+            server = VectorServiceServer(socket_path)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        def stop(signum, frame):
+            # shutdown会等待serve_forever退出，不能在同一线程中调用
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        self.stdout.write(self.style.SUCCESS(f'向量服务已启动: {socket_path}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('向量服务已停止')
@@ -0,0 +1,31 @@
+"""
+预热热门知识库：按最近的会话访问量加载向量索引和绑定的本地嵌入模型，并各执行一次空查询
+"""
+
+from django.core.management.base import BaseCommand
+
+from knowledge_mgt.utils.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = '按最近的会话访问量预热最常用知识库的向量索引和嵌入模型'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='预热的知识库数量，默认使用 VECTOR_WARMUP_KB_LIMIT'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='统计最近多少天的会话，默认使用 VECTOR_WARMUP_DAYS'
+        )
+
+    def handle(self, *args, **options):
+        state = warm_up(options.get('limit'), options.get('days'))
+        for error in state['errors']:
+            self.stdout.write(self.style.WARNING(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"预热完成: 知识库 {state['knowledge_bases']}，嵌入模型 {state['models']}"
+        ))
@@ -30,9 +30,12 @@ urlpatterns = [
     path('vector/index-info/', vector_management_views.get_vector_index_info, name='get_vector_index_info'),
     path('vector/list-indexes/', vector_management_views.list_user_vector_indexes, name='list_user_vector_indexes'),
     path('vector/rebuild-index/', vector_management_views.rebuild_vector_index, name='rebuild_vector_index'),
+    path('vector/migrate-index/', vector_management_views.migrate_vector_index, name='migrate_vector_index'),
     path('vector/cleanup-index/', vector_management_views.cleanup_vector_index, name='cleanup_vector_index'),
     path('vector/delete-vectors/', vector_management_views.delete_vectors, name='delete_vectors'),
     path('vector/statistics/', vector_management_views.get_vector_statistics, name='get_vector_statistics'),
+    path('vector/search-config/', vector_management_views.update_vector_search_config, name='update_vector_search_config'),
+    path('vector/search-config/tune/', vector_management_views.tune_vector_search_config, name='tune_vector_search_config'),
     
     # 文档上传任务队列API
     path('upload-task/create/', upload_task_views.create_upload_task, name='create_upload_task'),
@@ -48,6 +51,7 @@ urlpatterns = [
     
     # 召回检索测试API
     path('recall/test', recall_views.recall_test, name='recall_test_api'),
+    path('recall/batch-test', recall_views.recall_batch_test, name='recall_batch_test_api'),
 
     # 网页抓取与导入API
     path('web-crawl/create/', document_views.create_web_crawl, name='create_web_crawl'),
@@ -6,7 +6,6 @@ import fitz  # PyMuPDF
 import docx
 import uuid
 import numpy as np
-import faiss
 import pickle
 import json
 from datetime import datetime
@@ -15,6 +14,12 @@ from django.conf import settings
 
 logger = logging.getLogger('knowledge_mgt')
 
+try:
+    import faiss
+except ImportError:
+    # 未安装FAISS时向量存储使用NumPy检索后端，本模块中基于FAISS的旧接口不可用
+    faiss = None
+
 
 class DocumentProcessor:
     """文档处理类，用于解析不同类型的文档并分块"""
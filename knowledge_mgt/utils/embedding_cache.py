@@ -0,0 +1,297 @@
+"""
+嵌入向量持久化缓存模块
+以 (嵌入模型, 规范化文本哈希) 为键把生成过的向量以float16保存在本地SQLite中，
+重新上传修改后的文档、重建向量索引、批量查重时，未变化的分块直接读取缓存，只为变化的分块生成向量。
+多个进程共享同一个缓存文件（WAL模式），总大小超过上限时按最近使用时间淘汰。
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_DTYPE = np.float16
+# 命中时最近使用时间超过该秒数才更新，避免每次读取都产生写入
+TOUCH_INTERVAL = 3600
+# 超过大小上限时一次淘汰的比例
+EVICT_FRACTION = 0.1
+# 每写入多少条检查一次缓存大小
+SIZE_CHECK_EVERY = 1000
+# SQLite单条语句的参数数量上限较低，按批查询
+QUERY_BATCH = 500
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """规范化文本：Unicode NFC、合并连续空白并去掉首尾空白，仅空白不同的文本共用缓存"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_hash(text):
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+def embedding_model_key(model_config):
+    """缓存中区分嵌入模型的键：模型ID加模型配置摘要
+
+    同一ID的模型被修改为其他模型名称、路径或接口地址后，摘要随之变化，不会读到旧模型生成的向量。
+    """
+    model_config = model_config or {}
+    signature = '|'.join(str(model_config.get(key) or '') for key in
+                         ('model_type', 'model_name', 'local_path', 'api_url'))
+    digest = hashlib.blake2b(signature.encode('utf-8'), digest_size=6).hexdigest()
+    return f"{model_config.get('id') or 0}:{digest}"
+
+
+class EmbeddingCache:
+    """基于SQLite的嵌入向量缓存，线程安全，每个线程（以及fork后的子进程）使用独立连接
+
+    缓存读写失败只记录警告并按未命中处理，不影响向量生成。
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model_key TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model_key, text_hash)
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, model_key, texts):
+        """查询一组文本的缓存向量，返回与texts一一对应的列表，未命中的位置为None"""
+        results = [None] * len(texts)
+        if not texts:
+            return results
+        try:
+            hashes = [text_hash(text) for text in texts]
+            positions = {}
+            for i, digest in enumerate(hashes):
+                positions.setdefault(digest, []).append(i)
+            conn = self._connection()
+            now = time.time()
+            stale = []
+            unique = list(positions)
+            for start in range(0, len(unique), QUERY_BATCH):
+                batch = unique[start:start + QUERY_BATCH]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector, last_used FROM embedding_cache "
+                    f"WHERE model_key = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model_key, *batch]
+                ).fetchall()
+                for digest, blob, last_used in rows:
+                    vector = np.frombuffer(blob, dtype=CACHE_DTYPE).astype('float32').tolist()
+                    for i in positions[bytes(digest)]:
+                        results[i] = vector
+                    if now - last_used > TOUCH_INTERVAL:
+                        stale.append(digest)
+            if stale:
+                conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE model_key = ? AND text_hash = ?",
+                                 [(now, model_key, digest) for digest in stale])
+        except Exception as e:
+            logger.warning(f"读取嵌入缓存失败: {str(e)}")
+        return results
+
+    def put_many(self, model_key, texts, vectors):
+        """写入一组文本的向量，已存在的键被覆盖"""
+        if not texts:
+            return
+        try:
+            now = time.time()
+            rows = [(model_key, text_hash(text), np.asarray(vector, dtype=CACHE_DTYPE).tobytes(), now)
+                    for text, vector in zip(texts, vectors)]
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany("INSERT OR REPLACE INTO embedding_cache (model_key, text_hash, vector, last_used) "
+                                 "VALUES (?, ?, ?, ?)", rows)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            with self._lock:
+                self._writes += len(rows)
+                check = self._writes >= SIZE_CHECK_EVERY
+                if check:
+                    self._writes = 0
+            if check:
+                self._evict(conn)
+        except Exception as e:
+            logger.warning(f"写入嵌入缓存失败: {str(e)}")
+
+    def _size_bytes(self, conn):
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, conn):
+        """超过大小上限时删除最久未使用的条目，释放的页由后续写入复用"""
+        if not self.max_bytes:
+            return
+        while self._size_bytes(conn) > self.max_bytes:
+            total = conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+            if total == 0:
+                return
+            count = max(1, int(total * EVICT_FRACTION))
+            conn.execute("DELETE FROM embedding_cache WHERE rowid IN "
+                         "(SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?)", [count])
+            logger.info(f"嵌入缓存超过上限，已淘汰 {count} 条最久未使用的向量")
+
+    def embed(self, model_key, texts, embed_func):
+        """先查缓存，只对未命中的文本调用 embed_func(文本列表) 生成向量并写入缓存，返回与texts对应的向量列表"""
+        vectors = self.get_many(model_key, texts)
+        # 规范化后相同的未命中文本只生成一次
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(text_hash(texts[i]), []).append(i)
+        if not missing:
+            return vectors
+        positions = list(missing.values())
+        generated = embed_func([texts[group[0]] for group in positions])
+        for group, vector in zip(positions, generated):
+            for i in group:
+                vectors[i] = vector
+        self.put_many(model_key, [texts[group[0]] for group in positions], generated)
+        return vectors
+
+    def clear(self, model_key=None):
+        """清空缓存，指定model_key时只清除该模型的向量"""
+        conn = self._connection()
+        if model_key is None:
+            conn.execute('DELETE FROM embedding_cache')
+        else:
+            conn.execute('DELETE FROM embedding_cache WHERE model_key = ?', [model_key])
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'entries': conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0],
+            'bytes': self._size_bytes(conn),
+            'max_bytes': self.max_bytes,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """返回全局嵌入缓存，未开启 EMBEDDING_CACHE_ENABLED 时返回None"""
+    global _cache
+    if not getattr(settings, 'EMBEDDING_CACHE_ENABLED', False):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = getattr(settings, 'EMBEDDING_CACHE_PATH', '') or \
+                    os.path.join(settings.MEDIA_ROOT, 'embedding_cache', 'embeddings.sqlite3')
+                _cache = EmbeddingCache(path, int(getattr(settings, 'EMBEDDING_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+    return _cache
+
+
+def llamaindex_embedding_base():
+    """返回LlamaIndex的 (BaseEmbedding, PrivateAttr)，兼容新旧版本的导入路径"""
+    try:
+        from llama_index.core.embeddings import BaseEmbedding
+        from llama_index.core.bridge.pydantic import PrivateAttr
+    except ImportError:
+        from llama_index.embeddings.base import BaseEmbedding
+        from pydantic import PrivateAttr
+    return BaseEmbedding, PrivateAttr
+
+
+_cached_embedding_class = None
+
+
+def _get_cached_embedding_class():
+    """LlamaIndex为可选依赖，首次使用时才定义包装类"""
+    global _cached_embedding_class
+    if _cached_embedding_class is not None:
+        return _cached_embedding_class
+
+    BaseEmbedding, PrivateAttr = llamaindex_embedding_base()
+
+    class CachedEmbedding(BaseEmbedding):
+        """为LlamaIndex嵌入模型加上持久化缓存，文档向量读写缓存，查询向量直接由原模型生成"""
+
+        _inner = PrivateAttr()
+        _model_key = PrivateAttr()
+        _cache = PrivateAttr()
+
+        def __init__(self, inner, model_key, cache):
+            super().__init__(model_name=getattr(inner, 'model_name', 'unknown'),
+                             embed_batch_size=getattr(inner, 'embed_batch_size', 10))
+            self._inner = inner
+            self._model_key = model_key
+            self._cache = cache
+
+        @classmethod
+        def class_name(cls):
+            return 'CachedEmbedding'
+
+        @property
+        def inner(self):
+            return self._inner
+
+        def _get_query_embedding(self, query):
+            return self._inner.get_query_embedding(query)
+
+        async def _aget_query_embedding(self, query):
+            return await self._inner.aget_query_embedding(query)
+
+        def _get_text_embedding(self, text):
+            return self._get_text_embeddings([text])[0]
+
+        async def _aget_text_embedding(self, text):
+            return self._get_text_embedding(text)
+
+        def _get_text_embeddings(self, texts):
+            # 外层 get_text_embedding_batch 已按 embed_batch_size 分批，未命中部分直接交给原模型的批量实现
+            return self._cache.embed(self._model_key, texts, self._inner._get_text_embeddings)
+
+    _cached_embedding_class = CachedEmbedding
+    return CachedEmbedding
+
+
+def with_embedding_cache(embed_model, model_config):
+    """为LlamaIndex嵌入模型包装持久化缓存，未开启缓存时原样返回"""
+    cache = get_embedding_cache()
+    if cache is None or embed_model is None:
+        return embed_model
+    try:
+        return _get_cached_embedding_class()(embed_model, embedding_model_key(model_config), cache)
+    except Exception as e:
+        logger.warning(f"嵌入模型缓存包装失败，不使用缓存: {str(e)}")
+        return embed_model
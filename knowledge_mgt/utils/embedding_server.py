@@ -0,0 +1,466 @@
+"""
+本机嵌入服务模块
+由一个独立进程（manage.py run_embedding_server）持有本地嵌入模型，gunicorn工作进程、入库线程和
+LLMsManager 通过Unix socket或本机HTTP访问，同一主机上每个模型的权重只加载一份，推理请求在服务内合并为批量encode。
+
+接口与OpenAI兼容：POST /v1/embeddings，请求 {"model": 模型ID或名称, "input": 文本或文本列表,
+"encoding_format": "float"|"base64"}；GET /v1/models 列出常驻模型；GET /health 返回服务状态。
+"""
+
+import os
+import json
+import time
+import base64
+import socket
+import logging
+import threading
+import http.client
+import socketserver
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, close_old_connections
+
+from .embedding_cache import embedding_model_key, llamaindex_embedding_base
+
+logger = logging.getLogger(__name__)
+
+UNIX_SCHEME = 'unix://'
+# 单个请求体的长度上限
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+# 服务端缓存模型配置的秒数，避免每个请求都查询数据库
+MODEL_CONFIG_TTL = 60
+
+# 当前进程是否为嵌入服务本身，服务进程内的模型管理器直接加载模型，不能再连接自己
+_server_process = False
+
+
+def mark_server_process():
+    """标记当前进程为嵌入服务进程"""
+    global _server_process
+    _server_process = True
+
+
+def embedding_server_url():
+    """配置了嵌入服务且当前进程不是服务本身时返回服务地址，否则返回None"""
+    if _server_process:
+        return None
+    return getattr(settings, 'EMBEDDING_SERVER_URL', '') or None
+
+
+class EmbeddingServerError(Exception):
+    """嵌入服务请求失败"""
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """处理OpenAI兼容的嵌入请求，连接保持长连接"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        from .embeddings import local_embedding_manager
+
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/health':
+            self._send_json(200, {'status': 'ok', 'pid': os.getpid(), 'models': local_embedding_manager.stats()})
+        elif path == '/v1/models':
+            models = local_embedding_manager.stats()['models']
+            self._send_json(200, {
+                'object': 'list',
+                'data': [{'id': str(model['model_id']), 'object': 'model', 'owned_by': 'zhiqing'} for model in models]
+            })
+        else:
+            self._send_error(404, f"未知路径: {path}", 'not_found_error')
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path != '/v1/embeddings':
+            self._send_error(404, f"未知路径: {path}", 'not_found_error')
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_REQUEST_BYTES:
+                self._send_error(413, '请求体过大')
+                return
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_error(400, f"无效的JSON请求: {str(e)}")
+            return
+        try:
+            status, response = self.server.embeddings(payload)
+        except Exception as e:
+            logger.error(f"嵌入服务处理请求失败: {str(e)}", exc_info=True)
+            status, response = 500, _error_body(str(e), 'server_error')
+        finally:
+            close_old_connections()
+        self._send_json(status, response)
+
+    def _send_error(self, status, message, error_type='invalid_request_error'):
+        self._send_json(status, _error_body(message, error_type))
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"嵌入服务: {format % args}")
+
+
+def _error_body(message, error_type='invalid_request_error'):
+    return {'error': {'message': message, 'type': error_type}}
+
+
+class EmbeddingServerMixin:
+    """嵌入服务的请求处理：解析模型、在模型池中推理并按OpenAI格式返回"""
+
+    daemon_threads = True
+    # 各工作进程的线程同时建立连接时，默认的监听队列长度5会使Unix socket的connect直接失败
+    request_queue_size = 128
+
+    def setup_embedding_server(self):
+        # 本进程内的模型管理器直接加载模型，不能再连接自己
+        mark_server_process()
+        self._model_configs = {}
+        self._model_configs_lock = threading.Lock()
+
+    def resolve_model(self, model):
+        """按模型ID或名称查找启用的本地嵌入模型配置，结果缓存MODEL_CONFIG_TTL秒"""
+        from .embeddings import get_embedding_model_by_id
+
+        key = str(model)
+        with self._model_configs_lock:
+            cached = self._model_configs.get(key)
+            if cached and time.monotonic() - cached[0] < MODEL_CONFIG_TTL:
+                return cached[1]
+        model_id = int(key) if key.isdigit() else None
+        if model_id is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id FROM embedding_model WHERE name = %s AND is_active = 1 LIMIT 1", [key])
+                row = cursor.fetchone()
+            model_id = row[0] if row else None
+        model_config = get_embedding_model_by_id(model_id) if model_id is not None else None
+        with self._model_configs_lock:
+            self._model_configs[key] = (time.monotonic(), model_config)
+        return model_config
+
+    def embeddings(self, payload):
+        """处理 /v1/embeddings 请求，返回 (HTTP状态码, 响应)"""
+        from .embeddings import local_embedding_manager
+
+        model = payload.get('model')
+        inputs = payload.get('input')
+        if model is None or inputs is None:
+            return 400, _error_body('缺少 model 或 input 参数')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+            return 400, _error_body('input 必须是文本或文本列表')
+
+        model_config = self.resolve_model(model)
+        if not model_config:
+            return 404, _error_body(f"嵌入模型不存在或未启用: {model}", 'not_found_error')
+        if model_config.get('api_type') != 'local':
+            return 400, _error_body(f"嵌入模型 {model} 不是本地模型")
+
+        with local_embedding_manager.use_model(model_config['id'], model_config) as embedding_model:
+            if len(inputs) == 1:
+                # 单条请求交给合并调度器，与其他连接的并发请求合并为一次encode
+                vectors = [embedding_model.embed_text(inputs[0])]
+            else:
+                vectors = embedding_model.embed_texts(inputs, batch_size=model_config.get('batch_size') or 32)
+
+        use_base64 = payload.get('encoding_format') == 'base64'
+        data = []
+        for i, vector in enumerate(vectors):
+            if use_base64:
+                embedding = base64.b64encode(np.asarray(vector, dtype='<f4').tobytes()).decode('ascii')
+            else:
+                embedding = np.asarray(vector, dtype='float32').tolist()
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+        return 200, {
+            'object': 'list',
+            'data': data,
+            'model': str(model),
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+        }
+
+
+class EmbeddingHTTPServer(EmbeddingServerMixin, ThreadingHTTPServer):
+    """监听本机TCP端口的嵌入服务"""
+
+    def __init__(self, host, port):
+        self.setup_embedding_server()
+        super().__init__((host, port), EmbeddingRequestHandler)
+
+
+class EmbeddingUnixServer(EmbeddingServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听Unix socket的嵌入服务"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            # 上次退出时残留的socket文件，确认没有服务在监听后删除
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise RuntimeError(f"嵌入服务已在 {socket_path} 运行")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(socket_path)
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        self.setup_embedding_server()
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def get_request(self):
+        # Unix socket没有客户端地址，BaseHTTPRequestHandler需要可索引的client_address
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def create_server(url):
+    """按地址创建嵌入服务：unix:///路径 监听Unix socket，http://主机:端口 监听TCP"""
+    if url.startswith(UNIX_SCHEME):
+        return EmbeddingUnixServer(url[len(UNIX_SCHEME):])
+    parsed = urlparse(url if '://' in url else f'http://{url}')
+    return EmbeddingHTTPServer(parsed.hostname or '127.0.0.1', parsed.port or 8100)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过Unix socket发送HTTP请求"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class EmbeddingServerClient:
+    """嵌入服务客户端，每个线程使用各自的长连接，fork后的子进程重新连接"""
+
+    def __init__(self, url=None, timeout=None):
+        self.url = url or embedding_server_url()
+        self.timeout = timeout or getattr(settings, 'EMBEDDING_SERVER_TIMEOUT', 60)
+        self._local = threading.local()
+
+    def _new_connection(self):
+        if self.url.startswith(UNIX_SCHEME):
+            return _UnixHTTPConnection(self.url[len(UNIX_SCHEME):], timeout=self.timeout)
+        parsed = urlparse(self.url)
+        return http.client.HTTPConnection(parsed.hostname or '127.0.0.1', parsed.port or 8100, timeout=self.timeout)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = self._new_connection()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        # 长连接可能已被服务端关闭（例如服务重启），重连一次
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = json.loads(response.read().decode('utf-8'))
+                break
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self._close()
+                if attempt == 1 or isinstance(e, socket.timeout):
+                    raise EmbeddingServerError(f"无法访问嵌入服务 {self.url}: {str(e)}")
+        if response.status != 200:
+            message = (data.get('error') or {}).get('message') if isinstance(data, dict) else None
+            raise EmbeddingServerError(f"嵌入服务返回 {response.status}: {message or data}")
+        return data
+
+    def embed(self, model, texts):
+        """为一组文本生成向量，返回与texts一一对应的向量列表"""
+        if not texts:
+            return []
+        data = self._request('POST', '/v1/embeddings',
+                             {'model': str(model), 'input': list(texts), 'encoding_format': 'base64'})
+        vectors = [None] * len(texts)
+        for item in data['data']:
+            vectors[item['index']] = np.frombuffer(base64.b64decode(item['embedding']), dtype='<f4').tolist()
+        return vectors
+
+    def health(self):
+        """检查嵌入服务是否可用，返回服务进程号和常驻模型，不可用时返回None"""
+        try:
+            return self._request('GET', '/health')
+        except EmbeddingServerError as e:
+            logger.warning(str(e))
+            return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_embedding_server_client():
+    """返回全局嵌入服务客户端，未配置嵌入服务时返回None"""
+    global _client
+    url = embedding_server_url()
+    if not url:
+        return None
+    if _client is None or _client.url != url:
+        with _client_lock:
+            if _client is None or _client.url != url:
+                _client = EmbeddingServerClient(url)
+    return _client
+
+
+class RemoteEmbeddingModel:
+    """由嵌入服务执行推理的本地模型，接口与 EmbeddingModel 相同
+
+    配置了 EMBEDDING_SERVER_URL 时 LocalEmbeddingManager 创建本类代替 EmbeddingModel，工作进程不加载模型权重。
+    与 EmbeddingModel 一致，推理失败（包括嵌入服务不可用）时记录错误并抛出异常。
+    """
+
+    def __init__(self, model_id, model_name, model_config=None, client=None):
+        self.model_id = model_id
+        self.model_name = model_name
+        self.model_config = model_config or {}
+        self.client = client or get_embedding_server_client()
+        self.model = None
+        self.is_loaded = False
+        self._dimension = None
+
+    def load_model(self):
+        """让嵌入服务加载模型，并确认向量维度"""
+        if self.is_loaded:
+            return
+        vector = self.client.embed(self.model_id, ['预热'])[0]
+        self._dimension = len(vector)
+        self.is_loaded = True
+        logger.info(f"嵌入模型 {self.model_name} 由嵌入服务 {self.client.url} 提供，维度 {self._dimension}")
+
+    def unload_model(self):
+        """模型权重由嵌入服务持有，本进程只释放引用"""
+        self.is_loaded = False
+
+    def embed_text(self, text):
+        """为单个文本生成嵌入向量，空文本返回零向量，推理失败时抛出异常"""
+        if not text or not text.strip():
+            logger.warning("嵌入空文本")
+            return np.zeros(self.get_dimension())
+        try:
+            return self.client.embed(self.model_id, [text])[0]
+        except Exception as e:
+            logger.error(f"生成嵌入向量失败: {str(e)}", exc_info=True)
+            raise
+
+    def embed_texts(self, texts, batch_size=32, use_cache=True):
+        """为多个文本生成嵌入向量，返回的向量与texts一一对应，空文本返回零向量，任一批推理失败时抛出异常
+
+        嵌入服务只对多条文本的请求使用持久化嵌入缓存，use_cache=False时逐条请求，查询文本不写入缓存。
+        """
+        if not texts:
+            logger.warning("嵌入空文本列表")
+            return []
+        if not use_cache:
+            return [self.embed_text(text) for text in texts]
+        positions = [i for i, text in enumerate(texts) if text and text.strip()]
+        vectors = [np.zeros(self.get_dimension()).tolist() for _ in texts]
+        batch_size = max(1, int(batch_size or 32))
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start:start + batch_size]
+            try:
+                for i, vector in zip(batch, self.client.embed(self.model_id, [texts[i] for i in batch])):
+                    vectors[i] = vector
+            except Exception as e:
+                logger.error(f"批量生成嵌入向量失败: {str(e)}", exc_info=True)
+                raise
+        return vectors
+
+    def get_dimension(self):
+        """获取嵌入向量的维度"""
+        return self._dimension or self.model_config.get('vector_dimension', 384)
+
+    def get_device(self):
+        """获取模型当前运行的设备"""
+        return 'remote' if self.is_loaded else "未加载"
+
+    def batching_stats(self):
+        return None
+
+    @property
+    def cache_key(self):
+        """嵌入缓存与查询向量缓存中区分本模型的键"""
+        model_config = dict(self.model_config)
+        model_config['model_name'] = model_config.get('model_name') or self.model_name
+        return embedding_model_key(model_config)
+
+
+_remote_embedding_class = None
+
+
+def remote_llamaindex_embedding(model_config):
+    """创建通过嵌入服务推理的LlamaIndex嵌入模型，供 LLMsManager 替代进程内的 HuggingFaceEmbedding"""
+    global _remote_embedding_class
+    if _remote_embedding_class is None:
+        BaseEmbedding, PrivateAttr = llamaindex_embedding_base()
+
+        class RemoteEmbedding(BaseEmbedding):
+            """LlamaIndex嵌入模型接口，推理由本机嵌入服务执行"""
+
+            _client = PrivateAttr()
+            _model = PrivateAttr()
+
+            def __init__(self, client, model, model_name):
+                super().__init__(model_name=model_name)
+                self._client = client
+                self._model = model
+
+            @classmethod
+            def class_name(cls):
+                return 'RemoteEmbedding'
+
+            def _get_query_embedding(self, query):
+                return self._client.embed(self._model, [query])[0]
+
+            async def _aget_query_embedding(self, query):
+                return self._get_query_embedding(query)
+
+            def _get_text_embedding(self, text):
+                return self._client.embed(self._model, [text])[0]
+
+            async def _aget_text_embedding(self, text):
+                return self._get_text_embedding(text)
+
+            def _get_text_embeddings(self, texts):
+                return self._client.embed(self._model, texts)
+
+        _remote_embedding_class = RemoteEmbedding
+
+    return _remote_embedding_class(get_embedding_server_client(), model_config['id'],
+                                   model_config.get('model_name') or model_config.get('name') or str(model_config['id']))
@@ -1,11 +1,123 @@
+import os
+import time
+import queue
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
 import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
+from django.conf import settings
 from django.db import connection
 
+from .embedding_cache import get_embedding_cache, embedding_model_key
+from .embedding_server import embedding_server_url, RemoteEmbeddingModel
+
 logger = logging.getLogger('knowledge_mgt')
 
+class EmbeddingBatcher:
+    """把并发的单条 embed_text 请求合并为一次批量推理
+
+    请求线程把文本放入队列后等待结果；后台线程取到第一条后最多再等待max_wait_ms毫秒或凑满max_batch条，
+    调用一次 encode_func(文本列表)，再把各条向量交回等待的线程。CPU上一次批量encode的吞吐远高于多个线程
+    各自encode一条，负载越高每批合并的请求越多。整批失败时逐条重试，只有出错的请求收到异常。
+    """
+
+    def __init__(self, encode_func, max_batch=None, max_wait_ms=None, name='embedding'):
+        self.encode_func = encode_func
+        self.max_batch = max(1, int(max_batch or getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32)))
+        if max_wait_ms is None:
+            max_wait_ms = getattr(settings, 'EMBEDDING_BATCH_MAX_WAIT_MS', 5)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_thread(self):
+        # 调用方持有self._lock；fork出的子进程不会继承后台线程，按进程号重新创建队列和线程
+        if self._thread is None or self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                            name=f'embedding-batcher-{self.name}', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+        return self._queue
+
+    def submit(self, text):
+        """提交一条文本，阻塞到所在批次推理完成，返回向量"""
+        future = Future()
+        # 检查关闭状态与入队在同一把锁内完成，close之后不会再有请求进入队列
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"模型 {self.name} 已卸载")
+            self._ensure_thread().put((text, future))
+        return future.result()
+
+    def _run(self, requests):
+        while True:
+            item = requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            vectors = self.encode_func([text for text, _ in batch])
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            logger.warning(f"合并的 {len(batch)} 条文本批量推理失败，逐条重试: {str(e)}")
+        for text, future in batch:
+            try:
+                future.set_result(self.encode_func([text])[0])
+            except Exception as item_error:
+                future.set_exception(item_error)
+
+    def close(self):
+        """停止后台线程：正在推理的批次照常完成，尚未取出的请求以RuntimeError结束"""
+        with self._lock:
+            self._closed = True
+            if self._thread is not None and self._pid == os.getpid():
+                while True:
+                    try:
+                        _, future = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    future.set_exception(RuntimeError(f"模型 {self.name} 已卸载"))
+                self._queue.put(None)
+            self._thread = None
+            self._queue = None
+
+
 class EmbeddingModel:
     """文本嵌入模型"""
     
@@ -14,6 +126,8 @@ class EmbeddingModel:
         self.model_config = model_config or {}
         self.model = None
         self.is_loaded = False
+        # 合并并发 embed_text 请求的调度器，模型加载后创建
+        self._batcher = None
         
     def load_model(self):
         """加载模型到内存"""
@@ -46,6 +160,8 @@ class EmbeddingModel:
             # 使用指定设备加载模型，不自动下载
             self.model = SentenceTransformer(model_path, device=device, cache_folder=None)
             self.is_loaded = True
+            if getattr(settings, 'EMBEDDING_BATCHING_ENABLED', True):
+                self._batcher = EmbeddingBatcher(self._encode_queries, name=self.model_name)
             logger.info(f"成功加载嵌入模型: {model_path} 到设备: {device}")
         except Exception as e:
             logger.error(f"加载嵌入模型失败: {str(e)}", exc_info=True)
@@ -53,6 +169,9 @@ class EmbeddingModel:
     
     def unload_model(self):
         """卸载模型释放内存"""
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
         if self.model is not None:
             del self.model
             self.model = None
@@ -63,7 +182,7 @@ class EmbeddingModel:
             logger.info(f"已卸载嵌入模型: {self.model_name}")
     
     def embed_text(self, text):
-        """为单个文本生成嵌入向量"""
+        """为单个文本生成嵌入向量，空文本返回零向量，推理失败时抛出异常"""
         if not self.is_loaded:
             raise RuntimeError(f"模型 {self.model_name} 尚未加载，请先调用 load_model()")
             
@@ -72,14 +191,20 @@ class EmbeddingModel:
             return np.zeros(self.get_dimension())
         
         try:
-            vector = self.model.encode(text)
-            return vector.tolist()
+            batcher = self._batcher
+            if batcher is not None:
+                return batcher.submit(text)
+            return self._encode_queries([text])[0]
         except Exception as e:
             logger.error(f"生成嵌入向量失败: {str(e)}", exc_info=True)
-            return np.zeros(self.get_dimension()).tolist()
+            raise
     
-    def embed_texts(self, texts):
-        """为多个文本生成嵌入向量"""
+    def embed_texts(self, texts, batch_size=32, use_cache=True):
+        """为多个文本生成嵌入向量，按batch_size分批推理，返回的向量与texts一一对应
+
+        空文本返回零向量；推理失败时抛出异常，由调用方决定逐条重试或放弃，不会用零向量代替失败的文本。
+        文本为查询而非文档分块时传入use_cache=False，不经过持久化嵌入缓存。
+        """
         if not self.is_loaded:
             raise RuntimeError(f"模型 {self.model_name} 尚未加载，请先调用 load_model()")
             
@@ -87,18 +212,52 @@ class EmbeddingModel:
             logger.warning("嵌入空文本列表")
             return []
         
-        # 过滤空文本
-        filtered_texts = [text for text in texts if text and text.strip()]
-        
-        if not filtered_texts:
-            return []
+        # 过滤空文本，推理后按原位置放回
+        positions = [i for i, text in enumerate(texts) if text and text.strip()]
+        vectors = [np.zeros(self.get_dimension()).tolist() for _ in texts]
+        if not positions:
+            return vectors
         
         try:
-            vectors = self.model.encode(filtered_texts)
-            return vectors.tolist()
+            encoded = self._encode([texts[i] for i in positions], batch_size=batch_size, use_cache=use_cache)
         except Exception as e:
             logger.error(f"批量生成嵌入向量失败: {str(e)}", exc_info=True)
-            return [np.zeros(self.get_dimension()).tolist() for _ in filtered_texts]
+            raise
+        for i, vector in zip(positions, encoded):
+            vectors[i] = vector
+        return vectors
+    
+    def _encode(self, texts, batch_size=32, use_cache=True):
+        """生成向量，use_cache为True且开启嵌入缓存时只为缓存中没有的文本推理"""
+        def encode(items):
+            return self.model.encode(items, batch_size=batch_size).tolist()
+
+        cache = get_embedding_cache() if use_cache else None
+        if cache is None:
+            return encode(texts)
+        return cache.embed(self.cache_key, texts, encode)
+    
+    def _encode_queries(self, texts):
+        """embed_text的推理入口，查询文本不经过持久化嵌入缓存
+
+        只有文档分块经embed_texts写入缓存，与 CachedEmbedding._get_query_embedding 一致；查询向量由 query_embedding_cache 缓存。
+        """
+        return self._encode(texts, use_cache=False)
+
+    def batching_stats(self):
+        """合并推理的批次数和平均每批条数，未开启合并时返回None"""
+        batcher = self._batcher
+        if batcher is None:
+            return None
+        return {'batches': batcher.batches, 'items': batcher.items,
+                'avg_batch_size': round(batcher.items / batcher.batches, 2) if batcher.batches else None}
+    
+    @property
+    def cache_key(self):
+        """嵌入缓存与查询向量缓存中区分本模型的键"""
+        model_config = dict(self.model_config)
+        model_config['model_name'] = model_config.get('model_name') or self.model_name
+        return embedding_model_key(model_config)
     
     def get_dimension(self):
         """获取嵌入向量的维度"""
@@ -113,63 +272,172 @@ class EmbeddingModel:
             return "未加载"
         return self.model.device.type
 
+def _model_nbytes(embedding_model):
+    """估算模型参数和缓冲区占用的内存"""
+    module = embedding_model.model
+    if module is None:
+        return 0
+    try:
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception as e:
+        logger.warning(f"估算模型 {embedding_model.model_name} 内存占用失败: {str(e)}")
+        return 0
+
+
 # 全局本地嵌入模型管理器
 class LocalEmbeddingManager:
-    """本地嵌入模型管理器 - 单例模式，同时只能加载一个本地模型"""
+    """本地嵌入模型池 - 单例模式，线程安全
+
+    多个本地模型可同时常驻，参数总占用超过 LOCAL_EMBEDDING_MEMORY_BUDGET_MB 时按最近使用顺序卸载空闲模型。
+    当前模型（最近一次 load_model 加载的模型，供未绑定模型的知识库使用）不会被淘汰；
+    通过 use_model()/acquire() 取得的模型持有引用计数，使用期间不会被其他线程卸载。
+    """
     
     _instance = None
-    _current_model = None
-    _current_model_id = None
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(LocalEmbeddingManager, cls).__new__(cls)
+            instance = super(LocalEmbeddingManager, cls).__new__(cls)
+            instance._models = OrderedDict()
+            instance._sizes = {}
+            instance._refs = {}
+            instance._load_locks = {}
+            instance._current_model_id = None
+            instance._lock = threading.RLock()
+            cls._instance = instance
         return cls._instance
     
+    @property
+    def budget_bytes(self):
+        return int(getattr(settings, 'LOCAL_EMBEDDING_MEMORY_BUDGET_MB', 4096)) * 1024 * 1024
+    
     def get_current_model(self):
         """获取当前加载的模型"""
-        return self._current_model
+        with self._lock:
+            return self._models.get(self._current_model_id)
     
     def get_current_model_id(self):
         """获取当前加载的模型ID"""
-        return self._current_model_id
+        with self._lock:
+            return self._current_model_id if self._current_model_id in self._models else None
     
     def load_model(self, model_id, model_config):
-        """加载指定的本地模型"""
-        # 如果已经加载了相同的模型，直接返回
-        if self._current_model_id == model_id and self._current_model is not None:
-            logger.info(f"模型 {model_id} 已经加载")
-            return self._current_model
-        
-        # 卸载当前模型
-        if self._current_model is not None:
-            logger.info(f"卸载当前模型 {self._current_model_id}")
-            self._current_model.unload_model()
-            self._current_model = None
-            self._current_model_id = None
-        
-        # 加载新模型
-        try:
-            model_name = model_config.get('model_name') or model_config.get('local_path', 'all-MiniLM-L6-v2')
-            embedding_model = EmbeddingModel(model_name=model_name, model_config=model_config)
-            embedding_model.load_model()
-            
-            self._current_model = embedding_model
+        """加载指定的本地模型并设为当前模型，已常驻的模型直接返回"""
+        embedding_model = self._get_or_load(model_id, model_config)
+        with self._lock:
             self._current_model_id = model_id
-            
-            logger.info(f"成功加载本地嵌入模型 {model_id}: {model_name}")
-            return embedding_model
-        except Exception as e:
-            logger.error(f"加载本地嵌入模型失败: {str(e)}", exc_info=True)
-            raise
+        return embedding_model
+    
+    def acquire(self, model_id, model_config):
+        """取得模型并增加引用计数，用完后必须调用 release(model_id)"""
+        return self._get_or_load(model_id, model_config, acquire=True)
+    
+    def release(self, model_id):
+        """释放 acquire 取得的引用，空闲后超出内存预算的模型随即被卸载"""
+        with self._lock:
+            count = self._refs.get(model_id, 0) - 1
+            if count > 0:
+                self._refs[model_id] = count
+            else:
+                self._refs.pop(model_id, None)
+            evicted = self._select_evictions()
+        self._unload(evicted)
+    
+    @contextmanager
+    def use_model(self, model_id, model_config):
+        """在with块内使用模型，期间模型不会被卸载，不改变当前模型"""
+        embedding_model = self.acquire(model_id, model_config)
+        try:
+            yield embedding_model
+        finally:
+            self.release(model_id)
+    
+    def _get_or_load(self, model_id, model_config, acquire=False):
+        with self._lock:
+            embedding_model = self._models.get(model_id)
+            if embedding_model is not None:
+                self._models.move_to_end(model_id)
+                if acquire:
+                    self._refs[model_id] = self._refs.get(model_id, 0) + 1
+                return embedding_model
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+        
+        # 同一模型只由一个线程加载，其他线程等待后直接使用
+        with load_lock:
+            with self._lock:
+                embedding_model = self._models.get(model_id)
+                if embedding_model is not None:
+                    self._models.move_to_end(model_id)
+                    if acquire:
+                        self._refs[model_id] = self._refs.get(model_id, 0) + 1
+                    return embedding_model
+            try:
+                model_name = model_config.get('model_name') or model_config.get('local_path', 'all-MiniLM-L6-v2')
+                if embedding_server_url():
+                    # 模型权重由本机嵌入服务持有，本进程只保存客户端
+                    embedding_model = RemoteEmbeddingModel(model_id, model_name, model_config)
+                else:
+                    embedding_model = EmbeddingModel(model_name=model_name, model_config=model_config)
+                embedding_model.load_model()
+            except Exception as e:
+                logger.error(f"加载本地嵌入模型失败: {str(e)}", exc_info=True)
+                raise
+            nbytes = _model_nbytes(embedding_model)
+            with self._lock:
+                self._models[model_id] = embedding_model
+                self._sizes[model_id] = nbytes
+                if acquire:
+                    self._refs[model_id] = self._refs.get(model_id, 0) + 1
+                evicted = self._select_evictions(keep=model_id)
+            logger.info(f"成功加载本地嵌入模型 {model_id}: {model_name}，约 {nbytes / 1024 / 1024:.1f} MB")
+        self._unload(evicted)
+        return embedding_model
+    
+    def _select_evictions(self, keep=None):
+        """在持有锁时选出需要卸载的模型：从最久未使用的开始，跳过当前模型、使用中的模型和keep"""
+        total = sum(self._sizes.values())
+        evicted = []
+        for model_id in list(self._models):
+            if total <= self.budget_bytes:
+                break
+            if model_id in (keep, self._current_model_id) or self._refs.get(model_id):
+                continue
+            evicted.append((model_id, self._models.pop(model_id)))
+            total -= self._sizes.pop(model_id, 0)
+        if total > self.budget_bytes:
+            logger.warning(f"本地嵌入模型占用 {total / 1024 / 1024:.1f} MB，超过预算，使用中的模型释放后再卸载")
+        return evicted
+    
+    @staticmethod
+    def _unload(evicted):
+        for model_id, embedding_model in evicted:
+            logger.info(f"超出内存预算，卸载本地嵌入模型 {model_id}")
+            embedding_model.unload_model()
     
     def unload_current_model(self):
-        """卸载当前模型"""
-        if self._current_model is not None:
-            logger.info(f"卸载当前模型 {self._current_model_id}")
-            self._current_model.unload_model()
-            self._current_model = None
+        """卸载当前模型；模型正在使用时只取消当前模型身份，使用结束后按内存预算卸载"""
+        with self._lock:
+            model_id = self._current_model_id
             self._current_model_id = None
+            if model_id not in self._models or self._refs.get(model_id):
+                return
+            embedding_model = self._models.pop(model_id)
+            self._sizes.pop(model_id, None)
+        logger.info(f"卸载当前模型 {model_id}")
+        embedding_model.unload_model()
+    
+    def stats(self):
+        """常驻模型列表（按最近使用排序）及内存占用"""
+        with self._lock:
+            return {
+                'current_model_id': self._current_model_id,
+                'budget_bytes': self.budget_bytes,
+                'total_bytes': sum(self._sizes.values()),
+                'models': [{'model_id': model_id, 'model_name': model.model_name, 'bytes': self._sizes.get(model_id, 0),
+                            'in_use': self._refs.get(model_id, 0), 'batching': model.batching_stats()}
+                           for model_id, model in self._models.items()],
+            }
 
 # 全局管理器实例
 local_embedding_manager = LocalEmbeddingManager()
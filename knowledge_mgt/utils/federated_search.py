@@ -0,0 +1,165 @@
+"""
+跨知识库联邦检索模块
+在线程池中并发检索多个知识库的向量索引，用堆合并各知识库的top-k结果，并批量查询分块详情
+"""
+
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_guard = threading.Lock()
+
+
+def _get_executor():
+    """获取进程内共享的检索线程池（延迟创建）"""
+    global _executor
+    with _executor_guard:
+        if _executor is None:
+            max_workers = getattr(settings, 'VECTOR_FEDERATED_MAX_WORKERS', 8)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='federated-search')
+        return _executor
+
+
+def get_accessible_knowledge_bases(knowledge_db_ids=None, user_id=None, role_id=None):
+    """一次查询获取有权限访问的知识库信息
+
+    knowledge_db_ids为空时返回用户可访问的全部知识库；管理员（role_id=1）不受所属用户限制。
+    返回 {知识库ID: {'id', 'name', 'vector_dimension', 'index_type'}}。
+    """
+    sql = "SELECT id, name, vector_dimension, index_type FROM knowledge_database"
+    conditions = []
+    params = []
+    if knowledge_db_ids is not None:
+        if not knowledge_db_ids:
+            return {}
+        conditions.append(f"id IN ({','.join(['%s'] * len(knowledge_db_ids))})")
+        params.extend(knowledge_db_ids)
+    if role_id != 1:
+        conditions.append("user_id = %s")
+        params.append(user_id)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {
+            row[0]: {'id': row[0], 'name': row[1], 'vector_dimension': row[2], 'index_type': row[3]}
+            for row in cursor.fetchall()
+        }
+
+
+def federated_search(query_vector, knowledge_db_ids=None, top_k=20, per_kb_top_k=5, user_id=None, role_id=None,
+                     use_cosine=False, knowledge_bases=None):
+    """在多个知识库中并发检索并合并结果
+
+    Args:
+        query_vector: 查询向量
+        knowledge_db_ids: 待检索的知识库ID列表，为空时检索用户可访问的全部知识库
+        top_k: 合并后返回的结果数量
+        per_kb_top_k: 每个知识库检索的结果数量
+        user_id, role_id: 用于知识库权限过滤
+        use_cosine: 与 VectorStore.search 含义相同，为True时distance为相似度（越大越相似）
+        knowledge_bases: 已查询好的知识库信息（get_accessible_knowledge_bases的返回值），提供时不再查询数据库
+
+    Returns:
+        按相似度从高到低排列的结果列表，每项包含 knowledge_db_id、knowledge_db_name、chunk_id、distance、rank
+    """
+    if knowledge_bases is None:
+        knowledge_bases = get_accessible_knowledge_bases(knowledge_db_ids, user_id, role_id)
+    if not knowledge_bases:
+        return []
+
+    dimension = len(query_vector)
+
+    def search_one(kb):
+        # 权限已在知识库查询中过滤，工作线程内不再访问数据库
+        vector_store = VectorStore(vector_dimension=dimension, index_type=kb['index_type'])
+        return kb, vector_store.search(kb['id'], query_vector, top_k=per_kb_top_k, use_cosine=use_cosine)
+
+    executor = _get_executor()
+    futures = [executor.submit(search_one, kb) for kb in knowledge_bases.values()]
+
+    candidates = []
+    for future in futures:
+        try:
+            kb, results = future.result()
+        except Exception as e:
+            logger.error(f"联邦检索中单个知识库检索失败: {str(e)}")
+            continue
+        for result in results:
+            candidates.append({
+                'knowledge_db_id': kb['id'],
+                'knowledge_db_name': kb['name'],
+                'chunk_id': result['chunk_id'],
+                'distance': result['distance']
+            })
+
+    # 余弦模式下distance为相似度，越大越好；L2模式下越小越好
+    if use_cosine:
+        merged = heapq.nlargest(top_k, candidates, key=lambda item: item['distance'])
+    else:
+        merged = heapq.nsmallest(top_k, candidates, key=lambda item: item['distance'])
+    for rank, item in enumerate(merged, start=1):
+        item['rank'] = rank
+
+    logger.info(f"联邦检索完成: 检索 {len(knowledge_bases)} 个知识库，候选 {len(candidates)} 个，返回 {len(merged)} 个结果")
+    return merged
+
+
+def get_chunk_details_bulk(chunk_ids, user_id=None, role_id=None):
+    """一次查询获取多个分块的详细信息
+
+    返回 {分块ID: 分块详情}，无权限访问或不存在的分块不包含在结果中。
+    """
+    if not chunk_ids:
+        return {}
+
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    placeholders = ','.join(['%s'] * len(chunk_ids))
+    sql = f"""
+        SELECT
+            c.id, c.content, c.chunk_index, c.create_time,
+            d.id as document_id, d.filename, d.file_path, d.file_type,
+            d.chunking_method, d.chunk_size, d.user_id as doc_user_id,
+            u.username as doc_username
+        FROM knowledge_document_chunk c
+        JOIN knowledge_document d ON c.document_id = d.id
+        LEFT JOIN account_user u ON d.user_id = u.id
+        WHERE c.id IN ({placeholders})
+    """
+    params = list(chunk_ids)
+    # 普通用户只能访问自己的文档
+    if role_id != 1:
+        sql += " AND d.user_id = %s"
+        params.append(user_id)
+
+    details = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            details[row[0]] = {
+                'chunk_id': row[0],
+                'content': row[1],
+                'chunk_index': row[2],
+                'create_time': row[3].isoformat() if row[3] else None,
+                'document_info': {
+                    'id': row[4],
+                    'filename': row[5],
+                    'file_path': row[6],
+                    'file_type': row[7],
+                    'chunking_method': row[8],
+                    'chunk_size': row[9],
+                    'user_id': row[10],
+                    'username': row[11]
+                }
+            }
+    return details
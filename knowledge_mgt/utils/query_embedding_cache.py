@@ -0,0 +1,201 @@
+"""
+查询向量缓存模块
+对话检索、召回测试和内容查重会反复提交相同的查询，每次都要做一次模型推理或付费接口调用。
+本模块按 (嵌入模型, 查询文本) 缓存查询向量：进程内为带过期时间的LRU，
+开启 QUERY_EMBEDDING_CACHE_REDIS 后以Redis作为各gunicorn工作进程共享的第二级缓存。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .embedding_cache import text_hash, embedding_model_key
+
+logger = logging.getLogger(__name__)
+
+# 进程内命中统计累计到该次数或间隔后写入Redis，汇总各工作进程的命中率
+STATS_FLUSH_EVERY = 100
+STATS_FLUSH_INTERVAL = 30.0
+
+
+class QueryEmbeddingCache:
+    """查询向量的两级缓存：进程内TTL LRU + 可选的Redis
+
+    Redis读写失败只记录警告并按未命中处理，查询总能回退为直接调用模型生成向量。
+    """
+
+    def __init__(self, max_entries=None, ttl=None, use_redis=None, prefix=None):
+        self.max_entries = max_entries if max_entries is not None else \
+            getattr(settings, 'QUERY_EMBEDDING_CACHE_SIZE', 1024)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'QUERY_EMBEDDING_CACHE_TTL', 3600)
+        self.use_redis = use_redis if use_redis is not None else \
+            getattr(settings, 'QUERY_EMBEDDING_CACHE_REDIS', False)
+        self.prefix = prefix or getattr(settings, 'QUERY_EMBEDDING_CACHE_PREFIX', 'zhiqing:query_embedding')
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        # 尚未写入Redis的统计增量
+        self._pending_stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+        self._flushed_at = time.monotonic()
+
+    def _redis(self):
+        # fork后的子进程不能复用父进程的连接
+        if self._client is None or self._client_pid != os.getpid():
+            import redis
+            self._client = redis.Redis(
+                host=getattr(settings, 'REDIS_HOST', 'localhost'),
+                port=getattr(settings, 'REDIS_PORT', 6379),
+                password=getattr(settings, 'REDIS_PASSWORD', None) or None,
+                socket_connect_timeout=2,
+                socket_timeout=2,
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    def _key(self, model_key, query):
+        return f"{model_key}:{text_hash(query).hex()}"
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(vector)
+
+    def _put_local(self, key, vector):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self, key):
+        try:
+            data = self._redis().get(f"{self.prefix}:{key}")
+        except Exception as e:
+            logger.warning(f"读取Redis查询向量缓存失败: {str(e)}")
+            return None
+        if data is None:
+            return None
+        return np.frombuffer(data, dtype='float32').tolist()
+
+    def _put_redis(self, key, vector):
+        try:
+            self._redis().set(f"{self.prefix}:{key}", np.asarray(vector, dtype='float32').tobytes(),
+                              ex=max(1, int(self.ttl)))
+        except Exception as e:
+            logger.warning(f"写入Redis查询向量缓存失败: {str(e)}")
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            if not self.use_redis:
+                return
+            self._pending_stats[field] += 1
+            due = sum(self._pending_stats.values()) >= STATS_FLUSH_EVERY or \
+                time.monotonic() - self._flushed_at >= STATS_FLUSH_INTERVAL
+            if not due:
+                return
+            pending = self._pending_stats
+            self._pending_stats = {name: 0 for name in pending}
+            self._flushed_at = time.monotonic()
+        try:
+            pipe = self._redis().pipeline(transaction=False)
+            for name, value in pending.items():
+                if value:
+                    pipe.hincrby(f"{self.prefix}:stats", name, value)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入查询向量缓存统计失败: {str(e)}")
+
+    def get_or_embed(self, model_key, query, embed_func):
+        """返回查询向量，未命中时调用 embed_func(query) 生成并写入缓存"""
+        if not query or self.max_entries <= 0:
+            return embed_func(query)
+        key = self._key(model_key, query)
+        vector = self._get_local(key)
+        if vector is not None:
+            self._count('local_hits')
+            return vector
+        if self.use_redis:
+            vector = self._get_redis(key)
+            if vector is not None:
+                self._put_local(key, vector)
+                self._count('redis_hits')
+                return vector
+        self._count('misses')
+        vector = embed_func(query)
+        # 模型出错时返回全零向量，不缓存
+        if vector is None or not np.any(np.asarray(vector)):
+            return vector
+        vector = np.asarray(vector, dtype='float32').tolist()
+        self._put_local(key, vector)
+        if self.use_redis:
+            self._put_redis(key, vector)
+        return vector
+
+    def clear(self):
+        """清空进程内缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """本进程的命中统计；开启Redis时另外返回全部工作进程的汇总统计"""
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'local_hits': self.local_hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else None,
+            }
+        if self.use_redis:
+            try:
+                totals = {key.decode() if isinstance(key, bytes) else key: int(value)
+                          for key, value in self._redis().hgetall(f"{self.prefix}:stats").items()}
+                lookups = sum(totals.values())
+                hits = totals.get('local_hits', 0) + totals.get('redis_hits', 0)
+                stats['cluster'] = dict(totals, hit_rate=round(hits / lookups, 4) if lookups else None)
+            except Exception as e:
+                logger.warning(f"读取查询向量缓存统计失败: {str(e)}")
+        return stats
+
+
+# 全局查询向量缓存实例
+query_embedding_cache = QueryEmbeddingCache()
+
+
+def embed_query(embedding_model, query, model_config=None):
+    """生成查询向量并缓存
+
+    本地 EmbeddingModel 使用 embed_text，LlamaIndex模型与文档入库一致使用 get_text_embedding；
+    model_config用于区分模型，为空时使用本地模型的 cache_key。
+    """
+    if not getattr(settings, 'QUERY_EMBEDDING_CACHE_ENABLED', True):
+        return _embed(embedding_model, query)
+    model_key = embedding_model.cache_key if model_config is None else embedding_model_key(model_config)
+    return query_embedding_cache.get_or_embed(model_key, query, lambda text: _embed(embedding_model, text))
+
+
+def _embed(embedding_model, query):
+    if hasattr(embedding_model, 'embed_text'):
+        return embedding_model.embed_text(query)
+    # 查询文本不写入持久化嵌入缓存，绕过 CachedEmbedding 直接调用原模型
+    return getattr(embedding_model, 'inner', embedding_model).get_text_embedding(query)
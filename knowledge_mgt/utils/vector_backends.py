@@ -0,0 +1,694 @@
+"""
+向量检索后端模块
+定义向量检索引擎的统一接口（构建、添加、检索、重构、保存、加载），提供FAISS实现和纯NumPy实现。
+VectorStore只通过该接口操作索引文件，ID映射、增量段、墓碑和原始向量由VectorStore统一维护；
+未安装FAISS的精简部署和CI环境可以使用NumPy后端，新的检索引擎实现该接口并登记到 BACKENDS 即可接入
+"""
+
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import faiss
+
+    FAISS_AVAILABLE = True
+except ImportError:
+    faiss = None
+    FAISS_AVAILABLE = False
+
+# 距离度量：l2为欧氏距离；cosine在入库时对向量做L2归一化，使用内积索引检索
+METRIC_L2 = "l2"
+METRIC_COSINE = "cosine"
+
+BACKEND_FAISS = "faiss"
+BACKEND_NUMPY = "numpy"
+
+# NumPy后端每次参与矩阵乘法的向量行数
+NUMPY_BLOCK_SIZE = 65536
+
+# 索引类型别名，前端与数据库中可能使用FLAT、IVFFLAT等写法
+INDEX_TYPE_ALIASES = {
+    "flat": "Flat",
+    "faiss": "Flat",
+    "hnsw": "HNSW",
+    "ivf": "IVF",
+    "ivfflat": "IVF",
+    "ivf_flat": "IVF",
+    "ivfpq": "IVFPQ",
+    "ivf_pq": "IVFPQ",
+    "sq8": "SQ8",
+    "hnsw_sq": "HNSW_SQ",
+    "hnswsq": "HNSW_SQ",
+    "hnsw_sq8": "HNSW_SQ",
+}
+# 支持的索引类型
+SUPPORTED_INDEX_TYPES = ("Flat", "HNSW", "IVF", "IVFPQ", "SQ8", "HNSW_SQ")
+# 有损压缩的索引类型，默认保留全精度向量用于重排序
+COMPRESSED_INDEX_TYPES = ("IVFPQ", "SQ8", "HNSW_SQ")
+# 需要训练的索引类型，训练前使用Flat暂存索引
+TRAINED_INDEX_TYPES = ("IVF", "IVFPQ", "SQ8", "HNSW_SQ")
+# IVF索引参数：nlist约为sqrt(N)并限制在上下限之间
+IVF_NLIST_MIN = 16
+IVF_NLIST_MAX = 4096
+# 每个聚类中心抽取的训练样本数（FAISS k-means每个中心最多使用256个样本）
+IVF_TRAIN_POINTS_PER_LIST = 256
+# FAISS建议每个聚类中心至少39个训练样本
+IVF_MIN_POINTS_PER_LIST = 39
+# PQ每个子空间的码本大小（8bit编码），码本训练同样需要足够样本
+PQ_CODEBOOK_SIZE = 256
+# 训练抽样数下限，保证PQ码本的训练样本充足
+TRAIN_SAMPLE_MIN = 65536
+# 标量量化只需统计各维度取值范围，少量样本即可训练
+SQ_MIN_TRAIN_VECTORS = 1000
+# HNSW图中每个节点的最大连接数及建图时的候选集大小
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+# HNSW检索时的默认候选集大小，知识库可在元数据中配置ef_search覆盖
+DEFAULT_EF_SEARCH = 100
+# 自动调优时依次尝试的efSearch，取满足目标召回率的最小值
+EF_SEARCH_CANDIDATES = (16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024)
+
+
+def get_backend_name():
+    """按 VECTOR_BACKEND 配置确定使用的检索后端，auto表示已安装FAISS时使用FAISS，否则使用NumPy"""
+    name = str(getattr(settings, "VECTOR_BACKEND", "auto") or "auto").strip().lower()
+    if name == BACKEND_NUMPY:
+        return BACKEND_NUMPY
+    if name == BACKEND_FAISS:
+        if not FAISS_AVAILABLE:
+            raise ImportError("VECTOR_BACKEND=faiss，但FAISS未安装")
+        return BACKEND_FAISS
+    if name != "auto":
+        logger.warning(f"未知的向量检索后端 {name}，按auto处理")
+    return BACKEND_FAISS if FAISS_AVAILABLE else BACKEND_NUMPY
+
+
+def get_backend_class(name=None):
+    """返回检索后端类，name为空时按 VECTOR_BACKEND 配置选择"""
+    name = name or get_backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"未知的向量检索后端: {name}")
+    return BACKENDS[name]
+
+
+def normalize_index_type(index_type):
+    """统一索引类型名称为 SUPPORTED_INDEX_TYPES 中的写法"""
+    if not index_type:
+        return "Flat"
+    return INDEX_TYPE_ALIASES.get(str(index_type).lower(), index_type)
+
+
+def ivf_nlist_for(num_vectors):
+    """根据向量数确定IVF聚类数"""
+    return int(min(IVF_NLIST_MAX, max(IVF_NLIST_MIN, np.sqrt(num_vectors))))
+
+
+def pq_m_for(dimension):
+    """IVFPQ子向量个数：每个子向量约8维，且必须整除向量维度"""
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def default_nprobe(nlist):
+    """未配置nprobe时的默认检索聚类数"""
+    return min(nlist, max(8, nlist // 16))
+
+
+def normalize_rows(vectors):
+    """原地对float32矩阵逐行做L2归一化，零向量保持不变，与faiss.normalize_L2一致"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def empty_result(n, k, metric):
+    """没有任何结果时的 (距离矩阵, 向量ID矩阵)"""
+    worst = -np.inf if metric == METRIC_COSINE else np.inf
+    return np.full((n, k), worst, dtype="float32"), np.full((n, k), -1, dtype=np.int64)
+
+
+def merge_results(parts, n, k, metric):
+    """合并多个索引分别检索得到的 [(距离矩阵, 向量ID矩阵), ...]，按距离取每个查询的全局TopK
+
+    各部分的向量ID须已换算为全局ID，ID为-1的无效结果排在最后。
+    """
+    if not parts:
+        return empty_result(n, k, metric)
+    distances = np.concatenate([part[0] for part in parts], axis=1)
+    labels = np.concatenate([part[1] for part in parts], axis=1)
+    cosine = metric == METRIC_COSINE
+    distances = np.where(labels >= 0, distances, -np.inf if cosine else np.inf).astype(
+        "float32"
+    )
+    order = np.argsort(-distances if cosine else distances, axis=1, kind="stable")[
+        :, :k
+    ]
+    distances = np.take_along_axis(distances, order, axis=1)
+    labels = np.take_along_axis(labels, order, axis=1)
+    if labels.shape[1] < k:
+        pad_distances, pad_labels = empty_result(n, k - labels.shape[1], metric)
+        distances = np.concatenate([distances, pad_distances], axis=1)
+        labels = np.concatenate([labels, pad_labels], axis=1)
+    return distances, labels
+
+
+class VectorBackend:
+    """向量检索后端接口
+
+    向量ID为添加顺序的行号，从0开始连续编号。search返回 (距离矩阵, 向量ID矩阵)，不足k个结果的位置ID为-1；
+    L2度量的距离为L2距离平方，从小到大排列，cosine度量的距离为内积相似度，从大到小排列。
+    已删除的向量由VectorStore在ID映射中标记为墓碑，检索时通过mask排除，后端本身不记录删除状态。
+    """
+
+    name = None
+    # 知识库向量目录下的索引文件名
+    index_filename = None
+
+    @classmethod
+    def build(cls, vectors, metric, index_type="Flat"):
+        """用已按度量方式处理过的 (n, d) float32向量构建索引，向量ID按传入顺序编号"""
+        raise NotImplementedError
+
+    @classmethod
+    def create(cls, dimension, metric):
+        """创建空的精确检索索引，用作增量段"""
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, path, metric=METRIC_L2, readonly=False):
+        """从path加载索引；readonly为True时可使用内存映射，返回的索引不能再添加向量
+
+        metric供索引文件本身不记录度量方式的后端使用。
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def ready_to_train(cls, num_vectors, index_type):
+        """向量数是否足以把暂存索引训练为index_type，不需要训练的后端总是返回False"""
+        return False
+
+    @property
+    def ntotal(self):
+        raise NotImplementedError
+
+    @property
+    def dimension(self):
+        raise NotImplementedError
+
+    @property
+    def metric(self):
+        raise NotImplementedError
+
+    @property
+    def exact(self):
+        """检索结果是否精确，精确检索无需用全精度向量重排序"""
+        return True
+
+    @property
+    def nlist(self):
+        """IVF类索引的聚类数，其他索引为0"""
+        return 0
+
+    @property
+    def nbytes(self):
+        """估算的内存占用"""
+        raise NotImplementedError
+
+    @property
+    def description(self):
+        """索引的具体类型，用于日志和基准测试输出"""
+        return type(self).__name__
+
+    def is_staging(self, index_type):
+        """是否为等待训练的暂存索引"""
+        return False
+
+    def add(self, vectors):
+        """添加已按度量方式处理过的向量，返回第一个新向量的ID"""
+        raise NotImplementedError
+
+    def search(self, queries, k, params=None, mask=None):
+        """检索TopK，mask为按向量ID排列的布尔数组，提供时只检索mask为True的向量"""
+        raise NotImplementedError
+
+    def reconstruct_all(self):
+        """取出全部向量，返回 (ntotal, d) float32矩阵；有损压缩的索引返回解码后的近似向量"""
+        raise NotImplementedError
+
+    def save(self, path):
+        """保存到path，先写临时文件再重命名，避免读取方看到写了一半的文件"""
+        raise NotImplementedError
+
+    def search_params(self, metadata, nprobe=None, ef_search=None):
+        """构造单次检索参数：优先使用按查询指定的值，其次为知识库元数据中的配置，最后为默认值
+
+        返回 (params, 生效的参数字典)，没有可调参数的索引返回 (None, {})。
+        """
+        return None, {}
+
+    def tunable_param(self):
+        """可自动调优的检索参数，返回 (参数名, 候选值列表)，没有时返回None"""
+        return None
+
+
+class FaissBackend(VectorBackend):
+    """FAISS后端，封装一个FAISS索引；mask通过IDSelectorBitmap在FAISS内部过滤"""
+
+    name = BACKEND_FAISS
+    index_filename = "faiss.index"
+
+    def __init__(self, index):
+        if not FAISS_AVAILABLE:
+            raise ImportError("FAISS未安装，无法使用FAISS检索后端")
+        self.index = index
+
+    @staticmethod
+    def _faiss_metric(metric):
+        return (
+            faiss.METRIC_INNER_PRODUCT if metric == METRIC_COSINE else faiss.METRIC_L2
+        )
+
+    @classmethod
+    def _new_index(cls, dimension, metric, index_type, nlist=IVF_NLIST_MIN):
+        """按索引类型和度量方式创建空的FAISS索引，TRAINED_INDEX_TYPES中的索引需要调用方自行训练"""
+        faiss_metric = cls._faiss_metric(metric)
+        if index_type == "Flat":
+            return faiss.IndexFlat(dimension, faiss_metric)
+        if index_type == "HNSW":
+            # 创建HNSW索引，M是每个节点的最大连接数；efSearch在检索时通过SearchParametersHNSW指定
+            index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss_metric)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = DEFAULT_EF_SEARCH
+            return index
+        if index_type == "IVF":
+            # 为IVF创建量化器，nlist是聚类的数量
+            quantizer = faiss.IndexFlat(dimension, faiss_metric)
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss_metric)
+        if index_type == "IVFPQ":
+            # 乘积量化：每个子向量编码为8bit
+            quantizer = faiss.IndexFlat(dimension, faiss_metric)
+            return faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, pq_m_for(dimension), 8, faiss_metric
+            )
+        if index_type == "SQ8":
+            # 标量量化：每个维度编码为8bit
+            return faiss.IndexScalarQuantizer(
+                dimension, faiss.ScalarQuantizer.QT_8bit, faiss_metric
+            )
+        if index_type == "HNSW_SQ":
+            index = faiss.IndexHNSWSQ(
+                dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss_metric
+            )
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = DEFAULT_EF_SEARCH
+            return index
+        # 默认使用Flat
+        logger.warning(f"不支持的索引类型 {index_type}，使用默认Flat")
+        return faiss.IndexFlat(dimension, faiss_metric)
+
+    @classmethod
+    def ready_to_train(cls, num_vectors, index_type):
+        if index_type not in TRAINED_INDEX_TYPES:
+            return False
+        if index_type in ("SQ8", "HNSW_SQ"):
+            return num_vectors >= SQ_MIN_TRAIN_VECTORS
+        threshold = getattr(settings, "VECTOR_IVF_TRAIN_THRESHOLD", 10000)
+        floor = IVF_NLIST_MIN * IVF_MIN_POINTS_PER_LIST
+        if index_type == "IVFPQ":
+            floor = max(floor, PQ_CODEBOOK_SIZE * IVF_MIN_POINTS_PER_LIST)
+        return num_vectors >= max(threshold, floor)
+
+    @classmethod
+    def build(cls, vectors, metric, index_type="Flat"):
+        """需要训练的索引类型在向量数未达到训练阈值时返回Flat暂存索引；达到后按向量数确定nlist，
+        并从全部向量中随机抽样训练
+        """
+        dimension = vectors.shape[1]
+        if index_type not in TRAINED_INDEX_TYPES:
+            index = cls._new_index(dimension, metric, index_type)
+        elif not cls.ready_to_train(len(vectors), index_type):
+            index = cls._new_index(dimension, metric, "Flat")
+        else:
+            nlist = ivf_nlist_for(len(vectors))
+            index = cls._new_index(dimension, metric, index_type, nlist)
+            sample_size = min(
+                len(vectors), max(nlist * IVF_TRAIN_POINTS_PER_LIST, TRAIN_SAMPLE_MIN)
+            )
+            sample = vectors[
+                np.sort(
+                    np.random.default_rng().choice(
+                        len(vectors), sample_size, replace=False
+                    )
+                )
+            ]
+            index.train(np.ascontiguousarray(sample, dtype="float32"))
+            logger.info(
+                f"已训练{index_type}索引: nlist={nlist}, 训练样本数={sample_size}"
+            )
+        if len(vectors):
+            index.add(np.ascontiguousarray(vectors, dtype="float32"))
+        return cls(index)
+
+    @classmethod
+    def create(cls, dimension, metric):
+        return cls(cls._new_index(dimension, metric, "Flat"))
+
+    @classmethod
+    def load(cls, path, metric=METRIC_L2, readonly=False):
+        """readonly为True时以内存映射方式加载，同一主机上的多个工作进程共享操作系统页缓存
+
+        Flat、HNSW的向量存储使用IO_FLAG_MMAP_IFC映射，IVF的倒排表使用IO_FLAG_MMAP映射；
+        索引类型不支持或未启用VECTOR_INDEX_MMAP时回退为普通读取。
+        """
+        if not FAISS_AVAILABLE:
+            raise ImportError("FAISS未安装，无法读取FAISS索引")
+        # Windows下被映射的文件无法被替换，仅在POSIX系统使用内存映射
+        if (
+            readonly
+            and getattr(settings, "VECTOR_INDEX_MMAP", True)
+            and os.name == "posix"
+        ):
+            for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+                io_flag = getattr(faiss, flag_name, None)
+                if io_flag is None:
+                    continue
+                try:
+                    return cls(faiss.read_index(path, io_flag))
+                except RuntimeError as e:
+                    logger.debug(f"索引 {path} 不支持 {flag_name} 方式加载: {str(e)}")
+        return cls(faiss.read_index(path))
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def dimension(self):
+        return self.index.d
+
+    @property
+    def metric(self):
+        return (
+            METRIC_COSINE
+            if self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+            else METRIC_L2
+        )
+
+    @property
+    def exact(self):
+        return isinstance(self.index, faiss.IndexFlat)
+
+    @property
+    def nlist(self):
+        return self.index.nlist if isinstance(self.index, faiss.IndexIVF) else 0
+
+    @property
+    def nbytes(self):
+        return self.index.ntotal * self.index.code_size
+
+    @property
+    def description(self):
+        return type(self.index).__name__
+
+    def is_staging(self, index_type):
+        return index_type in TRAINED_INDEX_TYPES and isinstance(
+            self.index, faiss.IndexFlat
+        )
+
+    def add(self, vectors):
+        start = self.index.ntotal
+        self.index.add(np.ascontiguousarray(vectors, dtype="float32"))
+        return start
+
+    def search(self, queries, k, params=None, mask=None):
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        if mask is None:
+            return self.index.search(queries, k, params=params)
+        mask = np.asarray(mask[: self.ntotal], dtype=bool)
+        allowed = int(np.count_nonzero(mask))
+        if allowed == 0:
+            return empty_result(len(queries), k, self.metric)
+        # bitmap和selector需在检索期间保持引用
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(self.ntotal, faiss.swig_ptr(bitmap))
+        params = self._filtered_params(params, selector, allowed / self.ntotal)
+        return self.index.search(queries, k, params=params)
+
+    def _filtered_params(self, params, selector, selectivity):
+        """构造带ID过滤器的检索参数
+
+        过滤后可用向量的比例selectivity越低，IVF需要扫描的聚类和HNSW的候选集越大才能凑满TopK，
+        因此nprobe和efSearch按比例放大，上限分别为nlist和向量数。
+        """
+        index = self.index
+        if isinstance(index, faiss.IndexIVF):
+            nprobe = params.nprobe if params is not None else index.nprobe
+            params = faiss.SearchParametersIVF()
+            params.nprobe = int(min(index.nlist, np.ceil(nprobe / selectivity)))
+        elif isinstance(index, faiss.IndexHNSW):
+            ef_search = params.efSearch if params is not None else index.hnsw.efSearch
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(
+                min(max(index.ntotal, ef_search), np.ceil(ef_search / selectivity))
+            )
+        else:
+            params = faiss.SearchParameters()
+        params.sel = selector
+        return params
+
+    def reconstruct_all(self):
+        if self.index.ntotal == 0:
+            return np.empty((0, self.index.d), dtype="float32")
+        # IVF索引需先建立直接映射
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.make_direct_map()
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def save(self, path):
+        # 原文件被替换后，已通过内存映射打开旧文件的进程仍可继续使用旧版本，直到重新加载
+        tmp_path = f"{path}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, path)
+
+    def search_params(self, metadata, nprobe=None, ef_search=None):
+        """IVF索引使用nprobe，HNSW索引使用ef_search
+
+        通过SearchParameters传参而不修改索引属性，缓存中的索引可被多个线程并发检索，
+        也不依赖索引文件序列化时保存的efSearch。nprobe不超过索引的聚类数nlist。
+        """
+        if isinstance(self.index, faiss.IndexIVF):
+            nprobe = min(
+                int(
+                    nprobe or metadata.get("nprobe") or default_nprobe(self.index.nlist)
+                ),
+                self.index.nlist,
+            )
+            params = faiss.SearchParametersIVF()
+            params.nprobe = nprobe
+            return params, {"nprobe": nprobe}
+        if isinstance(self.index, faiss.IndexHNSW):
+            ef_search = int(ef_search or metadata.get("ef_search") or DEFAULT_EF_SEARCH)
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = ef_search
+            return params, {"ef_search": ef_search}
+        return None, {}
+
+    def tunable_param(self):
+        if isinstance(self.index, faiss.IndexIVF):
+            nlist = self.index.nlist
+            return "nprobe", sorted(
+                {min(2**i, nlist) for i in range(int(np.log2(nlist)) + 2)}
+            )
+        if isinstance(self.index, faiss.IndexHNSW):
+            return "ef_search", list(EF_SEARCH_CANDIDATES)
+        return None
+
+
+class NumpyBackend(VectorBackend):
+    """纯NumPy后端：向量以行优先存放在.npy格式的索引文件中并以只读内存映射打开，
+    按块做矩阵乘法后用argpartition取TopK
+
+    每次只把block_size行转换为float32参与计算，内存占用与知识库大小无关；
+    L2度量用 ||x||² - 2q·x 排序，向量的平方范数在首次检索时计算并缓存。
+    新添加的向量保存在内存中，save时与已有向量一起写入新文件。检索为精确检索，索引类型只作记录。
+    """
+
+    name = BACKEND_NUMPY
+    index_filename = "numpy.index"
+
+    def __init__(self, dimension, metric=METRIC_L2, vectors=None, block_size=None):
+        self._dimension = int(dimension)
+        self._metric = metric
+        self.block_size = int(
+            block_size or getattr(settings, "VECTOR_NUMPY_BLOCK_SIZE", NUMPY_BLOCK_SIZE)
+        )
+        self._base = (
+            vectors
+            if vectors is not None
+            else np.empty((0, self._dimension), dtype="float32")
+        )
+        self._pending = []
+        self._pending_rows = 0
+        self._norms = None
+
+    @classmethod
+    def build(cls, vectors, metric, index_type="Flat"):
+        backend = cls(vectors.shape[1], metric)
+        backend.add(vectors)
+        return backend
+
+    @classmethod
+    def create(cls, dimension, metric):
+        return cls(dimension, metric)
+
+    @classmethod
+    def load(cls, path, metric=METRIC_L2, readonly=False):
+        # Windows下被映射的文件无法被替换，仅在POSIX系统使用内存映射
+        vectors = np.load(path, mmap_mode="r" if os.name == "posix" else None)
+        return cls(vectors.shape[1], metric, vectors)
+
+    @property
+    def ntotal(self):
+        return len(self._base) + self._pending_rows
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    @property
+    def metric(self):
+        return self._metric
+
+    @property
+    def nbytes(self):
+        return self.ntotal * self._dimension * 4
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype="float32").reshape(-1, self._dimension)
+        start = self.ntotal
+        if len(vectors):
+            self._pending.append(np.array(vectors, dtype="float32"))
+            self._pending_rows += len(vectors)
+        return start
+
+    def _parts(self):
+        """按向量ID顺序返回 [(起始ID, 向量矩阵), ...]"""
+        parts = [(0, self._base)]
+        offset = len(self._base)
+        for pending in self._pending:
+            parts.append((offset, pending))
+            offset += len(pending)
+        return parts
+
+    def _blocks(self):
+        """按块依次返回 (起始ID, float32向量块)"""
+        for offset, vectors in self._parts():
+            for start in range(0, len(vectors), self.block_size):
+                yield offset + start, np.asarray(
+                    vectors[start : start + self.block_size], dtype="float32"
+                )
+
+    def _squared_norms(self):
+        if self._norms is None or len(self._norms) != self.ntotal:
+            self._norms = np.concatenate(
+                [np.einsum("ij,ij->i", block, block) for _, block in self._blocks()]
+                or [np.empty(0, dtype="float32")]
+            )
+        return self._norms
+
+    def search(self, queries, k, params=None, mask=None):
+        """params为 {'cosine': True} 时在L2度量的向量上按余弦相似度检索，返回相似度（从大到小）"""
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype="float32")
+        n = len(queries)
+        cosine = self._metric == METRIC_COSINE or bool((params or {}).get("cosine"))
+        result_metric = METRIC_COSINE if cosine else METRIC_L2
+        if self.ntotal == 0 or k <= 0:
+            return empty_result(n, max(k, 0), result_metric)
+        norms = None if self._metric == METRIC_COSINE else self._squared_norms()
+        if cosine and norms is not None:
+            # 存储的向量未归一化：查询向量归一化，内积再除以各向量的范数
+            queries = normalize_rows(queries.copy())
+            inv_norms = np.sqrt(norms)
+            inv_norms[inv_norms == 0] = 1.0
+            inv_norms = 1.0 / inv_norms
+
+        # 统一为“越小越好”的分数：内积取负，L2省略对排序无影响的 ||q||²
+        best_scores = np.full((n, 0), np.inf, dtype="float32")
+        best_ids = np.empty((n, 0), dtype=np.int64)
+        for start, block in self._blocks():
+            scores = queries @ block.T
+            if not cosine:
+                scores = norms[start : start + len(block)] - 2.0 * scores
+            elif norms is not None:
+                scores = -scores * inv_norms[start : start + len(block)]
+            else:
+                scores = -scores
+            if mask is not None:
+                scores[:, ~np.asarray(mask[start : start + len(block)], dtype=bool)] = (
+                    np.inf
+                )
+            ids = np.broadcast_to(
+                np.arange(start, start + len(block), dtype=np.int64), scores.shape
+            )
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, ids], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                ids = np.take_along_axis(ids, top, axis=1)
+            best_scores, best_ids = scores, ids
+
+        order = np.argsort(best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        # 被过滤掉的向量分数为inf，不作为结果返回
+        best_ids = np.where(
+            np.isinf(best_scores), -1, np.take_along_axis(best_ids, order, axis=1)
+        )
+        if cosine:
+            distances = -best_scores
+        else:
+            distances = np.maximum(
+                0.0, best_scores + np.einsum("ij,ij->i", queries, queries)[:, None]
+            )
+            distances[np.isinf(best_scores)] = np.inf
+
+        # 结果不足k个时补齐，与FAISS返回的形状一致
+        if best_ids.shape[1] < k:
+            empty_distances, empty_ids = empty_result(
+                n, k - best_ids.shape[1], result_metric
+            )
+            distances = np.concatenate([distances, empty_distances], axis=1)
+            best_ids = np.concatenate([best_ids, empty_ids], axis=1)
+        return distances.astype("float32"), best_ids
+
+    def reconstruct_all(self):
+        parts = [np.asarray(vectors, dtype="float32") for _, vectors in self._parts()]
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def save(self, path):
+        # 按块写入临时文件，不需要把全部向量同时读入内存
+        tmp_path = f"{path}.tmp"
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype="float32", shape=(self.ntotal, self._dimension)
+        )
+        for start, block in self._blocks():
+            out[start : start + len(block)] = block
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+
+
+# 已登记的检索后端，键为后端名称（VECTOR_BACKEND配置值及段清单中记录的后端）
+BACKENDS = {
+    BACKEND_FAISS: FaissBackend,
+    BACKEND_NUMPY: NumpyBackend,
+}
@@ -0,0 +1,262 @@
+"""
+向量索引文件模块
+知识库向量目录中与检索后端无关的文件读写：ID映射、原始向量、元数据和分块属性表，
+以及按知识库在进程内和进程间串行执行写操作的写锁
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，写锁只在进程内生效
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ID映射文件：int64数组，下标为向量ID，值为分块ID，-1表示该位置没有对应分块
+ID_MAP_FILENAME = "id_mapping.npy"
+# 原始向量文件：行优先存储，第i行对应向量ID i（经ID映射对应分块ID），
+# 用于压缩索引的精确重排序，以及重建、压缩、转换索引时直接读取向量而无需重新生成embedding
+RAW_VECTORS_FILENAME = "vectors.f32"
+# 按存储精度区分的原始向量文件名，float16占用减半，精度足以用于重建和重排序
+RAW_VECTORS_FILENAMES = {"float32": RAW_VECTORS_FILENAME, "float16": "vectors.f16"}
+# 分块属性表：按分块ID记录所属文档、上传时间和文件类型，只追加写入，用于检索时按属性过滤
+CHUNK_ATTRIBUTES_FILENAME = "chunk_attrs.bin"
+CHUNK_ATTRIBUTE_DTYPE = np.dtype(
+    [
+        ("chunk_id", "<i8"),
+        ("document_id", "<i8"),
+        ("created_at", "<i8"),
+        ("file_type", "S16"),
+    ]
+)
+
+# 对同一知识库索引文件的写操作（添加、删除、重建、压缩）通过写锁串行执行，
+# 写锁在进程内是可重入锁，进程间通过知识库目录下锁文件上的flock互斥
+WRITE_LOCK_FILENAME = ".lock"
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def raw_vectors_dtype(metadata):
+    """知识库原始向量文件的存储精度，旧版元数据没有记录时为float32"""
+    dtype = (metadata or {}).get("raw_dtype", "float32")
+    return dtype if dtype in RAW_VECTORS_FILENAMES else "float32"
+
+
+def versioned_filename(filename, version):
+    """第version版基础索引使用的文件名，例如 faiss.00000003.index
+
+    基础索引、ID映射和原始向量每次重写都使用新版本的文件名，由段清单指向当前版本；
+    version为空时是旧版目录的固定文件名。
+    """
+    if not version:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{int(version):08d}{ext}"
+
+
+def raw_vectors_path(db_vector_dir, metadata, version):
+    """知识库第version版基础索引对应的原始向量文件路径"""
+    return os.path.join(
+        db_vector_dir,
+        versioned_filename(RAW_VECTORS_FILENAMES[raw_vectors_dtype(metadata)], version),
+    )
+
+
+def load_raw_vectors(path, dimension, dtype="float32"):
+    """读取原始向量，POSIX系统以只读内存映射打开，文件不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    rows = os.path.getsize(path) // (np.dtype(dtype).itemsize * dimension)
+    if rows == 0:
+        return np.empty((0, dimension), dtype=dtype)
+    # Windows下被映射的文件无法被替换，仅在POSIX系统使用内存映射
+    if os.name == "posix":
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows, dimension))
+    return np.fromfile(path, dtype=dtype, count=rows * dimension).reshape(
+        rows, dimension
+    )
+
+
+def save_raw_vectors(path, vectors, dtype="float32"):
+    """整体写入原始向量，先写临时文件再重命名"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(np.ascontiguousarray(vectors, dtype=dtype).tobytes())
+    os.replace(tmp_path, path)
+
+
+def append_raw_vectors(path, vectors, ntotal, load_vectors, dtype="float32"):
+    """在原始向量文件末尾追加向量，必须在新向量提交到索引之前调用
+
+    ntotal为索引中已有的向量数。文件行数多于ntotal（上次写入在提交前中断）时截断多余的行；
+    少于ntotal（例如旧索引此前未保存原始向量）时，用load_vectors()返回的全部向量重写。
+    """
+    dimension = vectors.shape[1]
+    row_bytes = np.dtype(dtype).itemsize * dimension
+    rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+    if rows > ntotal:
+        logger.warning(
+            f"原始向量文件 {path} 行数 {rows} 多于索引向量数 {ntotal}，截断未提交的向量"
+        )
+        os.truncate(path, ntotal * row_bytes)
+    elif rows < ntotal:
+        logger.warning(
+            f"原始向量文件 {path} 行数 {rows} 少于索引向量数 {ntotal}，使用索引重构的向量重写"
+        )
+        save_raw_vectors(path, load_vectors(), dtype)
+    with open(path, "ab") as f:
+        f.write(np.ascontiguousarray(vectors, dtype=dtype).tobytes())
+
+
+def save_metadata(path, metadata):
+    """写入元数据文件，先写临时文件再重命名"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_chunk_attributes(path):
+    """读取分块属性表，POSIX系统以只读内存映射打开，文件不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    rows = os.path.getsize(path) // CHUNK_ATTRIBUTE_DTYPE.itemsize
+    if rows == 0:
+        return np.empty(0, dtype=CHUNK_ATTRIBUTE_DTYPE)
+    # Windows下被映射的文件无法被替换，仅在POSIX系统使用内存映射
+    if os.name == "posix":
+        return np.memmap(path, dtype=CHUNK_ATTRIBUTE_DTYPE, mode="r", shape=(rows,))
+    return np.fromfile(path, dtype=CHUNK_ATTRIBUTE_DTYPE, count=rows)
+
+
+def save_chunk_attributes(path, rows):
+    """整体写入分块属性表，先写临时文件再重命名"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(np.ascontiguousarray(rows, dtype=CHUNK_ATTRIBUTE_DTYPE).tobytes())
+    os.replace(tmp_path, path)
+
+
+def append_chunk_attributes(path, rows):
+    """在分块属性表末尾追加属性行"""
+    with open(path, "ab") as f:
+        f.write(np.ascontiguousarray(rows, dtype=CHUNK_ATTRIBUTE_DTYPE).tobytes())
+
+
+def load_id_map(path, mmap=False):
+    """读取ID映射数组，mmap为True时以只读内存映射方式打开"""
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def save_id_map(path, id_map):
+    """写入ID映射数组，先写临时文件再重命名，避免读取方看到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(id_map, dtype=np.int64))
+    os.replace(tmp_path, path)
+
+
+def resize_id_map(id_map, size):
+    """将ID映射调整到指定长度，新增位置填充-1"""
+    if len(id_map) >= size:
+        return np.asarray(id_map[:size], dtype=np.int64)
+    return np.concatenate([id_map, np.full(size - len(id_map), -1, dtype=np.int64)])
+
+
+def link_file(src, dst):
+    """让dst与src指向同一文件内容，优先使用硬链接，不支持时复制；src不存在时忽略"""
+    if not os.path.exists(src):
+        return
+    remove_file(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def remove_file(path):
+    """删除文件，文件不存在时忽略"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class KnowledgeBaseWriteLock:
+    """知识库写锁：进程内可重入，最外层获取时再对锁文件加flock排他锁
+
+    多个进程（多个Web worker、后台任务）写同一知识库时，各自读到的段清单可能已经过期，
+    由flock保证同一时刻只有一个进程在读取清单并写入，写操作应在获取写锁之后再读取段清单。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = self._lock_file()
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fd, self._fd = self._fd, None
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _lock_file(self):
+        """打开锁文件并加排他锁，返回文件描述符
+
+        加锁期间锁文件可能随知识库目录一起被删除，此时重新创建锁文件再加锁，
+        保证持有的锁与其他进程看到的是同一个文件。
+        """
+        while True:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+
+def get_write_lock(knowledge_db_id):
+    """获取知识库的写锁"""
+    key = str(knowledge_db_id)
+    path = os.path.join(settings.MEDIA_ROOT, "vector_indexes", key, WRITE_LOCK_FILENAME)
+    with _write_locks_guard:
+        lock = _write_locks.get(key)
+        if lock is None or lock.path != path:
+            lock = _write_locks[key] = KnowledgeBaseWriteLock(path)
+        return lock
@@ -0,0 +1,450 @@
+"""
+向量索引缓存模块
+在进程内缓存已加载的向量索引（检索后端实例）及ID映射，避免每次检索都从磁盘反序列化索引文件
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .vector_files import load_chunk_attributes
+
+logger = logging.getLogger(__name__)
+
+# 存活向量掩码尚未计算的标记
+_UNSET = object()
+
+# 加载锁的条带数：同一知识库的并发加载串行执行，锁数量固定，不随知识库数量增长
+LOAD_LOCK_STRIPES = 64
+
+
+class CachedIndex:
+    """缓存条目：基础索引、增量段、ID映射、元数据、文件版本戳及估算内存占用
+
+    segments为 [(起始向量ID, 段索引), ...]，id_mapping覆盖基础索引与全部段。
+    base_version为基础索引的版本号，用于找到同一版本的原始向量文件，旧版目录为None。
+    """
+
+    __slots__ = (
+        "index",
+        "_id_mapping",
+        "_live_mask",
+        "_chunk_attributes",
+        "metadata",
+        "stamp",
+        "nbytes",
+        "segments",
+        "base_version",
+        "checked_at",
+    )
+
+    def __init__(
+        self,
+        index,
+        id_mapping,
+        metadata,
+        stamp,
+        nbytes,
+        segments=(),
+        base_version=None,
+    ):
+        self.index = index
+        self.id_mapping = id_mapping
+        self.metadata = metadata
+        self.stamp = stamp
+        self.nbytes = nbytes
+        self.segments = list(segments)
+        self.base_version = base_version
+        self._chunk_attributes = None
+        # 最近一次校验版本戳的时间（time.monotonic），0表示下次访问必须校验
+        self.checked_at = time.monotonic()
+
+    @property
+    def id_mapping(self):
+        return self._id_mapping
+
+    @id_mapping.setter
+    def id_mapping(self, id_mapping):
+        self._id_mapping = id_mapping
+        self._live_mask = _UNSET
+
+    def live_mask(self):
+        """按向量ID排列的存活向量布尔数组，没有已删除向量时返回None
+
+        结果随ID映射缓存，ID映射被替换（删除、追加增量段）后重新计算。
+        """
+        if self._live_mask is _UNSET:
+            live = np.asarray(self._id_mapping) >= 0
+            self._live_mask = None if live.all() else live
+        return self._live_mask
+
+    def chunk_attributes(self, path):
+        """分块属性表及按chunk_id排序的行号索引，返回 (attributes, order, sorted_chunk_ids)
+
+        sorted_chunk_ids[i] 是属性表第 order[i] 行的chunk_id，过滤检索时用二分查找定位每个向量的属性行。
+        结果随缓存条目保存，属性表文件的版本戳变化（追加、重新生成）后重新加载；文件不存在时返回None。
+        """
+        stamp = VectorIndexCache.file_stamp([path])
+        if stamp is None:
+            return None
+        cached = self._chunk_attributes
+        if cached is None or cached[0] != stamp:
+            attributes = load_chunk_attributes(path)
+            if attributes is None:
+                return None
+            chunk_ids = np.asarray(attributes["chunk_id"])
+            order = np.argsort(chunk_ids, kind="stable")
+            cached = (stamp, attributes, order, chunk_ids[order])
+            self._chunk_attributes = cached
+        return cached[1:]
+
+
+class IndexChangeNotifier:
+    """通过Redis发布/订阅在进程间广播索引变更
+
+    写入方提交后发布知识库ID，各进程的订阅线程收到后把对应缓存条目标记为待校验，
+    下一次检索立即重新比较版本戳，而不必等到校验间隔结束。Redis不可用时只记录日志，
+    缓存仍依靠定期校验版本戳在有限延迟内看到其他进程的写入。
+    """
+
+    def __init__(self, channel=None):
+        self.channel = channel or getattr(
+            settings, "VECTOR_INDEX_NOTIFY_CHANNEL", "zhiqing:vector_index_changed"
+        )
+        self._client = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _connect():
+        import redis
+
+        return redis.Redis(
+            host=getattr(settings, "REDIS_HOST", "localhost"),
+            port=getattr(settings, "REDIS_PORT", 6379),
+            password=getattr(settings, "REDIS_PASSWORD", None) or None,
+            socket_connect_timeout=2,
+        )
+
+    def publish(self, key):
+        """广播知识库索引已变化"""
+        try:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+                client = self._client
+            client.publish(self.channel, str(key))
+        except Exception as e:
+            logger.warning(f"广播索引变更失败（知识库 {key}）: {str(e)}")
+
+    def ensure_listener(self, cache):
+        """在当前进程启动订阅线程；fork出的子进程不会继承线程，按进程号判断是否需要重新启动"""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            # 父进程的连接不能在子进程中复用
+            self._client = None
+        thread = threading.Thread(
+            target=self._listen, args=(cache,), name="vector-index-notify", daemon=True
+        )
+        thread.start()
+
+    def _listen(self, cache):
+        while True:
+            try:
+                pubsub = self._connect().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # 订阅建立前可能错过了通知，全部条目重新校验一次
+                cache.mark_stale()
+                for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    key = message["data"]
+                    if isinstance(key, bytes):
+                        key = key.decode()
+                    cache.mark_stale(key)
+            except Exception as e:
+                logger.warning(f"索引变更订阅中断，稍后重连: {str(e)}")
+                time.sleep(5)
+
+
+class VectorIndexCache:
+    """按知识库ID缓存索引，以文件mtime/size作为版本戳校验，超出内存上限时按LRU淘汰
+
+    缓存中的索引只用于只读检索，多个线程可以同时对同一个条目执行search；
+    写操作（添加、删除、重建）必须自行从磁盘读取新的索引副本，写完后调用invalidate。
+
+    每个条目最多每check_interval秒stat一次文件校验版本戳，其他进程的写入在该间隔内可见；
+    配置了notifier时，写入方的invalidate/refresh/append_segment会广播变更，其他进程立即重新校验。
+    """
+
+    def __init__(self, max_bytes=None, check_interval=None, notifier=None):
+        if max_bytes is None:
+            max_bytes = getattr(
+                settings, "VECTOR_INDEX_CACHE_MAX_BYTES", 1024 * 1024 * 1024
+            )
+        if check_interval is None:
+            check_interval = getattr(
+                settings, "VECTOR_INDEX_VERSION_CHECK_INTERVAL", 1.0
+            )
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.notifier = notifier
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = tuple(threading.Lock() for _ in range(LOAD_LOCK_STRIPES))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def file_stamp(paths, optional_paths=()):
+        """获取一组文件的版本戳
+
+        paths中任一文件不存在时返回None；optional_paths中的文件不存在时以(0, 0)参与版本戳。
+        """
+        stamp = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return None
+            stamp.append((st.st_mtime_ns, st.st_size))
+        for path in optional_paths:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append((0, 0))
+        return tuple(stamp)
+
+    def get(self, key, stamp):
+        """获取版本戳一致的缓存条目，不一致时丢弃旧条目并返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.stamp != stamp:
+                self._remove(key)
+                return None
+            entry.checked_at = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(
+        self,
+        key,
+        index,
+        id_mapping,
+        metadata,
+        stamp,
+        nbytes,
+        segments=(),
+        base_version=None,
+    ):
+        """写入缓存条目，并按LRU淘汰超出内存上限的条目"""
+        entry = CachedIndex(
+            index, id_mapping, metadata, stamp, nbytes, segments, base_version
+        )
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                logger.warning(
+                    f"索引 {key} 大小 {nbytes} 字节超过缓存上限 {self.max_bytes}，不进行缓存"
+                )
+                return entry
+            self._entries[key] = entry
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.evictions += 1
+                logger.info(f"索引缓存已满，淘汰知识库 {old_key} 的索引")
+        return entry
+
+    def get_or_load(self, key, paths, loader, optional_paths=()):
+        """获取缓存条目，未命中或文件已变化时调用loader加载
+
+        loader返回 (index, id_mapping, metadata, segments, base_version)，同一知识库的并发加载只会执行一次。
+        距上次校验不足check_interval秒的条目直接返回，不访问文件系统。
+        """
+        if self.notifier is not None:
+            self.notifier.ensure_listener(self)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked_at < self.check_interval:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        stamp = self.file_stamp(paths, optional_paths)
+        if stamp is None:
+            return None
+
+        entry = self.get(key, stamp)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        with self._load_lock(key):
+            # 等待期间可能已被其他线程加载
+            stamp = self.file_stamp(paths, optional_paths)
+            if stamp is None:
+                return None
+            entry = self.get(key, stamp)
+            if entry is not None:
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            # 写入方依次替换多个文件，加载期间文件发生变化时重新加载，避免索引与映射版本不一致
+            for _ in range(3):
+                index, id_mapping, metadata, segments, base_version = loader()
+                new_stamp = self.file_stamp(paths, optional_paths)
+                if new_stamp == stamp:
+                    break
+                if new_stamp is None:
+                    return None
+                stamp = new_stamp
+            nbytes = sum(size for _, size in stamp) + sum(
+                self._segment_bytes(seg) for _, seg in segments
+            )
+            logger.debug(f"已加载知识库 {key} 的索引到缓存，估算大小 {nbytes} 字节")
+            return self.put(
+                key,
+                index,
+                id_mapping,
+                metadata,
+                stamp,
+                nbytes,
+                segments,
+                base_version,
+            )
+
+    def _load_lock(self, key):
+        """知识库对应的加载锁，不同知识库可能共用同一把锁"""
+        return self._load_locks[hash(key) % len(self._load_locks)]
+
+    def refresh(self, key, paths, optional_paths=(), id_mapping=None, metadata=None):
+        """仅ID映射或元数据发生变化时原地更新缓存条目，避免重新加载索引文件
+
+        id_mapping、metadata为None时保留原值。paths的第一个文件必须是索引文件；
+        若索引文件也已变化（例如被其他进程改写），则直接丢弃缓存条目。
+        """
+        self._notify(key)
+        stamp = self.file_stamp(paths, optional_paths)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if stamp is None or entry.stamp[0] != stamp[0]:
+                self._remove(key)
+                return
+            if id_mapping is not None:
+                entry.id_mapping = id_mapping
+            if metadata is not None:
+                entry.metadata = metadata
+            entry.stamp = stamp
+            entry.checked_at = time.monotonic()
+
+    def append_segment(
+        self, key, paths, optional_paths, offset, segment, segment_ids, metadata=None
+    ):
+        """把新提交的增量段追加到缓存条目，避免为一次小批量写入重新加载整个索引
+
+        只有基础索引文件未变化且条目的向量总数恰好等于offset时才追加，否则丢弃缓存条目。
+        """
+        self._notify(key)
+        stamp = self.file_stamp(paths, optional_paths)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if (
+                stamp is None
+                or entry.stamp[0] != stamp[0]
+                or len(entry.id_mapping) != offset
+            ):
+                self._remove(key)
+                return
+            entry.segments = entry.segments + [(offset, segment)]
+            entry.id_mapping = np.concatenate([entry.id_mapping, segment_ids])
+            if metadata is not None:
+                entry.metadata = metadata
+            entry.stamp = stamp
+            entry.checked_at = time.monotonic()
+            nbytes = self._segment_bytes(segment) + segment_ids.nbytes
+            entry.nbytes += nbytes
+            self._total_bytes += nbytes
+
+    @staticmethod
+    def _segment_bytes(segment):
+        """估算增量段的内存占用"""
+        return segment.nbytes
+
+    def invalidate(self, key):
+        """使指定知识库的缓存失效"""
+        self._notify(key)
+        with self._lock:
+            self._remove(key)
+
+    def mark_stale(self, key=None):
+        """要求指定知识库（key为None时为全部知识库）的条目在下次访问时重新校验版本戳"""
+        with self._lock:
+            entries = (
+                self._entries.values()
+                if key is None
+                else filter(None, [self._entries.get(key)])
+            )
+            for entry in entries:
+                entry.checked_at = 0
+
+    def _notify(self, key):
+        if self.notifier is not None:
+            self.notifier.publish(key)
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.nbytes
+
+
+# 全局索引缓存实例
+vector_index_cache = VectorIndexCache(
+    notifier=(
+        IndexChangeNotifier()
+        if getattr(settings, "VECTOR_INDEX_NOTIFY_REDIS", False)
+        else None
+    )
+)
@@ -0,0 +1,322 @@
+"""
+索引迁移模块
+旧版JSON格式ID映射到id_mapping.npy的迁移，以及按 VECTOR_INDEX_MIGRATION_POLICY 在线迁移知识库的索引类型
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .vector_backends import (
+    COMPRESSED_INDEX_TYPES,
+    SUPPORTED_INDEX_TYPES,
+    normalize_index_type,
+)
+from .vector_files import ID_MAP_FILENAME, get_write_lock, save_id_map, save_metadata
+from .vector_index_cache import vector_index_cache
+from .vector_segments import MANIFEST_FILENAME, load_manifest, reconstruct_all
+
+logger = logging.getLogger(__name__)
+
+# 旧版JSON格式的ID映射文件
+LEGACY_ID_MAP_FILENAME = "id_mapping.json"
+
+# 正在后台迁移索引类型的知识库ID
+_migrating = set()
+_migrating_guard = threading.Lock()
+
+
+def parse_migration_policy(policy):
+    """解析索引类型自动迁移策略
+
+    格式为逗号分隔的 "索引类型:向量数阈值"，例如 "HNSW:100000,IVFPQ:2000000"，
+    表示向量数达到10万时迁移为HNSW、达到200万时迁移为IVFPQ。返回按阈值升序排列的 [(阈值, 索引类型), ...]。
+    """
+    tiers = []
+    for item in (policy or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        index_type, _, threshold = item.rpartition(":")
+        index_type = normalize_index_type(index_type)
+        if index_type not in SUPPORTED_INDEX_TYPES or not threshold.strip().isdigit():
+            raise ValueError(f"无效的索引迁移策略: {item}")
+        tiers.append((int(threshold), index_type))
+    return sorted(tiers)
+
+
+def migrate_id_mapping(db_vector_dir):
+    """将旧版id_mapping.json转换为id_mapping.npy，返回是否执行了迁移
+
+    旧文件会被重命名为id_mapping.json.bak保留。
+    """
+    legacy_path = os.path.join(db_vector_dir, LEGACY_ID_MAP_FILENAME)
+    map_path = os.path.join(db_vector_dir, ID_MAP_FILENAME)
+    if not os.path.exists(legacy_path) or os.path.exists(map_path):
+        return False
+
+    with open(legacy_path, "r") as f:
+        legacy_mapping = json.load(f)
+
+    count = len(legacy_mapping)
+    vector_ids = np.fromiter(
+        (int(k) for k in legacy_mapping.keys()), dtype=np.int64, count=count
+    )
+    chunk_ids = np.fromiter(
+        (int(v) for v in legacy_mapping.values()), dtype=np.int64, count=count
+    )
+    size = int(vector_ids.max()) + 1 if count else 0
+    id_map = np.full(size, -1, dtype=np.int64)
+    id_map[vector_ids] = chunk_ids
+
+    save_id_map(map_path, id_map)
+    try:
+        os.replace(legacy_path, f"{legacy_path}.bak")
+    except FileNotFoundError:
+        # 其他进程已完成迁移
+        pass
+    logger.info(f"已将 {legacy_path} 迁移为 {map_path}，共 {count} 条映射")
+    return True
+
+
+class IndexMigrationMixin:
+    """VectorStore中在线迁移索引类型的方法"""
+
+    def _policy_index_type(self, metadata, total_vectors):
+        """按 VECTOR_INDEX_MIGRATION_POLICY 判断知识库是否需要迁移索引类型，返回目标类型或None
+
+        只向策略中阈值更高的类型迁移：当前类型为Flat或策略中阈值更低的类型时才会迁移，
+        手动选择的其他类型以及元数据中 auto_migrate 为false的知识库不受影响。
+        """
+        if not metadata or metadata.get("auto_migrate") is False:
+            return None
+        try:
+            tiers = parse_migration_policy(
+                getattr(settings, "VECTOR_INDEX_MIGRATION_POLICY", "")
+            )
+        except ValueError as e:
+            logger.error(str(e))
+            return None
+        reached = [
+            index_type for threshold, index_type in tiers if total_vectors >= threshold
+        ]
+        if not reached:
+            return None
+        target = reached[-1]
+        current = normalize_index_type(metadata.get("index_type", self.index_type))
+        if current == target or (current != "Flat" and current not in reached[:-1]):
+            return None
+        return target
+
+    def schedule_migration(self, knowledge_db_id, index_type):
+        """在后台线程把知识库迁移为指定索引类型，同一知识库同时只会有一个迁移任务
+
+        返回是否启动了新的迁移任务。
+        """
+        key = str(knowledge_db_id)
+        with _migrating_guard:
+            if key in _migrating:
+                return False
+            _migrating.add(key)
+
+        def run():
+            try:
+                from .vector_store import VectorStore
+
+                VectorStore(
+                    self.vector_dimension, self.index_type, local=True
+                ).migrate_index_type(knowledge_db_id, index_type)
+            finally:
+                with _migrating_guard:
+                    _migrating.discard(key)
+                # 后台线程使用的数据库连接需要手动关闭
+                connection.close()
+
+        threading.Thread(target=run, name=f"vector-migrate-{key}", daemon=True).start()
+        logger.info(
+            f"已启动知识库 {knowledge_db_id} 的后台索引迁移，目标类型 {index_type}"
+        )
+        return True
+
+    def migrate_index_type(self, knowledge_db_id, index_type):
+        """在线迁移知识库的索引类型
+
+        先在写锁内记录当前向量数和原始向量，释放写锁后训练并构建新索引，期间旧索引照常提供检索和写入；
+        构建完成后重新获取写锁，补入迁移期间新增的向量，与合并增量段一样写入新版本的基础索引并提交段清单，
+        检索进程在下次校验版本戳时切换到新索引。向量ID保持不变，迁移期间的删除也会保留。
+        迁移期间索引被压缩或重建（向量ID重新编号）时放弃本次迁移。
+        """
+        index_type = normalize_index_type(index_type)
+        if index_type not in SUPPORTED_INDEX_TYPES:
+            logger.error(f"索引迁移失败: 不支持的索引类型 {index_type}")
+            return False
+
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        try:
+            # 1. 记录迁移起点
+            with get_write_lock(knowledge_db_id):
+                if not self._ensure_index(knowledge_db_id):
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                    return False
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                metadata = self._read_metadata(metadata_path)
+                old_index_type = normalize_index_type(
+                    metadata.get("index_type", manifest["index_type"])
+                )
+                if old_index_type == index_type:
+                    logger.info(
+                        f"知识库 {knowledge_db_id} 的索引已是 {index_type}，无需迁移"
+                    )
+                    return True
+                epoch = int(manifest.get("epoch", 0))
+                metric = manifest["metric"]
+                start_total = manifest["base_ntotal"] + sum(
+                    seg["ntotal"] for seg in manifest["segments"]
+                )
+                # 原始向量文件只追加，之后写入的行不影响已映射的部分；没有原始向量文件时从索引重构
+                vectors = self._stored_vectors(
+                    db_vector_dir,
+                    manifest.get("base_version"),
+                    metadata,
+                    manifest["dimension"],
+                    start_total,
+                )
+                if vectors is None:
+                    vectors = reconstruct_all(
+                        *self._read_all(db_vector_dir, manifest)[:2]
+                    )
+                vectors = vectors[:start_total]
+                self._set_migration_status(
+                    knowledge_db_id,
+                    {
+                        "target": index_type,
+                        "status": "building",
+                        "vectors": start_total,
+                        "started_at": str(np.datetime64("now")),
+                    },
+                )
+
+            # 2. 不持有写锁构建新索引
+            logger.info(
+                f"开始为知识库 {knowledge_db_id} 构建 {index_type} 索引（{start_total} 个向量）"
+            )
+            new_index = self._build_index(vectors, metric, index_type)
+            del vectors
+
+            # 3. 补入迁移期间新增的向量并切换
+            with get_write_lock(knowledge_db_id):
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                metadata = self._read_metadata(metadata_path)
+                if (
+                    int(manifest.get("epoch", 0)) != epoch
+                    or manifest["metric"] != metric
+                ):
+                    logger.warning(
+                        f"知识库 {knowledge_db_id} 的索引在迁移期间被重建，放弃本次迁移"
+                    )
+                    self._set_migration_status(
+                        knowledge_db_id,
+                        dict(metadata.get("migration", {}), status="aborted"),
+                    )
+                    return False
+
+                index, segments, id_mapping = self._read_all(db_vector_dir, manifest)
+                total = len(id_mapping)
+                if total > start_total:
+                    new_vectors = self._stored_vectors(
+                        db_vector_dir,
+                        manifest.get("base_version"),
+                        metadata,
+                        manifest["dimension"],
+                        total,
+                    )
+                    if new_vectors is None:
+                        new_vectors = reconstruct_all(index, segments)
+                    new_index.add(
+                        np.ascontiguousarray(
+                            new_vectors[start_total:total], dtype="float32"
+                        )
+                    )
+                del index, segments
+
+                self._commit_base(
+                    db_vector_dir, manifest, new_index, index_type, id_mapping, metadata
+                )
+
+                if metadata:
+                    metadata["index_type"] = index_type
+                    metadata["rerank"] = index_type in COMPRESSED_INDEX_TYPES
+                    metadata["nlist"] = new_index.nlist
+                    # 原类型的检索参数不适用于新索引
+                    for key in ("nprobe", "ef_search", "search_tuning"):
+                        metadata.pop(key, None)
+                    metadata["migration"] = dict(
+                        metadata.get("migration", {}),
+                        status="completed",
+                        from_type=old_index_type,
+                        finished_at=str(np.datetime64("now")),
+                    )
+                    metadata["last_updated"] = str(np.datetime64("now"))
+                    save_metadata(metadata_path, metadata)
+                vector_index_cache.invalidate(str(knowledge_db_id))
+                self.index_type = index_type
+
+            self._update_knowledge_db_index_type(knowledge_db_id, index_type)
+            logger.info(
+                f"知识库 {knowledge_db_id} 的索引已由 {old_index_type} 迁移为 {index_type}，"
+                f"共 {new_index.ntotal} 个向量（迁移期间新增 {total - start_total} 个）"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"索引迁移失败: {str(e)}", exc_info=True)
+            try:
+                with get_write_lock(knowledge_db_id):
+                    metadata = self._read_metadata(metadata_path)
+                    self._set_migration_status(
+                        knowledge_db_id,
+                        dict(
+                            metadata.get("migration", {}), status="failed", error=str(e)
+                        ),
+                    )
+            except Exception:
+                pass
+            return False
+
+    def _set_migration_status(self, knowledge_db_id, status):
+        """在元数据中记录索引迁移状态（需持有写锁）"""
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+        metadata = self._read_metadata(metadata_path)
+        if not metadata:
+            return
+        metadata["migration"] = status
+        save_metadata(metadata_path, metadata)
+        vector_index_cache.refresh(
+            str(knowledge_db_id),
+            list(self._base_paths(db_vector_dir, load_manifest(db_vector_dir))),
+            optional_paths=[
+                metadata_path,
+                os.path.join(db_vector_dir, MANIFEST_FILENAME),
+            ],
+            metadata=metadata,
+        )
+
+    @staticmethod
+    def _update_knowledge_db_index_type(knowledge_db_id, index_type):
+        """同步知识库表中记录的索引类型"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE knowledge_database SET index_type = %s WHERE id = %s",
+                    [index_type, knowledge_db_id],
+                )
+        except Exception as e:
+            logger.error(f"更新知识库 {knowledge_db_id} 的索引类型失败: {str(e)}")
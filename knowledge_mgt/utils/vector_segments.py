@@ -0,0 +1,419 @@
+"""
+增量段模块
+段清单（manifest.json）与增量段文件的读写、基础索引与增量段的联合检索，
+以及VectorStore中维护段清单、合并增量段的方法
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .vector_backends import BACKENDS, METRIC_L2, merge_results, normalize_index_type
+from .vector_files import (
+    ID_MAP_FILENAME,
+    RAW_VECTORS_FILENAMES,
+    get_write_lock,
+    link_file,
+    load_id_map,
+    raw_vectors_dtype,
+    raw_vectors_path,
+    remove_file,
+    resize_id_map,
+    save_id_map,
+    save_metadata,
+    save_raw_vectors,
+    versioned_filename,
+)
+from .vector_index_cache import vector_index_cache
+
+logger = logging.getLogger(__name__)
+
+# 段清单文件：记录检索后端、基础索引向量数及各增量段，每次写入通过重命名原子提交
+MANIFEST_FILENAME = "manifest.json"
+# 增量段目录：每次添加向量写入一个不可变的小段（精确检索索引 + ID映射），由后台合并到基础索引
+SEGMENTS_DIRNAME = "segments"
+
+# 正在后台合并增量段的知识库ID
+_merging = set()
+_merging_guard = threading.Lock()
+
+
+def reconstruct_all(index, segments=()):
+    """取出基础索引中的全部向量（float32），segments为增量段列表 [(起始向量ID, 段索引), ...]，其向量按顺序拼接在基础索引之后"""
+    parts = [index.reconstruct_all()] + [
+        segment.reconstruct_all() for _, segment in segments
+    ]
+    return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def load_manifest(db_vector_dir):
+    """读取段清单，旧版索引目录没有清单时返回None"""
+    path = os.path.join(db_vector_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(db_vector_dir, manifest):
+    """提交段清单：版本号加一后先写临时文件再重命名，重命名完成即视为提交"""
+    manifest["version"] = int(manifest.get("version", 0)) + 1
+    manifest["updated_at"] = str(np.datetime64("now"))
+    save_metadata(os.path.join(db_vector_dir, MANIFEST_FILENAME), manifest)
+
+
+def segment_paths(db_vector_dir, name):
+    """增量段的索引文件与ID映射文件路径"""
+    segment_dir = os.path.join(db_vector_dir, SEGMENTS_DIRNAME)
+    return os.path.join(segment_dir, f"{name}.index"), os.path.join(
+        segment_dir, f"{name}.ids.npy"
+    )
+
+
+def open_segments(db_vector_dir, manifest, index, base_ids, readonly=False, mmap=False):
+    """按段清单打开增量段，返回 (段列表, 覆盖基础索引与全部段的ID映射)
+
+    段列表为 [(起始向量ID, 段索引), ...]，段索引由基础索引所属的检索后端读取，readonly为True时可使用内存映射。
+    index和base_ids必须是按同一份段清单中的基础索引版本打开的文件。
+    """
+    backend_cls = type(index)
+    metric = (manifest or {}).get("metric", index.metric)
+    id_parts = [resize_id_map(base_ids, index.ntotal)]
+    segments = []
+    end = index.ntotal
+    for seg in (manifest or {}).get("segments", []):
+        if seg["offset"] != end:
+            raise RuntimeError(
+                f"{db_vector_dir} 的段 {seg['name']} 起始编号 {seg['offset']} 与已有向量数 {end} 不一致"
+            )
+        seg_index_path, seg_ids_path = segment_paths(db_vector_dir, seg["name"])
+        segment = backend_cls.load(seg_index_path, metric=metric, readonly=readonly)
+        segments.append((end, segment))
+        id_parts.append(
+            resize_id_map(load_id_map(seg_ids_path, mmap=mmap), segment.ntotal)
+        )
+        end += segment.ntotal
+    id_mapping = np.concatenate(id_parts) if len(id_parts) > 1 else id_parts[0]
+    return segments, id_mapping
+
+
+def remove_base_files(db_vector_dir, version):
+    """删除第version版基础索引的全部文件（各检索后端的索引文件、ID映射和原始向量）"""
+    filenames = [backend_cls.index_filename for backend_cls in BACKENDS.values()]
+    filenames += [ID_MAP_FILENAME, *RAW_VECTORS_FILENAMES.values()]
+    for filename in filenames:
+        remove_file(os.path.join(db_vector_dir, versioned_filename(filename, version)))
+
+
+def remove_orphan_segments(db_vector_dir, manifest):
+    """删除不在段清单中的段文件（已合并的段或提交前中断留下的段）"""
+    segment_dir = os.path.join(db_vector_dir, SEGMENTS_DIRNAME)
+    if not os.path.isdir(segment_dir):
+        return
+    live = {seg["name"] for seg in manifest.get("segments", [])}
+    for filename in os.listdir(segment_dir):
+        if filename.split(".", 1)[0] not in live:
+            remove_file(os.path.join(segment_dir, filename))
+
+
+def search_segments(index, segments, queries, k, params=None, mask=None):
+    """在基础索引和各增量段中分别检索TopK，按距离合并为全局TopK
+
+    params只作用于基础索引，增量段为精确检索。mask为按向量ID排列的布尔数组，
+    提供时由各检索后端在索引内部只检索mask为True的向量。
+    """
+    if not segments:
+        return index.search(queries, k, params=params, mask=mask)
+    results = []
+    for offset, part, part_params in [(0, index, params)] + [
+        (offset, seg, None) for offset, seg in segments
+    ]:
+        if part.ntotal == 0:
+            continue
+        part_mask = None
+        if mask is not None:
+            part_mask = mask[offset : offset + part.ntotal]
+            if not part_mask.any():
+                continue
+        distances, labels = part.search(
+            queries, min(k, part.ntotal), params=part_params, mask=part_mask
+        )
+        results.append((distances, np.where(labels >= 0, labels + offset, -1)))
+    return merge_results(results, len(queries), k, index.metric)
+
+
+class SegmentMixin:
+    """VectorStore中维护段清单与合并增量段的方法
+
+    每次添加向量写入一个不可变的增量段，段清单记录基础索引版本与各段，重命名清单文件即提交；
+    增量段累积到一定规模后由后台线程并入基础索引。
+    """
+
+    def _base_paths(self, db_vector_dir, manifest):
+        """段清单指向的当前检索后端基础索引文件与ID映射文件路径，旧版目录没有清单时为固定文件名"""
+        version = (manifest or {}).get("base_version")
+        return (
+            os.path.join(
+                db_vector_dir,
+                versioned_filename(self.backend_cls.index_filename, version),
+            ),
+            os.path.join(db_vector_dir, versioned_filename(ID_MAP_FILENAME, version)),
+        )
+
+    @staticmethod
+    def _layout_id_mapping(db_vector_dir, manifest):
+        """按段清单拼接基础索引与各增量段的ID映射，不需要读取索引文件，旧版目录没有清单时直接读取ID映射"""
+        base_ids = load_id_map(
+            os.path.join(
+                db_vector_dir,
+                versioned_filename(
+                    ID_MAP_FILENAME, (manifest or {}).get("base_version")
+                ),
+            )
+        )
+        if manifest is None:
+            return np.asarray(base_ids, dtype=np.int64)
+        id_parts = [resize_id_map(base_ids, manifest["base_ntotal"])]
+        for seg in manifest.get("segments", []):
+            id_parts.append(
+                resize_id_map(
+                    load_id_map(segment_paths(db_vector_dir, seg["name"])[1]),
+                    seg["ntotal"],
+                )
+            )
+        return np.concatenate(id_parts)
+
+    def _load_manifest_for_write(self, db_vector_dir):
+        """写操作前读取段清单（需持有写锁）
+
+        其他进程可能在本进程获取写锁之前提交了新的段清单，因此每次写操作都在获取写锁后从磁盘重新读取，
+        不使用缓存中的清单。旧版索引目录没有清单时按固定文件名的基础索引生成。
+        """
+        manifest = load_manifest(db_vector_dir)
+        if manifest is not None:
+            return manifest
+
+        metadata = self._read_metadata(os.path.join(db_vector_dir, "metadata.json"))
+        index = self.backend_cls.load(
+            self._base_paths(db_vector_dir, None)[0],
+            metric=metadata.get("metric", METRIC_L2),
+            readonly=True,
+        )
+        manifest = {"next_segment": 1, "segments": []}
+        index_type = normalize_index_type(metadata.get("index_type", self.index_type))
+        self._set_manifest_base(manifest, index, index_type)
+        save_manifest(db_vector_dir, manifest)
+        return manifest
+
+    @staticmethod
+    def _set_manifest_base(manifest, index, index_type):
+        """用基础索引的实际状态更新段清单中的基础索引信息"""
+        manifest["backend"] = index.name
+        manifest["dimension"] = index.dimension
+        manifest["metric"] = index.metric
+        manifest["index_type"] = index_type
+        manifest["staging"] = index.is_staging(index_type)
+        manifest["base_ntotal"] = index.ntotal
+
+    def _commit_base(
+        self,
+        db_vector_dir,
+        manifest,
+        index,
+        index_type,
+        id_mapping,
+        metadata,
+        vectors=None,
+    ):
+        """写入新版本的基础索引并提交段清单，清空增量段（需持有写锁）
+
+        基础索引、ID映射和原始向量写入下一版本的文件，当前版本的文件保持不变，重命名段清单是唯一的切换点：
+        读取方按同一份清单中的版本打开基础索引和增量段，不会把新的基础索引与旧清单中的段偏移组合，
+        提交前中断只会留下未被引用的文件。vectors为空时原始向量不变，新版本沿用当前版本的原始向量文件。
+        提交后删除旧版本的文件和已合并的段文件。
+        """
+        previous = manifest.get("base_version")
+        version = int(previous or 0) + 1
+        index_path, mapping_path = self._base_paths(
+            db_vector_dir, {"base_version": version}
+        )
+        new_raw_path = raw_vectors_path(db_vector_dir, metadata, version)
+        if vectors is not None:
+            save_raw_vectors(new_raw_path, vectors, raw_vectors_dtype(metadata))
+        else:
+            link_file(raw_vectors_path(db_vector_dir, metadata, previous), new_raw_path)
+        save_id_map(mapping_path, id_mapping)
+        index.save(index_path)
+
+        manifest["base_version"] = version
+        manifest["segments"] = []
+        self._set_manifest_base(manifest, index, index_type)
+        save_manifest(db_vector_dir, manifest)
+        remove_base_files(db_vector_dir, previous)
+        remove_orphan_segments(db_vector_dir, manifest)
+
+    def _read_all(self, db_vector_dir, manifest):
+        """读取可修改的基础索引、全部增量段及完整ID映射（需持有写锁）"""
+        index_path, mapping_path = self._base_paths(db_vector_dir, manifest)
+        index = self.backend_cls.load(index_path, metric=manifest["metric"])
+        base_ids = load_id_map(mapping_path)
+        segments, id_mapping = open_segments(db_vector_dir, manifest, index, base_ids)
+        return index, segments, np.array(id_mapping, dtype=np.int64)
+
+    def _merge_action(self, manifest, metadata):
+        """根据段清单决定是否需要合并增量段
+
+        返回'fold'表示把全部增量段并入基础索引（增量段向量数达到基础索引的 VECTOR_SEGMENT_MERGE_RATIO，
+        或暂存索引已达到训练条件），'consolidate'表示段数超过 VECTOR_SEGMENT_MAX_COUNT 时把增量段合并为一个段，
+        不需要合并时返回None。按比例并入基础索引使每个向量被重写的次数有上限，写入开销与批量大小成正比。
+        """
+        segments = manifest.get("segments", [])
+        if not segments:
+            return None
+        segment_vectors = sum(seg["ntotal"] for seg in segments)
+        merge_ratio = getattr(settings, "VECTOR_SEGMENT_MERGE_RATIO", 0.1)
+        if segment_vectors >= merge_ratio * manifest.get("base_ntotal", 0):
+            return "fold"
+        index_type = normalize_index_type(
+            metadata.get("index_type", manifest.get("index_type", self.index_type))
+        )
+        if manifest.get("staging") and self.backend_cls.ready_to_train(
+            manifest["base_ntotal"] + segment_vectors, index_type
+        ):
+            return "fold"
+        if len(segments) > getattr(settings, "VECTOR_SEGMENT_MAX_COUNT", 8):
+            return "consolidate"
+        return None
+
+    def _schedule_merge(self, knowledge_db_id):
+        """在后台线程合并知识库的增量段，同一知识库同时只会有一个合并任务"""
+        key = str(knowledge_db_id)
+        with _merging_guard:
+            if key in _merging:
+                return
+            _merging.add(key)
+
+        def run():
+            try:
+                from .vector_store import VectorStore
+
+                VectorStore(
+                    self.vector_dimension, self.index_type, local=True
+                ).merge_segments(knowledge_db_id)
+            finally:
+                with _merging_guard:
+                    _merging.discard(key)
+
+        threading.Thread(target=run, name=f"vector-merge-{key}", daemon=True).start()
+        logger.info(f"已启动知识库 {knowledge_db_id} 的后台增量段合并")
+
+    def merge_segments(self, knowledge_db_id, force=False):
+        """合并知识库的增量段，force为True时无论是否达到合并条件都把增量段并入基础索引
+
+        合并只改变向量的存放位置，不改变向量ID，分块表中的vector_id无需更新。
+        """
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        try:
+            with get_write_lock(knowledge_db_id):
+                if not self._ensure_index(knowledge_db_id):
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                    return False
+
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                metadata = self._read_metadata(metadata_path)
+                action = self._merge_action(manifest, metadata)
+                if force and manifest["segments"]:
+                    action = "fold"
+                if action is None:
+                    return True
+
+                index_type = normalize_index_type(
+                    metadata.get("index_type", manifest["index_type"])
+                )
+                merged = len(manifest["segments"])
+
+                if action == "consolidate":
+                    # 只合并增量段，不触碰基础索引
+                    segment_vectors, segment_ids = [], []
+                    for seg in manifest["segments"]:
+                        seg_index_path, seg_ids_path = segment_paths(
+                            db_vector_dir, seg["name"]
+                        )
+                        segment = self.backend_cls.load(
+                            seg_index_path, metric=manifest["metric"]
+                        )
+                        segment_vectors.append(segment.reconstruct_all())
+                        segment_ids.append(
+                            resize_id_map(load_id_map(seg_ids_path), segment.ntotal)
+                        )
+                    segment = self.backend_cls.create(
+                        manifest["dimension"], manifest["metric"]
+                    )
+                    segment.add(np.concatenate(segment_vectors))
+                    name = f"seg_{int(manifest.get('next_segment', 1)):08d}"
+                    seg_index_path, seg_ids_path = segment_paths(db_vector_dir, name)
+                    segment.save(seg_index_path)
+                    save_id_map(seg_ids_path, np.concatenate(segment_ids))
+                    manifest["segments"] = [
+                        {
+                            "name": name,
+                            "offset": manifest["segments"][0]["offset"],
+                            "ntotal": segment.ntotal,
+                        }
+                    ]
+                    manifest["next_segment"] = int(manifest.get("next_segment", 1)) + 1
+                    save_manifest(db_vector_dir, manifest)
+                    remove_orphan_segments(db_vector_dir, manifest)
+                else:
+                    index, segments, id_mapping = self._read_all(
+                        db_vector_dir, manifest
+                    )
+                    self.vector_dimension = index.dimension
+                    self.index_type = index_type
+                    if index.is_staging(index_type) and self.backend_cls.ready_to_train(
+                        len(id_mapping), index_type
+                    ):
+                        # 向量数达到训练阈值后，由暂存索引切换为训练好的索引
+                        vectors = np.ascontiguousarray(
+                            self._load_vectors(
+                                db_vector_dir,
+                                manifest.get("base_version"),
+                                index,
+                                metadata,
+                                segments,
+                            ),
+                            dtype="float32",
+                        )
+                        index = self._build_index(vectors, index.metric)
+                        logger.info(
+                            f"知识库 {knowledge_db_id} 的向量数达到 {index.ntotal}，已切换为{index_type}索引"
+                        )
+                    else:
+                        for _, segment in segments:
+                            index.add(segment.reconstruct_all())
+
+                    self._commit_base(
+                        db_vector_dir, manifest, index, index_type, id_mapping, metadata
+                    )
+
+                    if metadata:
+                        metadata["nlist"] = index.nlist
+                        metadata["last_updated"] = str(np.datetime64("now"))
+                        save_metadata(metadata_path, metadata)
+
+                vector_index_cache.invalidate(str(knowledge_db_id))
+
+            logger.info(
+                f"已合并知识库 {knowledge_db_id} 的 {merged} 个增量段（{action}）"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"合并增量段失败: {str(e)}", exc_info=True)
+            return False
@@ -0,0 +1,365 @@
+"""
+本机向量服务模块
+由一个独立进程（manage.py run_vector_service）持有全部知识库索引并串行化写入，
+gunicorn工作进程和入库线程通过Unix socket访问，同一主机上的索引内存只占用一份，写入不会互相覆盖
+
+协议：每条消息为 12字节头部（魔数、版本、JSON长度、二进制长度）+ JSON + 二进制区，
+请求和响应中的numpy数组按原始字节放在二进制区，JSON中只记录偏移、类型和形状
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+from datetime import date, datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import vector_store
+from .vector_index_cache import vector_index_cache
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_MAGIC = b"ZQ"
+PROTOCOL_VERSION = 1
+# 魔数(2字节)、版本(2字节)、JSON长度(4字节)、二进制区长度(4字节)，网络字节序
+HEADER = struct.Struct("!2sHII")
+# 单条消息的长度上限，防止读取到错误数据时分配过大的缓冲区
+MAX_MESSAGE_BYTES = 1024 * 1024 * 1024
+
+# 允许远程调用的 VectorStore 方法
+SERVICE_METHODS = (
+    "create_index",
+    "add_vectors",
+    "search",
+    "search_batch",
+    "delete_vectors",
+    "compact_index",
+    "merge_segments",
+    "schedule_migration",
+    "migrate_index_type",
+    "get_index_info",
+    "tune_search_params",
+    "rebuild_index",
+    "has_stored_vectors",
+    "rebuild_from_disk",
+    "convert_metric",
+    "update_search_config",
+    "cleanup_index",
+    "sync_chunk_attributes",
+)
+# 服务不可用时可以回退到进程内索引执行的只读方法
+READ_METHODS = ("search", "search_batch", "get_index_info", "has_stored_vectors")
+# 以float32矩阵传输的向量参数：方法名 -> (参数位置, 参数名)
+VECTOR_ARGUMENTS = {
+    "add_vectors": (2, "vectors"),
+    "search": (1, "query_vector"),
+    "search_batch": (1, "query_vectors"),
+    "rebuild_index": (1, "vectors_data"),
+}
+# 只读方法在服务端执行出错时的返回值，与 VectorStore 出错时的返回值一致；写方法出错时抛出 VectorServiceError
+FAILURE_RESULTS = {
+    "search": [],
+    "search_batch": [],
+    "get_index_info": None,
+    "has_stored_vectors": False,
+}
+# 请求中允许传给 VectorStore 构造函数的参数
+STORE_ARGUMENTS = ("vector_dimension", "index_type", "metric")
+
+
+class VectorServiceError(Exception):
+    """向量服务通信失败"""
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def encode_message(payload):
+    """把消息编码为字节串，payload中的numpy数组写入二进制区"""
+    blobs = []
+    offset = 0
+
+    def pack(value):
+        nonlocal offset
+        if isinstance(value, np.ndarray):
+            data = np.ascontiguousarray(value).tobytes()
+            ref = {
+                "__ndarray__": [offset, len(data), value.dtype.str, list(value.shape)]
+            }
+            blobs.append(data)
+            offset += len(data)
+            return ref
+        if isinstance(value, dict):
+            return {key: pack(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [pack(item) for item in value]
+        return value
+
+    body = json.dumps(pack(payload), default=_json_default, ensure_ascii=False).encode(
+        "utf-8"
+    )
+    blob = b"".join(blobs)
+    return (
+        HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, len(body), len(blob))
+        + body
+        + blob
+    )
+
+
+def decode_message(body, blob):
+    """解码JSON与二进制区，还原的numpy数组直接引用二进制区，不复制数据"""
+
+    def unpack(value):
+        if isinstance(value, dict):
+            ref = value.get("__ndarray__")
+            if ref is not None and len(value) == 1:
+                start, length, dtype, shape = ref
+                return np.frombuffer(
+                    blob,
+                    dtype=np.dtype(dtype),
+                    count=length // np.dtype(dtype).itemsize,
+                    offset=start,
+                ).reshape(shape)
+            return {key: unpack(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [unpack(item) for item in value]
+        return value
+
+    return unpack(json.loads(body.decode("utf-8")))
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("连接已关闭")
+        received += count
+    # 返回可写缓冲区，解码出的数组可以被服务端原地归一化
+    return buffer
+
+
+def recv_message(sock):
+    """从socket读取一条完整消息"""
+    magic, version, body_len, blob_len = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if magic != PROTOCOL_MAGIC or version != PROTOCOL_VERSION:
+        raise VectorServiceError(f"无法识别的消息头: {magic!r} v{version}")
+    if body_len + blob_len > MAX_MESSAGE_BYTES:
+        raise VectorServiceError(f"消息长度 {body_len + blob_len} 超过上限")
+    body = _recv_exact(sock, body_len)
+    blob = _recv_exact(sock, blob_len) if blob_len else bytearray()
+    return decode_message(body, blob)
+
+
+def send_message(sock, payload):
+    sock.sendall(encode_message(payload))
+
+
+class VectorServiceHandler(socketserver.BaseRequestHandler):
+    """处理一个客户端连接，连接上的请求依次执行，直到客户端断开"""
+
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            except VectorServiceError as e:
+                logger.warning(f"向量服务收到无效消息，关闭连接: {str(e)}")
+                return
+            try:
+                send_message(self.request, self.server.dispatch(request))
+            except (ConnectionError, OSError):
+                return
+
+
+class VectorServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """向量服务：每个客户端连接一个线程
+
+    检索在各线程中并发执行，同一知识库的写操作由 VectorStore 的进程内写锁串行执行；
+    全部写入都经过本进程，不同工作进程之间不会再竞争同一组索引文件。
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or settings.VECTOR_SERVICE_SOCKET
+        if os.path.exists(self.socket_path):
+            # 上次退出时残留的socket文件，确认没有服务在监听后删除
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f"向量服务已在 {self.socket_path} 运行")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        # 本进程内构造的 VectorStore 直接访问索引，不能再连接自己
+        vector_store.mark_service_process()
+        super().__init__(self.socket_path, VectorServiceHandler)
+        os.chmod(self.socket_path, 0o660)
+
+    def dispatch(self, request):
+        """执行一条请求，返回响应消息"""
+        method = request.get("method")
+        if method == "ping":
+            return {
+                "ok": True,
+                "result": {"pid": os.getpid(), "cache": vector_index_cache.stats()},
+            }
+        if method not in SERVICE_METHODS:
+            return {"ok": False, "error": f"不支持的方法: {method}"}
+        try:
+            options = request.get("store") or {}
+            store = vector_store.VectorStore(
+                **{name: options[name] for name in STORE_ARGUMENTS if name in options}
+            )
+            result = getattr(store, method)(
+                *request.get("args", []), **request.get("kwargs", {})
+            )
+            return {"ok": True, "result": result}
+        except Exception as e:
+            logger.error(f"向量服务执行 {method} 失败: {str(e)}", exc_info=True)
+            return {"ok": False, "error": str(e)}
+        finally:
+            close_old_connections()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class VectorServiceClient:
+    """向量服务客户端，接口与 VectorStore 相同，可直接替换
+
+    配置了 VECTOR_SERVICE_SOCKET 时，VectorStore(...) 在工作进程中返回本类的实例。每个线程使用各自的长连接，
+    fork后的子进程会重新连接。服务不可用时，只读方法回退为在进程内直接读取索引；
+    写方法无法在服务中执行（连接失败或服务端抛出异常）时抛出 VectorServiceError，避免调用方误以为写入成功。
+    """
+
+    def __init__(
+        self, vector_dimension=384, index_type="Flat", metric=None, socket_path=None
+    ):
+        self.vector_dimension = vector_dimension
+        self.index_type = vector_store.normalize_index_type(index_type)
+        self.metric = metric
+        self.socket_path = socket_path or settings.VECTOR_SERVICE_SOCKET
+        self.vector_dir = os.path.join(settings.MEDIA_ROOT, "vector_indexes")
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None and self._local.pid == os.getpid():
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(getattr(settings, "VECTOR_SERVICE_TIMEOUT", 300))
+        sock.connect(self.socket_path)
+        self._local.sock = sock
+        self._local.pid = os.getpid()
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _request(self, payload):
+        # 长连接可能已被服务端关闭（例如服务重启），重连一次
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_message(sock, payload)
+                return recv_message(sock)
+            except (ConnectionError, FileNotFoundError, socket.timeout, OSError) as e:
+                self._close()
+                if attempt == 1 or isinstance(e, socket.timeout):
+                    raise VectorServiceError(
+                        f"无法访问向量服务 {self.socket_path}: {str(e)}"
+                    )
+
+    def _call(self, method, args, kwargs):
+        args = list(args)
+        if method in VECTOR_ARGUMENTS:
+            # 向量以原始float32字节传输，不经过JSON
+            position, name = VECTOR_ARGUMENTS[method]
+            if position < len(args) and args[position] is not None:
+                args[position] = np.asarray(args[position], dtype="float32")
+            elif kwargs.get(name) is not None:
+                kwargs[name] = np.asarray(kwargs[name], dtype="float32")
+        payload = {
+            "method": method,
+            "store": {
+                "vector_dimension": self.vector_dimension,
+                "index_type": self.index_type,
+                "metric": self.metric,
+            },
+            "args": list(args),
+            "kwargs": kwargs,
+        }
+        try:
+            response = self._request(payload)
+        except VectorServiceError as e:
+            if method in READ_METHODS:
+                logger.warning(f"{str(e)}，在进程内执行 {method}")
+                store = vector_store.VectorStore(
+                    self.vector_dimension, self.index_type, self.metric, local=True
+                )
+                return getattr(store, method)(*args, **kwargs)
+            logger.error(f"{str(e)}，{method} 未执行")
+            raise
+        if not response.get("ok"):
+            logger.error(f"向量服务执行 {method} 失败: {response.get('error')}")
+            if method in READ_METHODS:
+                return FAILURE_RESULTS.get(method)
+            raise VectorServiceError(
+                f"向量服务执行 {method} 失败: {response.get('error')}"
+            )
+        return response.get("result")
+
+    def ping(self):
+        """检查向量服务是否可用，返回服务进程号和索引缓存统计，不可用时返回None"""
+        try:
+            response = self._request({"method": "ping"})
+        except VectorServiceError as e:
+            logger.warning(str(e))
+            return None
+        return response.get("result")
+
+
+def _proxy(name):
+    def method(self, *args, **kwargs):
+        return self._call(name, args, kwargs)
+
+    method.__name__ = name
+    method.__doc__ = getattr(vector_store.VectorStore, name).__doc__
+    return method
+
+
+for _name in SERVICE_METHODS:
+    setattr(VectorServiceClient, _name, _proxy(_name))
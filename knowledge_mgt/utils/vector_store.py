@@ -1,59 +1,261 @@
 """
 向量存储模块
-用于管理FAISS索引和向量操作，支持用户级别隔离
+用于管理知识库的向量索引和向量操作，支持用户级别隔离；索引的构建与检索由 vector_backends 中的检索后端完成
 """
 
-import os
 import json
 import logging
+import os
+from datetime import datetime, timedelta
+
 import numpy as np
 from django.conf import settings
 from django.db import connection
 
-logger = logging.getLogger(__name__)
-
-try:
-    import faiss
-    FAISS_AVAILABLE = True
-except ImportError:
-    FAISS_AVAILABLE = False
-    logger.warning("FAISS未安装，向量存储功能不可用")
+from .vector_backends import (
+    BACKENDS,
+    COMPRESSED_INDEX_TYPES,
+    FAISS_AVAILABLE,
+    METRIC_COSINE,
+    METRIC_L2,
+    SUPPORTED_INDEX_TYPES,
+    NumpyBackend,
+    get_backend_class,
+    normalize_index_type,
+    normalize_rows,
+)
+from .vector_files import (
+    CHUNK_ATTRIBUTE_DTYPE,
+    CHUNK_ATTRIBUTES_FILENAME,
+    ID_MAP_FILENAME,
+    RAW_VECTORS_FILENAMES,
+    append_chunk_attributes,
+    append_raw_vectors,
+    get_write_lock,
+    load_id_map,
+    load_raw_vectors,
+    raw_vectors_dtype,
+    raw_vectors_path,
+    resize_id_map,
+    save_chunk_attributes,
+    save_id_map,
+    save_metadata,
+    versioned_filename,
+)
+from .vector_index_cache import vector_index_cache
+from .vector_migration import IndexMigrationMixin, migrate_id_mapping
+from .vector_segments import (
+    MANIFEST_FILENAME,
+    SEGMENTS_DIRNAME,
+    SegmentMixin,
+    load_manifest,
+    open_segments,
+    reconstruct_all,
+    save_manifest,
+    search_segments,
+    segment_paths,
+)
+from .vector_tombstones import TombstoneMixin, count_tombstones
 
+logger = logging.getLogger(__name__)
 
-class VectorStore:
-    """向量存储类，用于管理FAISS索引和向量操作，支持用户级别隔离"""
-
-    def __init__(self, vector_dimension=384, index_type="Flat"):
-        if not FAISS_AVAILABLE:
-            raise ImportError("FAISS未安装，无法使用向量存储功能")
-            
+if not FAISS_AVAILABLE:
+    logger.warning("FAISS未安装，向量存储使用NumPy检索后端")
+
+
+# 重排序时候选集相对TopK的放大倍数
+DEFAULT_RERANK_FACTOR = 4
+
+
+def metric_for_embedding_model(api_type, model_name):
+    """根据嵌入模型推断新建知识库使用的度量方式，通义千问等在线模型使用余弦相似度"""
+    if api_type == "online" or "dashscope" in (model_name or "").lower():
+        return METRIC_COSINE
+    return METRIC_L2
+
+
+def rerank_candidates(vectors, query, labels, metric):
+    """用全精度向量对候选结果重新计算距离并排序
+
+    余弦度量返回内积相似度（从高到低），L2度量返回L2距离平方（从低到高）。
+    """
+    labels = np.sort(labels[(labels >= 0) & (labels < len(vectors))])
+    candidates = np.asarray(vectors[labels], dtype="float32")
+    if metric == METRIC_COSINE:
+        scores = candidates @ query
+        order = np.argsort(-scores)
+    else:
+        scores = np.square(candidates - query).sum(axis=1)
+        order = np.argsort(scores)
+    return scores[order], labels[order]
+
+
+def normalize_file_type(file_type):
+    """统一文件类型写法：小写且不带点，如 .PDF -> pdf"""
+    return str(file_type or "").strip().lower().lstrip(".")
+
+
+def to_timestamp(value, end_of_day=False):
+    """将datetime、ISO格式字符串或秒级时间戳转换为秒级时间戳
+
+    end_of_day为True且value只有日期时，返回次日零点，用作不含上界的截止时间。
+    """
+    if isinstance(value, (int, float, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        text = value.strip()
+        parsed = datetime.fromisoformat(text)
+        if end_of_day and len(text) == 10:
+            parsed += timedelta(days=1)
+        return int(parsed.timestamp())
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    raise ValueError(f"无法识别的时间: {value}")
+
+
+def normalize_search_filters(filters):
+    """校验并规范化检索过滤条件
+
+    支持 document_ids（文档ID列表）、file_types（文件类型列表）、date_from / date_to
+    （上传时间范围，日期或ISO时间字符串，只有日期的date_to包含当天）。
+    返回规范化后的字典，没有任何条件时返回None；格式错误时抛出ValueError。
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters必须是对象")
+    unknown = set(filters) - {"document_ids", "file_types", "date_from", "date_to"}
+    if unknown:
+        raise ValueError(f"不支持的过滤条件: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    try:
+        if filters.get("document_ids") is not None:
+            normalized["document_ids"] = [
+                int(doc_id) for doc_id in filters["document_ids"]
+            ]
+        if filters.get("file_types") is not None:
+            normalized["file_types"] = [
+                normalize_file_type(file_type) for file_type in filters["file_types"]
+            ]
+        if filters.get("date_from") is not None:
+            normalized["date_from"] = to_timestamp(filters["date_from"])
+        if filters.get("date_to") is not None:
+            normalized["date_to"] = to_timestamp(filters["date_to"], end_of_day=True)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"过滤条件格式错误: {str(e)}")
+    return normalized or None
+
+
+def chunk_attribute_rows(chunk_ids, document_id=None, file_type=None, created_at=None):
+    """构造分块属性行，属性可以是整批共用的单个值，也可以是与chunk_ids等长的序列"""
+    rows = np.zeros(len(chunk_ids), dtype=CHUNK_ATTRIBUTE_DTYPE)
+    rows["chunk_id"] = np.asarray(chunk_ids, dtype=np.int64)
+    rows["document_id"] = -1 if document_id is None else document_id
+    if created_at is None or isinstance(created_at, (str, datetime)):
+        rows["created_at"] = to_timestamp(created_at or datetime.now())
+    else:
+        rows["created_at"] = [to_timestamp(value) for value in created_at]
+    if file_type is None or isinstance(file_type, str):
+        rows["file_type"] = normalize_file_type(file_type).encode()[:16]
+    else:
+        rows["file_type"] = [
+            normalize_file_type(value).encode()[:16] for value in file_type
+        ]
+    return rows
+
+
+def labels_to_chunk_ids(id_map, labels):
+    """将检索返回的向量ID批量转换为分块ID，无效位置返回-1"""
+    labels = np.asarray(labels, dtype=np.int64)
+    valid = (labels >= 0) & (labels < len(id_map))
+    chunk_ids = np.full(labels.shape, -1, dtype=np.int64)
+    chunk_ids[valid] = id_map[labels[valid]]
+    return chunk_ids
+
+
+# 当前进程是否为向量服务进程（manage.py run_vector_service）
+_service_process = False
+
+
+def mark_service_process():
+    """标记当前进程为向量服务进程，此后构造的VectorStore直接访问索引而不再连接向量服务"""
+    global _service_process
+    _service_process = True
+
+
+def vector_service_socket():
+    """配置了向量服务且当前进程不是服务本身时返回Unix socket路径，否则返回None"""
+    if _service_process:
+        return None
+    return getattr(settings, "VECTOR_SERVICE_SOCKET", "") or None
+
+
+def fit_dimension(vectors, dimension):
+    """把向量矩阵调整为指定维度：维度不足时用零填充，超出时截断"""
+    if vectors.shape[1] < dimension:
+        padding = np.zeros(
+            (vectors.shape[0], dimension - vectors.shape[1]), dtype="float32"
+        )
+        return np.concatenate([vectors, padding], axis=1)
+    return vectors[:, :dimension]
+
+
+class VectorStore(SegmentMixin, TombstoneMixin, IndexMigrationMixin):
+    """向量存储类，用于管理知识库的向量索引和向量操作，支持用户级别隔离
+
+    索引文件的构建、检索、读写都通过 VECTOR_BACKEND 选定的检索后端（VectorBackend）完成；
+    ID映射、增量段、墓碑、原始向量和分块属性表与后端无关，由VectorStore统一维护。
+    直接构造VectorStore时，配置了 VECTOR_SERVICE_SOCKET 的工作进程得到连接本机向量服务的 VectorServiceClient；
+    local=True时总是直接访问本进程的索引，不经过向量服务。
+    """
+
+    def __new__(cls, *args, local=False, **kwargs):
+        if cls is VectorStore and not local and vector_service_socket():
+            from .vector_service import VectorServiceClient
+
+            return VectorServiceClient(*args, **kwargs)
+        return super().__new__(cls)
+
+    def __init__(
+        self, vector_dimension=384, index_type="Flat", metric=None, local=False
+    ):
+        # local只影响__new__是否返回向量服务客户端
+        # 检索后端，未安装FAISS且配置 VECTOR_BACKEND=faiss 时抛出ImportError
+        self.backend_cls = get_backend_class()
+        self.backend = self.backend_cls.name
         self.vector_dimension = vector_dimension
-        self.index_type = index_type
+        self.index_type = normalize_index_type(index_type)
+        # 度量方式，None表示沿用已有索引的配置，新建索引时默认为l2
+        self.metric = metric
         # 向量库存储目录
-        self.vector_dir = os.path.join(settings.MEDIA_ROOT, 'vector_indexes')
+        self.vector_dir = os.path.join(settings.MEDIA_ROOT, "vector_indexes")
         os.makedirs(self.vector_dir, exist_ok=True)
 
     def _get_knowledge_db_info(self, knowledge_db_id):
         """获取知识库信息，包括用户权限验证"""
         try:
             with connection.cursor() as cursor:
-                cursor.execute("""
+                cursor.execute(
+                    """
                     SELECT kd.id, kd.name, kd.user_id, kd.vector_dimension, kd.index_type,
                            u.username
                     FROM knowledge_database kd
                     JOIN user u ON kd.user_id = u.id
                     WHERE kd.id = %s
-                """, [knowledge_db_id])
+                """,
+                    [knowledge_db_id],
+                )
                 result = cursor.fetchone()
-                
+
                 if result:
                     return {
-                        'id': result[0],
-                        'name': result[1],
-                        'user_id': result[2],
-                        'vector_dimension': result[3],
-                        'index_type': result[4],
-                        'username': result[5]
+                        "id": result[0],
+                        "name": result[1],
+                        "user_id": result[2],
+                        "vector_dimension": result[3],
+                        "index_type": result[4],
+                        "username": result[5],
                     }
                 return None
         except Exception as e:
@@ -67,89 +269,359 @@ class VectorStore:
             if not kb_info:
                 logger.warning(f"知识库 {knowledge_db_id} 不存在")
                 return False, "知识库不存在"
-            
+
             # 管理员可以访问所有知识库
             if role_id == 1:
                 return True, kb_info
-            
+
             # 普通用户只能访问自己的知识库
-            if kb_info['user_id'] != user_id:
-                logger.warning(f"用户 {user_id} 无权访问知识库 {knowledge_db_id}（所有者: {kb_info['user_id']}）")
+            if kb_info["user_id"] != user_id:
+                logger.warning(
+                    f"用户 {user_id} 无权访问知识库 {knowledge_db_id}（所有者: {kb_info['user_id']}）"
+                )
                 return False, "无权限访问此知识库"
-            
+
             return True, kb_info
         except Exception as e:
             logger.error(f"验证用户权限失败: {str(e)}")
             return False, "权限验证失败"
 
-    def create_index(self, knowledge_db_id, user_id=None, role_id=None):
-        """为知识库创建FAISS索引，包含权限验证"""
+    def _load_cached_index(self, knowledge_db_id):
+        """从进程内缓存获取索引、ID映射和元数据，文件变化后自动重新加载
+
+        基础索引文件按段清单中的版本确定，读取期间基础索引切换到新版本（旧版本文件被删除）时重新读取清单。
+        知识库由其他检索后端创建时，先用磁盘上的向量建立当前后端的索引。
+        """
+        key = str(knowledge_db_id)
+        db_vector_dir = os.path.join(self.vector_dir, key)
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+        manifest_path = os.path.join(db_vector_dir, MANIFEST_FILENAME)
+        migrate_id_mapping(db_vector_dir)
+
+        def loader(base_paths):
+            # 基础索引与增量段按同一份清单打开，清单已指向其他版本时放弃本次读取
+            manifest = load_manifest(db_vector_dir)
+            if self._base_paths(db_vector_dir, manifest) != base_paths:
+                raise FileNotFoundError(f"{base_paths[0]} 已被新版本的基础索引替换")
+            index_path, mapping_path = base_paths
+            try:
+                index = self.backend_cls.load(
+                    index_path,
+                    metric=(manifest or {}).get("metric", METRIC_L2),
+                    readonly=True,
+                )
+            except Exception as e:
+                if not os.path.exists(index_path):
+                    raise FileNotFoundError(
+                        f"{index_path} 已被新版本的基础索引替换"
+                    ) from e
+                raise
+            # Windows下被映射的文件无法被替换，仅在POSIX系统使用内存映射
+            mmap = os.name == "posix"
+            segments, id_mapping = open_segments(
+                db_vector_dir,
+                manifest,
+                index,
+                load_id_map(mapping_path, mmap=mmap),
+                readonly=True,
+                mmap=mmap,
+            )
+            return (
+                index,
+                id_mapping,
+                self._read_metadata(metadata_path),
+                segments,
+                (manifest or {}).get("base_version"),
+            )
+
+        def load():
+            for _ in range(3):
+                base_paths = self._base_paths(
+                    db_vector_dir, load_manifest(db_vector_dir)
+                )
+                try:
+                    cached = vector_index_cache.get_or_load(
+                        key,
+                        list(base_paths),
+                        lambda: loader(base_paths),
+                        optional_paths=[metadata_path, manifest_path],
+                    )
+                except FileNotFoundError:
+                    continue
+                if cached is not None or base_paths == self._base_paths(
+                    db_vector_dir, load_manifest(db_vector_dir)
+                ):
+                    return cached
+            return None
+
+        cached = load()
+        if cached is not None and not isinstance(cached.index, self.backend_cls):
+            # 缓存中是同一进程内其他检索后端加载的条目，丢弃后重新加载
+            vector_index_cache.invalidate(key)
+            cached = load()
+        if (
+            cached is None
+            and os.path.exists(
+                self._base_paths(db_vector_dir, load_manifest(db_vector_dir))[1]
+            )
+            and self._adopt_index(knowledge_db_id)
+        ):
+            cached = load()
+        return cached
+
+    @staticmethod
+    def _read_metadata(metadata_path):
+        """读取元数据文件，不存在时返回空字典"""
+        if not os.path.exists(metadata_path):
+            return {}
+        with open(metadata_path, "r") as f:
+            return json.load(f)
+
+    def _resolve_metric(self, metadata):
+        """确定度量方式：优先使用构造参数，其次使用已有元数据，默认l2"""
+        return self.metric or metadata.get("metric") or METRIC_L2
+
+    def _build_index(self, vectors, metric, index_type=None):
+        """用已按度量方式处理过的向量构建当前检索后端的索引，向量ID按传入顺序编号
+
+        需要训练的索引类型在向量数未达到训练阈值时由后端返回暂存索引。
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if vectors.size == 0:
+            vectors = vectors.reshape(0, self.vector_dimension)
+        return self.backend_cls.build(vectors, metric, index_type or self.index_type)
+
+    def _rerank_vectors(self, db_vector_dir, version, index, metadata, ntotal=None):
+        """获取用于重排序的全精度向量，未开启重排序、索引本身无损或文件不完整时返回None
+
+        version为基础索引的版本号，ntotal为基础索引与增量段的向量总数，默认为基础索引的向量数。
+        """
+        if not metadata.get("rerank") or index.exact:
+            return None
+        ntotal = index.ntotal if ntotal is None else ntotal
+        vectors = load_raw_vectors(
+            raw_vectors_path(db_vector_dir, metadata, version),
+            index.dimension,
+            raw_vectors_dtype(metadata),
+        )
+        if vectors is None or len(vectors) < ntotal:
+            logger.warning(f"{db_vector_dir} 的原始向量文件缺失或不完整，跳过重排序")
+            return None
+        return vectors
+
+    def _load_vectors(self, db_vector_dir, version, index, metadata, segments=()):
+        """取出索引中全部向量（float32）：优先使用原始向量文件，否则从索引重构（压缩索引会有损）"""
+        ntotal = index.ntotal + sum(segment.ntotal for _, segment in segments)
+        vectors = self._stored_vectors(
+            db_vector_dir, version, metadata, index.dimension, ntotal
+        )
+        if vectors is not None:
+            return np.asarray(vectors[:ntotal], dtype="float32")
+        return reconstruct_all(index, segments)
+
+    @staticmethod
+    def _stored_vectors(db_vector_dir, version, metadata, dimension, ntotal):
+        """读取知识库第version版基础索引对应的原始向量，文件未维护或行数不足ntotal时返回None"""
+        if not (metadata.get("raw_vectors") or metadata.get("rerank")):
+            return None
+        vectors = load_raw_vectors(
+            raw_vectors_path(db_vector_dir, metadata, version),
+            dimension,
+            raw_vectors_dtype(metadata),
+        )
+        if vectors is None or len(vectors) < ntotal:
+            return None
+        return vectors
+
+    @staticmethod
+    def _layout_backend(db_vector_dir, manifest, metadata):
+        """知识库目录当前由哪个检索后端维护
+
+        以段清单中记录的后端为准；旧版清单没有记录时按已有的索引文件判断，
+        旧版NumPy后端创建的知识库没有索引文件，按元数据中的backend判断。
+        """
+        if manifest is not None and manifest.get("backend"):
+            return manifest["backend"]
+        version = (manifest or {}).get("base_version")
+        for name, backend_cls in BACKENDS.items():
+            filename = versioned_filename(backend_cls.index_filename, version)
+            if os.path.exists(os.path.join(db_vector_dir, filename)):
+                return name
+        return metadata.get("backend")
+
+    def _ensure_index(self, knowledge_db_id):
+        """当前检索后端的索引存在时返回True，知识库没有索引时返回False（需持有写锁）
+
+        知识库由其他检索后端创建时，先建立当前后端的索引。
+        """
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        migrate_id_mapping(db_vector_dir)
+        index_path, mapping_path = self._base_paths(
+            db_vector_dir, load_manifest(db_vector_dir)
+        )
+        if not os.path.exists(mapping_path):
+            return False
+        return os.path.exists(index_path) or self._adopt_index(knowledge_db_id)
+
+    def _adopt_index(self, knowledge_db_id):
+        """为其他检索后端创建的知识库建立当前后端的索引，返回是否建立了索引
+
+        向量ID、ID映射和原始向量保持不变，增量段一并并入新版本的基础索引。向量优先读取原始向量文件，
+        没有原始向量文件时用原后端从索引重构（需要原后端可用）。提交段清单后删除原后端的索引文件，
+        之后再由原后端访问时会以同样的方式切换回去。
+        """
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        with get_write_lock(knowledge_db_id):
+            manifest = load_manifest(db_vector_dir)
+            index_path, mapping_path = self._base_paths(db_vector_dir, manifest)
+            if os.path.exists(index_path):
+                return True
+            if not os.path.exists(mapping_path):
+                return False
+            version = (manifest or {}).get("base_version")
+            metadata = self._read_metadata(metadata_path)
+            source = self._layout_backend(db_vector_dir, manifest, metadata)
+            if source is None or source == self.backend:
+                logger.warning(
+                    f"知识库 {knowledge_db_id} 的{self.backend}索引文件缺失，无法加载"
+                )
+                return False
+
+            settings_source = manifest or metadata
+            dimension = int(
+                settings_source.get("dimension") or metadata.get("vector_dimension")
+            )
+            metric = settings_source.get("metric", METRIC_L2)
+            index_type = normalize_index_type(
+                metadata.get("index_type", settings_source.get("index_type"))
+            )
+            id_mapping = self._layout_id_mapping(db_vector_dir, manifest)
+            vectors = self._stored_vectors(
+                db_vector_dir, version, metadata, dimension, len(id_mapping)
+            )
+            raw_vectors = None
+            if vectors is None:
+                source_cls = BACKENDS.get(source)
+                source_path = (
+                    os.path.join(
+                        db_vector_dir,
+                        versioned_filename(source_cls.index_filename, version),
+                    )
+                    if source_cls
+                    else None
+                )
+                if source_path is None or not os.path.exists(source_path):
+                    raise RuntimeError(
+                        f"知识库 {knowledge_db_id} 的原始向量文件缺失或不完整，无法建立{self.backend}索引"
+                    )
+                source_index = source_cls.load(source_path, metric=metric)
+                segments, id_mapping = open_segments(
+                    db_vector_dir, manifest, source_index, load_id_map(mapping_path)
+                )
+                vectors = reconstruct_all(source_index, segments)
+                raw_vectors = vectors
+                metadata["raw_vectors"] = True
+
+            self.vector_dimension = dimension
+            self.index_type = index_type
+            index = self._build_index(vectors[: len(id_mapping)], metric)
+            manifest = manifest or {"next_segment": 1}
+            manifest["epoch"] = int(manifest.get("epoch", 0)) + 1
+            self._commit_base(
+                db_vector_dir,
+                manifest,
+                index,
+                index_type,
+                id_mapping,
+                metadata,
+                vectors=raw_vectors,
+            )
+
+            if metadata:
+                metadata["backend"] = self.backend
+                metadata.setdefault("rerank", index_type in COMPRESSED_INDEX_TYPES)
+                metadata["nlist"] = index.nlist
+                metadata["last_updated"] = str(np.datetime64("now"))
+                save_metadata(metadata_path, metadata)
+            vector_index_cache.invalidate(str(knowledge_db_id))
+
+        logger.info(
+            f"已为{source}后端创建的知识库 {knowledge_db_id} 建立{self.backend}后端的{index_type}索引，"
+            f"共 {index.ntotal} 个向量"
+        )
+        return True
+
+    def create_index(self, knowledge_db_id, user_id=None, role_id=None, rerank=None):
+        """为知识库创建索引，包含权限验证
+
+        rerank表示是否在磁盘保留全精度向量对检索结果重排序，为空时压缩索引类型默认开启。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
                 logger.error(f"创建索引失败: {result}")
                 return False
-            
+
             kb_info = result
             # 使用知识库的实际配置
-            self.vector_dimension = kb_info['vector_dimension']
-            self.index_type = kb_info['index_type']
-        
+            self.vector_dimension = kb_info["vector_dimension"]
+            self.index_type = normalize_index_type(kb_info["index_type"])
+
         db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
         os.makedirs(db_vector_dir, exist_ok=True)
-
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
         metadata_path = os.path.join(db_vector_dir, "metadata.json")
 
-        # 检查索引是否已存在
-        if os.path.exists(index_path) and os.path.exists(mapping_path):
-            logger.info(f"知识库 {knowledge_db_id} 的索引已存在")
-            return True
-
         try:
-            # 创建FAISS索引
-            if self.index_type == "Flat":
-                index = faiss.IndexFlatL2(self.vector_dimension)
-            elif self.index_type == "HNSW":
-                # 创建HNSW索引，M是每个节点的最大连接数
-                index = faiss.IndexHNSWFlat(self.vector_dimension, 32)
-                # 设置HNSW参数
-                index.hnsw.efConstruction = 200
-                index.hnsw.efSearch = 100
-            elif self.index_type == "IVF":
-                # 为IVF创建量化器
-                quantizer = faiss.IndexFlatL2(self.vector_dimension)
-                # 创建IVF索引，nlist是聚类的数量
-                index = faiss.IndexIVFFlat(quantizer, self.vector_dimension, 100)
-                # IVF索引需要训练
-                # 这里需要一些训练数据，通常实际应用中需要真实数据
-                # 如果没有训练数据，这里使用随机数据
-                random_data = np.random.random((100, self.vector_dimension)).astype('float32')
-                index.train(random_data)
-            else:
-                # 默认使用Flat
-                logger.warning(f"不支持的索引类型 {self.index_type}，使用默认Flat")
-                index = faiss.IndexFlatL2(self.vector_dimension)
-
-            # 保存索引
-            faiss.write_index(index, index_path)
-
-            # 创建空的ID映射
-            with open(mapping_path, 'w') as f:
-                json.dump({}, f)
-
-            # 创建元数据文件
-            metadata = {
-                'knowledge_db_id': knowledge_db_id,
-                'vector_dimension': self.vector_dimension,
-                'index_type': self.index_type,
-                'created_at': str(np.datetime64('now')),
-                'total_vectors': 0
-            }
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            with get_write_lock(knowledge_db_id):
+                # 检查索引是否已存在，其他检索后端创建的索引会被转换为当前后端的索引
+                if self._ensure_index(knowledge_db_id):
+                    logger.info(f"知识库 {knowledge_db_id} 的索引已存在")
+                    return True
+
+                metric = self.metric or METRIC_L2
+                if rerank is None:
+                    rerank = self.index_type in COMPRESSED_INDEX_TYPES
+                # 需要训练的索引此时还没有可用于训练的数据，先使用暂存索引
+                vectors = np.empty((0, self.vector_dimension), dtype="float32")
+                index = self._build_index(vectors, metric)
+
+                raw_dtype = getattr(settings, "VECTOR_RAW_VECTORS_DTYPE", "float32")
+                raw_dtype = (
+                    raw_dtype if raw_dtype in RAW_VECTORS_FILENAMES else "float32"
+                )
+                metadata = {
+                    "knowledge_db_id": knowledge_db_id,
+                    "backend": self.backend,
+                    "vector_dimension": self.vector_dimension,
+                    "index_type": self.index_type,
+                    "metric": metric,
+                    "nlist": 0,
+                    "rerank": bool(rerank),
+                    "rerank_factor": DEFAULT_RERANK_FACTOR,
+                    "raw_vectors": True,
+                    "raw_dtype": raw_dtype,
+                    "created_at": str(np.datetime64("now")),
+                    "total_vectors": 0,
+                }
+
+                # 写入空的基础索引、ID映射和原始向量并提交段清单，原始向量文件总是随索引一起维护
+                self._commit_base(
+                    db_vector_dir,
+                    {"next_segment": 1},
+                    index,
+                    self.index_type,
+                    np.empty(0, dtype=np.int64),
+                    metadata,
+                    vectors=vectors,
+                )
+
+                # 创建元数据文件
+                save_metadata(metadata_path, metadata)
 
             logger.info(f"已为知识库 {knowledge_db_id} 创建索引")
             return True
@@ -157,384 +629,1097 @@ class VectorStore:
             logger.error(f"创建索引时出错: {str(e)}", exc_info=True)
             return False
 
-    def add_vectors(self, knowledge_db_id, chunk_ids, vectors, user_id=None, role_id=None):
-        """添加向量到索引，包含权限验证"""
+    def add_vectors(
+        self,
+        knowledge_db_id,
+        chunk_ids,
+        vectors,
+        user_id=None,
+        role_id=None,
+        chunk_attributes=None,
+    ):
+        """添加向量到索引，包含权限验证
+
+        chunk_attributes为分块属性（document_id、file_type、created_at），写入分块属性表供过滤检索使用；
+        各属性可以是整批共用的单个值，也可以是与chunk_ids等长的序列，created_at默认为当前时间。
+        向量维度与索引维度不一致时拒绝写入，返回空列表。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
                 logger.error(f"添加向量失败: {result}")
                 return False
-        
+
         if len(chunk_ids) != len(vectors):
             logger.error("分块ID和向量数量不匹配")
             return False
 
         db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
         metadata_path = os.path.join(db_vector_dir, "metadata.json")
+        manifest_path = os.path.join(db_vector_dir, MANIFEST_FILENAME)
 
         try:
-            # 检查索引是否存在
-            if not os.path.exists(index_path) or not os.path.exists(mapping_path):
-                self.create_index(knowledge_db_id, user_id, role_id)
-
-            # 读取索引
-            index = faiss.read_index(index_path)
-
-            # 读取ID映射
-            with open(mapping_path, 'r') as f:
-                id_mapping = json.load(f)
+            with get_write_lock(knowledge_db_id):
+                # 检查索引是否存在
+                if not self._ensure_index(knowledge_db_id):
+                    self.create_index(knowledge_db_id, user_id, role_id)
+
+                # 只读取段清单，不加载基础索引，写入开销只与本批向量数相关
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                index_path, mapping_path = self._base_paths(db_vector_dir, manifest)
+                dimension = manifest["dimension"]
+
+                # 将向量添加到索引
+                vectors_array = np.array(vectors).astype("float32")
+
+                # 维度不一致说明写入方使用的嵌入模型与索引不匹配，填充或截断会产生无意义的向量，直接拒绝
+                if vectors_array.ndim != 2 or vectors_array.shape[1] != dimension:
+                    logger.error(
+                        f"向量维度不匹配: 索引维度 {dimension}, 向量形状 {vectors_array.shape}，拒绝写入"
+                    )
+                    return []
 
-            # 将向量添加到索引
-            vectors_array = np.array(vectors).astype('float32')
-            
-            # 检查维度匹配
-            if vectors_array.shape[1] != index.d:
-                logger.warning(f"向量维度不匹配: 索引维度 {index.d}, 向量维度 {vectors_array.shape[1]}")
-                
-                # 如果向量维度小于索引维度，用零填充
-                if vectors_array.shape[1] < index.d:
-                    padding = np.zeros((vectors_array.shape[0], index.d - vectors_array.shape[1]), dtype='float32')
-                    vectors_array = np.concatenate([vectors_array, padding], axis=1)
-                    logger.info(f"已用零填充向量到维度 {index.d}")
-                else:
-                    # 如果向量维度大于索引维度，截断
-                    vectors_array = vectors_array[:, :index.d]
-                    logger.info(f"已截断向量到维度 {index.d}")
-            
-            vector_ids = list(range(index.ntotal, index.ntotal + len(vectors)))
-
-            index.add(vectors_array)
-
-            # 更新ID映射
-            for i, chunk_id in enumerate(chunk_ids):
-                id_mapping[str(vector_ids[i])] = chunk_id
-
-            # 保存更新后的索引和映射
-            faiss.write_index(index, index_path)
-            with open(mapping_path, 'w') as f:
-                json.dump(id_mapping, f)
-
-            # 更新元数据
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                metadata['total_vectors'] = index.ntotal
-                metadata['last_updated'] = str(np.datetime64('now'))
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
-
-            logger.info(f"已将 {len(vectors)} 个向量添加到知识库 {knowledge_db_id} 的索引")
-            return vector_ids
+                # 余弦度量的索引存储归一化后的向量
+                vectors_array = np.ascontiguousarray(vectors_array)
+                if manifest["metric"] == METRIC_COSINE:
+                    normalize_rows(vectors_array)
+
+                start_id = manifest["base_ntotal"] + sum(
+                    seg["ntotal"] for seg in manifest["segments"]
+                )
+                vector_ids = list(range(start_id, start_id + len(vectors)))
+
+                # 先追加原始向量，保证原始向量文件行数不少于索引向量数；
+                # 旧版索引首次写入时由索引重构已有向量补齐文件，之后即可直接从磁盘重建
+                metadata = self._read_metadata(metadata_path)
+                append_raw_vectors(
+                    raw_vectors_path(
+                        db_vector_dir, metadata, manifest.get("base_version")
+                    ),
+                    vectors_array,
+                    start_id,
+                    lambda: reconstruct_all(
+                        *self._read_all(db_vector_dir, manifest)[:2]
+                    ),
+                    raw_vectors_dtype(metadata),
+                )
+
+                # 分块属性先于段清单写入，已提交的向量总能查到属性
+                if chunk_attributes is not None:
+                    append_chunk_attributes(
+                        os.path.join(db_vector_dir, CHUNK_ATTRIBUTES_FILENAME),
+                        chunk_attribute_rows(chunk_ids, **chunk_attributes),
+                    )
+
+                # 本批向量写成一个不可变的精确检索增量段
+                segment = self.backend_cls.create(dimension, manifest["metric"])
+                segment.add(vectors_array)
+                segment_ids = np.asarray(chunk_ids, dtype=np.int64)
+                name = f"seg_{int(manifest.get('next_segment', 1)):08d}"
+                seg_index_path, seg_ids_path = segment_paths(db_vector_dir, name)
+                os.makedirs(os.path.dirname(seg_index_path), exist_ok=True)
+                segment.save(seg_index_path)
+                save_id_map(seg_ids_path, segment_ids)
+
+                # 重命名段清单即提交，之前中断只会留下未被引用的段文件
+                manifest["segments"].append(
+                    {"name": name, "offset": start_id, "ntotal": len(vectors)}
+                )
+                manifest["next_segment"] = int(manifest.get("next_segment", 1)) + 1
+                save_manifest(db_vector_dir, manifest)
+
+                # 更新元数据
+                if metadata:
+                    metadata["total_vectors"] = metadata.get(
+                        "total_vectors", start_id
+                    ) + len(vectors)
+                    metadata["raw_vectors"] = True
+                    metadata["last_updated"] = str(np.datetime64("now"))
+                    save_metadata(metadata_path, metadata)
+
+                # 新段直接追加到缓存中的索引，无需重新加载基础索引
+                vector_index_cache.append_segment(
+                    str(knowledge_db_id),
+                    [index_path, mapping_path],
+                    [metadata_path, manifest_path],
+                    start_id,
+                    segment,
+                    segment_ids,
+                    metadata=metadata or None,
+                )
+
+                logger.info(
+                    f"已将 {len(vectors)} 个向量写入知识库 {knowledge_db_id} 的增量段 {name}"
+                )
+
+                if self._merge_action(manifest, metadata):
+                    self._schedule_merge(knowledge_db_id)
+                target_type = self._policy_index_type(metadata, start_id + len(vectors))
+                if target_type:
+                    self.schedule_migration(knowledge_db_id, target_type)
+                return vector_ids
         except Exception as e:
             logger.error(f"添加向量时出错: {str(e)}", exc_info=True)
             return []
 
-    def search(self, knowledge_db_id, query_vector, top_k=5, user_id=None, role_id=None, use_cosine=False):
-        """搜索最相似的向量，包含权限验证"""
+    def search(
+        self,
+        knowledge_db_id,
+        query_vector,
+        top_k=5,
+        user_id=None,
+        role_id=None,
+        use_cosine=False,
+        nprobe=None,
+        filters=None,
+        ef_search=None,
+    ):
+        """搜索最相似的向量，包含权限验证
+
+        nprobe仅对IVF索引生效，ef_search仅对HNSW索引生效，为空时使用知识库配置的值。
+        filters为过滤条件（见 normalize_search_filters），在索引内部只检索满足条件的分块。
+        """
+        results = self.search_batch(
+            knowledge_db_id,
+            [query_vector],
+            top_k=top_k,
+            user_id=user_id,
+            role_id=role_id,
+            use_cosine=use_cosine,
+            nprobe=nprobe,
+            filters=filters,
+            ef_search=ef_search,
+        )
+        return results[0] if results else []
+
+    def search_batch(
+        self,
+        knowledge_db_id,
+        query_vectors,
+        top_k=5,
+        user_id=None,
+        role_id=None,
+        use_cosine=False,
+        nprobe=None,
+        filters=None,
+        ef_search=None,
+    ):
+        """批量搜索最相似的向量，包含权限验证
+
+        query_vectors为 (n, d) 矩阵或n个向量的列表，所有查询通过一次批量检索完成，
+        返回与查询顺序一致的n个结果列表；索引不存在或出错时返回空列表。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
                 logger.error(f"向量搜索失败: {result}")
                 return []
 
-        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
-
         try:
-            if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+            # 从缓存读取索引和ID映射
+            cached = self._load_cached_index(knowledge_db_id)
+            if cached is None:
                 logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
                 return []
-
-            # 读取索引
-            index = faiss.read_index(index_path)
-
-            # 读取ID映射
-            with open(mapping_path, 'r') as f:
-                id_mapping = json.load(f)
-
-            # 确保query_vector是正确的形状
-            query_vector = np.array([query_vector]).astype('float32')
+            index = cached.index
+            segments = cached.segments
+            id_mapping = cached.id_mapping
+            ntotal = len(id_mapping)
+            params, _ = index.search_params(cached.metadata, nprobe, ef_search)
+
+            # 确保查询矩阵是正确的形状
+            query_matrix = np.atleast_2d(np.asarray(query_vectors, dtype="float32"))
+            if query_matrix.size == 0:
+                return []
 
             # 检查维度匹配
-            logger.debug(f"索引维度: {index.d}, 查询向量维度: {query_vector.shape[1]}, 配置维度: {self.vector_dimension}")
-
-            # 如果维度不匹配，进行调整
-            if query_vector.shape[1] != index.d:
-                if query_vector.shape[1] < index.d:
-                    # 如果查询向量维度小于索引维度，用零填充
-                    padding = np.zeros((1, index.d - query_vector.shape[1]), dtype='float32')
-                    query_vector = np.concatenate([query_vector, padding], axis=1)
-                else:
-                    # 如果查询向量维度大于索引维度，截断
-                    query_vector = query_vector[:, :index.d]
-
-            results = []
-
-            if use_cosine:
-                # 余弦相似：重构全部向量做归一化，然后与查询向量点积
-                # 归一化查询向量
-                q = query_vector[0]
-                q_norm = np.linalg.norm(q)
-                if q_norm == 0:
-                    return []
-                q = q / q_norm
-
-                # 遍历索引内所有向量并计算相似度
-                sims = []
-                for vid_str, chunk_id in id_mapping.items():
-                    vid = int(vid_str)
-                    try:
-                        v = index.reconstruct(vid)
-                    except Exception:
-                        # 某些索引可能不支持reconstruct，跳过
-                        continue
-                    v_norm = np.linalg.norm(v)
-                    if v_norm == 0:
-                        sim = 0.0
-                    else:
-                        sim = float(np.dot(q, v / v_norm))
-                    sims.append((sim, chunk_id))
-
-                # 取TopK（相似度从高到低）
-                sims.sort(key=lambda x: x[0], reverse=True)
-                for i, (sim, chunk_id) in enumerate(sims[:top_k]):
-                    # 余弦相似度模式下，distance直接使用相似度值
-                    results.append({
-                        'chunk_id': chunk_id,
-                        'distance': float(sim),
-                        'rank': i + 1
-                    })
+            logger.debug(
+                f"索引维度: {index.dimension}, 查询向量维度: {query_matrix.shape[1]}, 配置维度: {self.vector_dimension}"
+            )
+
+            # 如果维度不匹配，查询向量维度小于索引维度时用零填充，大于时截断
+            query_matrix = np.ascontiguousarray(
+                fit_dimension(query_matrix, index.dimension)
+            )
+            metric = index.metric
+
+            # 已删除的向量仍留在索引中，以存活向量掩码交给检索后端在索引内部排除，
+            # 检索量只与top_k相关；过滤条件的掩码本身不包含墓碑
+            mask = self._filter_mask(knowledge_db_id, cached, filters)
+            if mask is None:
+                mask = cached.live_mask()
+            if mask is not None and not mask.any():
+                return [[] for _ in range(len(query_matrix))]
+            fetch_k = top_k
+
+            # 压缩索引先取出放大的候选集，再用全精度向量重排序
+            db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+            rerank_vectors = self._rerank_vectors(
+                db_vector_dir, cached.base_version, index, cached.metadata, ntotal
+            )
+            if rerank_vectors is not None:
+                fetch_k += top_k * (
+                    int(cached.metadata.get("rerank_factor", DEFAULT_RERANK_FACTOR)) - 1
+                )
+            fetch_k = max(1, min(fetch_k, ntotal))
+
+            # 基础索引与各增量段分别检索后合并
+            if metric == METRIC_COSINE:
+                # 余弦度量索引：归一化查询向量后直接使用内积检索
+                normalize_rows(query_matrix)
+                sims, indices = search_segments(
+                    index, segments, query_matrix, fetch_k, params=params, mask=mask
+                )
+                rows = list(zip(sims, indices))
+                if rerank_vectors is not None:
+                    rows = [
+                        rerank_candidates(rerank_vectors, q, labels, metric)
+                        for q, labels in zip(query_matrix, indices)
+                    ]
+                # 余弦相似度模式下，distance直接使用相似度值
+                if not use_cosine:
+                    # 归一化向量间的L2距离平方为 2 - 2·cos，保持与L2索引一致的返回语义
+                    rows = [
+                        (
+                            np.maximum(0.0, 2.0 - 2.0 * np.clip(row_sims, -1.0, 1.0)),
+                            labels,
+                        )
+                        for row_sims, labels in rows
+                    ]
+            elif use_cosine:
+                rows = self._brute_force_cosine(
+                    knowledge_db_id,
+                    index,
+                    segments,
+                    id_mapping,
+                    query_matrix,
+                    top_k,
+                    vectors=rerank_vectors,
+                    mask=mask,
+                )
             else:
-                # FAISS原生L2检索
-                distances, indices = index.search(query_vector, top_k)
-                for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-                    if idx != -1:  # FAISS返回-1表示无效结果
-                        chunk_id = id_mapping.get(str(idx))
-                        if chunk_id:
-                            results.append({
-                                'chunk_id': chunk_id,
-                                'distance': float(distance),
-                                'rank': i + 1
-                            })
-
-            logger.info(f"在知识库 {knowledge_db_id} 中找到 {len(results)} 个相似结果")
-            return results
+                # 原生L2检索
+                distances, indices = search_segments(
+                    index, segments, query_matrix, fetch_k, params=params, mask=mask
+                )
+                rows = list(zip(distances, indices))
+                if rerank_vectors is not None:
+                    rows = [
+                        rerank_candidates(rerank_vectors, q, labels, metric)
+                        for q, labels in zip(query_matrix, indices)
+                    ]
+
+            batch_results = self._collect_results(id_mapping, rows, top_k)
+            logger.info(
+                f"在知识库 {knowledge_db_id} 中完成 {len(batch_results)} 个查询，"
+                f"共找到 {sum(len(r) for r in batch_results)} 个相似结果"
+            )
+            return batch_results
 
         except Exception as e:
             logger.error(f"向量搜索失败: {str(e)}", exc_info=True)
             return []
 
-    def delete_vectors(self, knowledge_db_id, vector_ids, user_id=None, role_id=None):
-        """删除指定的向量，包含权限验证"""
+    @staticmethod
+    def _collect_results(id_mapping, rows, top_k):
+        """把每个查询的 (距离数组, 向量ID数组) 转换为结果列表
+
+        检索返回-1表示无效结果，已删除的向量映射为-1，两者均被过滤。
+        """
+        batch_results = []
+        for distances, indices in rows:
+            results = []
+            chunk_ids = labels_to_chunk_ids(id_mapping, indices)
+            for distance, chunk_id in zip(distances, chunk_ids):
+                if chunk_id >= 0:
+                    results.append(
+                        {
+                            "chunk_id": int(chunk_id),
+                            "distance": float(distance),
+                            "rank": len(results) + 1,
+                        }
+                    )
+                    if len(results) >= top_k:
+                        break
+            batch_results.append(results)
+        return batch_results
+
+    @staticmethod
+    def _brute_force_cosine(
+        knowledge_db_id,
+        index,
+        segments,
+        id_mapping,
+        queries,
+        top_k,
+        vectors=None,
+        mask=None,
+    ):
+        """在L2索引上按余弦相似度检索：取出全部向量后用NumpyBackend分块做精确检索
+
+        vectors为全精度原始向量，为空时从索引重构；mask为允许检索的向量。返回每个查询的
+        (相似度数组, 向量ID数组)，按相似度从高到低排列。
+        """
+        logger.info(
+            f"知识库 {knowledge_db_id} 的索引为L2度量，余弦检索需要全量计算，"
+            f"可使用 manage.py convert_vector_metric 转换为余弦索引"
+        )
+        empty = (np.empty(0, dtype="float32"), np.empty(0, dtype=np.int64))
+        try:
+            if vectors is None:
+                vectors = reconstruct_all(index, segments)
+        except RuntimeError as e:
+            # 某些索引可能不支持reconstruct
+            logger.warning(f"知识库 {knowledge_db_id} 的索引不支持重构向量: {str(e)}")
+            return [empty] * len(queries)
+
+        vectors = vectors[: len(id_mapping)]
+        live = resize_id_map(id_mapping, len(vectors)) >= 0
+        if mask is not None:
+            live &= mask[: len(vectors)]
+        k = min(top_k, int(np.count_nonzero(live)))
+        if k == 0:
+            return [empty] * len(queries)
+        sims, labels = NumpyBackend(index.dimension, METRIC_L2, vectors).search(
+            queries, k, params={"cosine": True}, mask=live
+        )
+        # 零向量查询没有方向，不返回结果
+        valid_queries = np.linalg.norm(queries, axis=1) > 0
+        return [
+            (row_sims, row_labels) if valid else empty
+            for row_sims, row_labels, valid in zip(sims, labels, valid_queries)
+        ]
+
+    def _filter_mask(self, knowledge_db_id, cached, filters):
+        """按过滤条件计算允许检索的向量，返回按向量ID排列的布尔数组，没有过滤条件时返回None"""
+        filters = normalize_search_filters(filters)
+        if filters is None:
+            return None
+
+        attributes_path = os.path.join(
+            self.vector_dir, str(knowledge_db_id), CHUNK_ATTRIBUTES_FILENAME
+        )
+        loaded = cached.chunk_attributes(attributes_path)
+        if loaded is None:
+            # 旧版知识库没有分块属性表，首次过滤检索时从数据库生成
+            self.sync_chunk_attributes(knowledge_db_id)
+            loaded = cached.chunk_attributes(attributes_path)
+        attributes, order, sorted_chunk_ids = loaded
+
+        id_mapping = np.asarray(cached.id_mapping)
+        if len(sorted_chunk_ids) == 0:
+            return np.zeros(len(id_mapping), dtype=bool)
+
+        keep = np.ones(len(attributes), dtype=bool)
+        if "document_ids" in filters:
+            keep &= np.isin(attributes["document_id"], filters["document_ids"])
+        if "file_types" in filters:
+            keep &= np.isin(
+                attributes["file_type"],
+                [file_type.encode()[:16] for file_type in filters["file_types"]],
+            )
+        if "date_from" in filters:
+            keep &= attributes["created_at"] >= filters["date_from"]
+        if "date_to" in filters:
+            keep &= attributes["created_at"] < filters["date_to"]
+
+        # 在按chunk_id排序的属性表中二分查找每个向量的属性行；
+        # 属性表中没有的分块（包括映射为-1的墓碑）不允许检索
+        positions = np.minimum(
+            np.searchsorted(sorted_chunk_ids, id_mapping), len(sorted_chunk_ids) - 1
+        )
+        return (sorted_chunk_ids[positions] == id_mapping) & keep[order[positions]]
+
+    def sync_chunk_attributes(self, knowledge_db_id):
+        """从数据库重新生成知识库的分块属性表"""
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.id, d.id, d.file_type, d.create_time
+                FROM knowledge_document_chunk c
+                JOIN knowledge_document d ON c.document_id = d.id
+                WHERE d.database_id = %s
+            """,
+                [knowledge_db_id],
+            )
+            rows = cursor.fetchall()
+
+        attributes = chunk_attribute_rows(
+            [row[0] for row in rows],
+            document_id=[row[1] for row in rows],
+            file_type=[row[2] for row in rows],
+            created_at=[row[3] or datetime.now() for row in rows],
+        )
+        with get_write_lock(knowledge_db_id):
+            os.makedirs(db_vector_dir, exist_ok=True)
+            save_chunk_attributes(
+                os.path.join(db_vector_dir, CHUNK_ATTRIBUTES_FILENAME), attributes
+            )
+        logger.info(
+            f"已从数据库生成知识库 {knowledge_db_id} 的分块属性表，共 {len(attributes)} 条"
+        )
+        return len(attributes)
+
+    @staticmethod
+    def _sync_chunk_vector_ids(id_mapping, batch_size=1000):
+        """按新的ID映射更新分块表中的vector_id"""
+        params = [
+            (str(vector_id), int(chunk_id))
+            for vector_id, chunk_id in enumerate(id_mapping)
+        ]
+        with connection.cursor() as cursor:
+            for start in range(0, len(params), batch_size):
+                cursor.executemany(
+                    "UPDATE knowledge_document_chunk SET vector_id = %s WHERE id = %s",
+                    params[start : start + batch_size],
+                )
+
+    def get_index_info(
+        self, knowledge_db_id, user_id=None, role_id=None, estimate_recall=False
+    ):
+        """获取索引信息，包含权限验证
+
+        estimate_recall为True时抽样估计召回率，需要对全部向量做一次暴力检索，耗时与知识库大小成正比。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
-                logger.error(f"删除向量失败: {result}")
-                return False
-
-        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
-        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+                logger.error(f"获取索引信息失败: {result}")
+                return None
 
         try:
-            if not os.path.exists(index_path) or not os.path.exists(mapping_path):
-                logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
-                return False
-
-            # 读取索引
-            index = faiss.read_index(index_path)
-
-            # 读取ID映射
-            with open(mapping_path, 'r') as f:
-                id_mapping = json.load(f)
-
-            # 创建新的索引（FAISS不支持直接删除向量）
-            if self.index_type == "Flat":
-                new_index = faiss.IndexFlatL2(self.vector_dimension)
-            elif self.index_type == "HNSW":
-                new_index = faiss.IndexHNSWFlat(self.vector_dimension, 32)
-                new_index.hnsw.efConstruction = 200
-                new_index.hnsw.efSearch = 100
-            else:
-                new_index = faiss.IndexFlatL2(self.vector_dimension)
-
-            # 重新构建索引，排除要删除的向量
-            remaining_vectors = []
-            new_mapping = {}
-            new_vector_id = 0
-
-            for old_vector_id, chunk_id in id_mapping.items():
-                if old_vector_id not in [str(vid) for vid in vector_ids]:
-                    # 获取原向量
-                    old_vector = index.reconstruct(int(old_vector_id))
-                    remaining_vectors.append(old_vector)
-                    new_mapping[str(new_vector_id)] = chunk_id
-                    new_vector_id += 1
-
-            # 添加剩余向量到新索引
-            if remaining_vectors:
-                vectors_array = np.array(remaining_vectors).astype('float32')
-                new_index.add(vectors_array)
-
-            # 保存新索引和映射
-            faiss.write_index(new_index, index_path)
-            with open(mapping_path, 'w') as f:
-                json.dump(new_mapping, f)
-
-            # 更新元数据
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                metadata['total_vectors'] = new_index.ntotal
-                metadata['last_updated'] = str(np.datetime64('now'))
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
-
-            logger.info(f"已从知识库 {knowledge_db_id} 删除 {len(vector_ids)} 个向量")
-            return True
+            # 从缓存读取索引、映射和元数据
+            cached = self._load_cached_index(knowledge_db_id)
+            if cached is None:
+                return None
+            index = cached.index
+            segments = cached.segments
+            id_mapping = cached.id_mapping
+            metadata = cached.metadata
+            ntotal = len(id_mapping)
+
+            db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+            index_type = normalize_index_type(
+                metadata.get("index_type", self.index_type)
+            )
+            tombstones = count_tombstones(ntotal, id_mapping)
+            _, search_config = index.search_params(metadata)
+            info = {
+                "knowledge_db_id": knowledge_db_id,
+                "index_type": index_type,
+                "backend": index.name,
+                "staging": index.is_staging(index_type),
+                "nlist": index.nlist,
+                "nprobe": search_config.get("nprobe"),
+                "ef_search": search_config.get("ef_search"),
+                "metric": index.metric,
+                "rerank": bool(metadata.get("rerank")),
+                "vector_dimension": index.dimension,
+                "total_vectors": ntotal - tombstones,
+                "deleted_vectors": tombstones,
+                "mapping_count": int(np.count_nonzero(id_mapping >= 0)),
+                "segments": len(segments),
+                "segment_vectors": ntotal - index.ntotal,
+                "memory": self._memory_usage(db_vector_dir, cached.base_version, index),
+                "metadata": metadata,
+            }
+            if estimate_recall:
+                info["recall"] = self._estimate_recall(
+                    db_vector_dir, cached.base_version, index, metadata, segments
+                )
+            return info
 
         except Exception as e:
-            logger.error(f"删除向量失败: {str(e)}", exc_info=True)
-            return False
+            logger.error(f"获取索引信息失败: {str(e)}")
+            return None
 
-    def get_index_info(self, knowledge_db_id, user_id=None, role_id=None):
-        """获取索引信息，包含权限验证"""
+    @staticmethod
+    def _memory_usage(db_vector_dir, version, index):
+        """统计第version版基础索引文件、增量段与原始向量文件的大小，以及相对float32全精度存储的压缩比"""
+
+        def file_size(filename):
+            path = os.path.join(db_vector_dir, filename)
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        index_bytes = file_size(versioned_filename(index.index_filename, version))
+        bytes_per_vector = index_bytes / index.ntotal if index.ntotal else 0
+        segment_dir = os.path.join(db_vector_dir, SEGMENTS_DIRNAME)
+        segment_bytes = (
+            sum(
+                file_size(os.path.join(SEGMENTS_DIRNAME, filename))
+                for filename in os.listdir(segment_dir)
+            )
+            if os.path.isdir(segment_dir)
+            else 0
+        )
+        return {
+            "index_bytes": index_bytes,
+            "segment_bytes": segment_bytes,
+            "raw_vector_bytes": sum(
+                file_size(versioned_filename(filename, version))
+                for filename in RAW_VECTORS_FILENAMES.values()
+            ),
+            "bytes_per_vector": round(bytes_per_vector, 1),
+            "compression_ratio": (
+                round(index.dimension * 4 / bytes_per_vector, 2)
+                if bytes_per_vector
+                else None
+            ),
+        }
+
+    @staticmethod
+    def _exact_topk(vectors, queries, k, metric):
+        """分块暴力检索得到全精度下的真实TopK向量ID"""
+        vectors = np.asarray(vectors)
+        return NumpyBackend(vectors.shape[1], metric, vectors).search(queries, k)[1]
+
+    def _estimate_recall(
+        self,
+        db_vector_dir,
+        version,
+        index,
+        metadata,
+        segments=(),
+        sample_size=100,
+        k=10,
+    ):
+        """抽样估计召回率：以库内向量作为查询，与全精度暴力检索的TopK结果比较
+
+        开启重排序时同时给出重排序后的召回率。
+        """
+        vectors = self._load_vectors(db_vector_dir, version, index, metadata, segments)
+        if len(vectors) == 0:
+            return None
+        k = min(k, len(vectors))
+        sample_ids = np.random.default_rng().choice(
+            len(vectors), min(sample_size, len(vectors)), replace=False
+        )
+        queries = np.ascontiguousarray(vectors[np.sort(sample_ids)], dtype="float32")
+        truth_labels = self._exact_topk(vectors, queries, k, index.metric)
+
+        def recall_of(result_labels):
+            hits = sum(
+                len(np.intersect1d(truth, found))
+                for truth, found in zip(truth_labels, result_labels)
+            )
+            return round(hits / (len(queries) * k), 4)
+
+        params, _ = index.search_params(metadata)
+        _, labels = search_segments(index, segments, queries, k, params=params)
+        result = {"sample_queries": len(queries), "k": k, "recall": recall_of(labels)}
+
+        rerank_vectors = self._rerank_vectors(
+            db_vector_dir, version, index, metadata, len(vectors)
+        )
+        if rerank_vectors is not None:
+            fetch_k = min(
+                k * int(metadata.get("rerank_factor", DEFAULT_RERANK_FACTOR)),
+                len(vectors),
+            )
+            _, candidates = search_segments(
+                index, segments, queries, fetch_k, params=params
+            )
+            metric = index.metric
+            reranked = [
+                rerank_candidates(rerank_vectors, query, labels, metric)[1][:k]
+                for query, labels in zip(queries, candidates)
+            ]
+            result["recall_reranked"] = recall_of(reranked)
+        return result
+
+    def tune_search_params(
+        self,
+        knowledge_db_id,
+        target_recall=0.95,
+        sample_size=200,
+        k=10,
+        user_id=None,
+        role_id=None,
+    ):
+        """自动调优检索参数并保存到知识库元数据，包含权限验证
+
+        从知识库中抽取向量作为查询，依次尝试候选的efSearch（IVF索引为nprobe），取召回率达到target_recall的最小值。
+        查询向量本身就在索引中，比较时从真实结果和检索结果中去掉查询自身及已删除的向量（留一法），避免高估召回率；
+        开启重排序时按重排序后的结果计算召回率。全部候选值都达不到目标时使用召回率最高的候选值。
+        返回调优结果，索引不支持调优时 value 为None，出错时返回None。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
-                logger.error(f"获取索引信息失败: {result}")
+                logger.error(f"检索参数调优失败: {result}")
                 return None
 
-        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
-        metadata_path = os.path.join(db_vector_dir, "metadata.json")
-
         try:
-            if not os.path.exists(index_path):
+            cached = self._load_cached_index(knowledge_db_id)
+            if cached is None:
+                logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                return None
+            index = cached.index
+            segments = cached.segments
+            id_mapping = np.asarray(cached.id_mapping)
+            metadata = cached.metadata
+
+            tunable = index.tunable_param()
+            if tunable is None:
+                logger.info(
+                    f"知识库 {knowledge_db_id} 的索引为精确检索或尚未训练，无需调优"
+                )
+                return {
+                    "knowledge_db_id": knowledge_db_id,
+                    "param": None,
+                    "value": None,
+                }
+            param_name, candidates = tunable
+
+            db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+            vectors = self._load_vectors(
+                db_vector_dir, cached.base_version, index, metadata, segments
+            )
+            live = np.flatnonzero(id_mapping[: len(vectors)] >= 0)
+            k = min(k, len(live) - 1)
+            if k < 1:
+                logger.warning(f"知识库 {knowledge_db_id} 的向量数不足，无法调优")
                 return None
 
-            # 读取索引
-            index = faiss.read_index(index_path)
-
-            # 读取映射
-            id_mapping = {}
-            if os.path.exists(mapping_path):
-                with open(mapping_path, 'r') as f:
-                    id_mapping = json.load(f)
-
-            # 读取元数据
-            metadata = {}
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
+            rng = np.random.default_rng()
+            sample_ids = np.sort(
+                rng.choice(live, min(sample_size, len(live)), replace=False)
+            )
+            queries = np.ascontiguousarray(vectors[sample_ids], dtype="float32")
+            # 真实结果只在存活向量中计算，检索时同样排除墓碑；多取1个用于去掉查询自身
+            fetch_k = k + 1
+            truth_labels = live[
+                self._exact_topk(vectors[live], queries, fetch_k, index.metric)
+            ]
+            mask = cached.live_mask()
+
+            rerank_vectors = self._rerank_vectors(
+                db_vector_dir, cached.base_version, index, metadata, len(id_mapping)
+            )
+            rerank_factor = int(metadata.get("rerank_factor", DEFAULT_RERANK_FACTOR))
+            metric = index.metric
+
+            def top_live(labels, self_id):
+                labels = labels[(labels >= 0) & (labels != self_id)]
+                return labels[id_mapping[labels] >= 0][:k]
+
+            truth = [
+                top_live(labels, self_id)
+                for labels, self_id in zip(truth_labels, sample_ids)
+            ]
+
+            curve = []
+            for value in candidates:
+                params, _ = index.search_params(metadata, **{param_name: value})
+                if rerank_vectors is not None:
+                    _, candidates_labels = search_segments(
+                        index,
+                        segments,
+                        queries,
+                        min(fetch_k * rerank_factor, len(live)),
+                        params=params,
+                        mask=mask,
+                    )
+                    found = [
+                        rerank_candidates(rerank_vectors, query, labels, metric)[1]
+                        for query, labels in zip(queries, candidates_labels)
+                    ]
+                else:
+                    _, found = search_segments(
+                        index, segments, queries, fetch_k, params=params, mask=mask
+                    )
+                hits = sum(
+                    len(np.intersect1d(expected, top_live(labels, self_id)))
+                    for expected, labels, self_id in zip(truth, found, sample_ids)
+                )
+                recall = round(hits / sum(len(expected) for expected in truth), 4)
+                curve.append({"value": value, "recall": recall})
+                if recall >= target_recall:
+                    break
+
+            reached = [point for point in curve if point["recall"] >= target_recall]
+            best = (
+                reached[0] if reached else max(curve, key=lambda point: point["recall"])
+            )
+            tuning = {
+                "param": param_name,
+                "target_recall": target_recall,
+                "recall": best["recall"],
+                "k": k,
+                "sample_queries": len(queries),
+                "tuned_at": str(np.datetime64("now")),
+            }
+            if not self.update_search_config(
+                knowledge_db_id, tuning=tuning, **{param_name: best["value"]}
+            ):
+                return None
 
+            logger.info(
+                f"知识库 {knowledge_db_id} 检索参数调优完成: {param_name}={best['value']}，"
+                f"召回率 {best['recall']}（目标 {target_recall}）"
+            )
             return {
-                'knowledge_db_id': knowledge_db_id,
-                'index_type': self.index_type,
-                'vector_dimension': index.d,
-                'total_vectors': index.ntotal,
-                'mapping_count': len(id_mapping),
-                'metadata': metadata
+                "knowledge_db_id": knowledge_db_id,
+                "param": param_name,
+                "value": best["value"],
+                "recall": best["recall"],
+                "target_recall": target_recall,
+                "reached": bool(reached),
+                "k": k,
+                "sample_queries": len(queries),
+                "curve": curve,
             }
-
         except Exception as e:
-            logger.error(f"获取索引信息失败: {str(e)}")
+            logger.error(f"检索参数调优失败: {str(e)}", exc_info=True)
             return None
 
-    def rebuild_index(self, knowledge_db_id, vectors_data, user_id=None, role_id=None):
-        """重建索引，包含权限验证"""
+    def rebuild_index(
+        self, knowledge_db_id, vectors_data, user_id=None, role_id=None, chunk_ids=None
+    ):
+        """用重新生成的向量重建索引，包含权限验证
+
+        chunk_ids为与vectors_data逐一对应的分块ID，提供时写入ID映射并同步分块表中的vector_id；
+        为空时沿用旧行为，向量ID即为分块ID。磁盘上已保存原始向量时应优先使用rebuild_from_disk。
+        """
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
                 logger.error(f"重建索引失败: {result}")
                 return False
 
         db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
         os.makedirs(db_vector_dir, exist_ok=True)
-        index_path = os.path.join(db_vector_dir, "faiss.index")
-        mapping_path = os.path.join(db_vector_dir, "id_mapping.json")
         metadata_path = os.path.join(db_vector_dir, "metadata.json")
 
         try:
-            # 创建新索引
-            if self.index_type == "Flat":
-                index = faiss.IndexFlatL2(self.vector_dimension)
-            elif self.index_type == "HNSW":
-                index = faiss.IndexHNSWFlat(self.vector_dimension, 32)
-                index.hnsw.efConstruction = 200
-                index.hnsw.efSearch = 100
-            elif self.index_type == "IVF":
-                quantizer = faiss.IndexFlatL2(self.vector_dimension)
-                index = faiss.IndexIVFFlat(quantizer, self.vector_dimension, 100)
-                # 训练索引
-                if vectors_data:
-                    training_vectors = np.array(vectors_data[:100]).astype('float32')
-                    index.train(training_vectors)
-            else:
-                index = faiss.IndexFlatL2(self.vector_dimension)
-
-            # 添加所有向量
-            if vectors_data:
-                vectors_array = np.array(vectors_data).astype('float32')
-                index.add(vectors_array)
-
-            # 保存索引
-            faiss.write_index(index, index_path)
-
-            # 创建ID映射
-            id_mapping = {str(i): i for i in range(len(vectors_data))}
-            with open(mapping_path, 'w') as f:
-                json.dump(id_mapping, f)
-
-            # 更新元数据
-            metadata = {
-                'knowledge_db_id': knowledge_db_id,
-                'vector_dimension': self.vector_dimension,
-                'index_type': self.index_type,
-                'created_at': str(np.datetime64('now')),
-                'total_vectors': len(vectors_data),
-                'last_updated': str(np.datetime64('now'))
-            }
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            with get_write_lock(knowledge_db_id):
+                # 创建新索引，沿用原索引的度量方式
+                old_metadata = self._read_metadata(metadata_path)
+                metric = self._resolve_metric(old_metadata)
+
+                vectors_array = np.empty((0, self.vector_dimension), dtype="float32")
+                if vectors_data is not None and len(vectors_data) > 0:
+                    vectors_array = np.ascontiguousarray(
+                        np.array(vectors_data).astype("float32")
+                    )
+                    if metric == METRIC_COSINE:
+                        normalize_rows(vectors_array)
+
+                # 训练索引并添加所有向量
+                index = self._build_index(vectors_array, metric)
+                rerank = old_metadata.get(
+                    "rerank", self.index_type in COMPRESSED_INDEX_TYPES
+                )
+                raw_dtype = (
+                    raw_vectors_dtype(old_metadata)
+                    if old_metadata.get("raw_vectors")
+                    else getattr(settings, "VECTOR_RAW_VECTORS_DTYPE", "float32")
+                )
+                raw_dtype = (
+                    raw_dtype if raw_dtype in RAW_VECTORS_FILENAMES else "float32"
+                )
+
+                # 创建ID映射
+                if chunk_ids is not None:
+                    id_mapping = np.asarray(chunk_ids, dtype=np.int64)
+                    if len(id_mapping) != len(vectors_array):
+                        raise ValueError(
+                            f"分块ID数量 {len(id_mapping)} 与向量数量 {len(vectors_array)} 不一致"
+                        )
+                else:
+                    id_mapping = np.arange(len(vectors_array), dtype=np.int64)
+
+                # 元数据在提交段清单后写入
+                metadata = {
+                    "knowledge_db_id": knowledge_db_id,
+                    "backend": self.backend,
+                    "vector_dimension": self.vector_dimension,
+                    "index_type": self.index_type,
+                    "metric": metric,
+                    "nlist": index.nlist,
+                    "rerank": bool(rerank),
+                    "rerank_factor": old_metadata.get(
+                        "rerank_factor", DEFAULT_RERANK_FACTOR
+                    ),
+                    "raw_vectors": True,
+                    "raw_dtype": raw_dtype,
+                    "created_at": str(np.datetime64("now")),
+                    "total_vectors": len(vectors_array),
+                    "last_updated": str(np.datetime64("now")),
+                }
+                # 保留按知识库配置的检索参数
+                for key in ("nprobe", "ef_search", "search_tuning"):
+                    if key in old_metadata:
+                        metadata[key] = old_metadata[key]
+
+                # 基础索引、ID映射和原始向量写入新版本文件并提交段清单
+                manifest = load_manifest(db_vector_dir) or {"next_segment": 1}
+                manifest["epoch"] = int(manifest.get("epoch", 0)) + 1
+                self._commit_base(
+                    db_vector_dir,
+                    manifest,
+                    index,
+                    self.index_type,
+                    id_mapping,
+                    metadata,
+                    vectors=vectors_array,
+                )
+                # 分块属性表可能缺少新分块，删除后在下次带过滤条件的检索时从数据库重新同步
+                attributes_path = os.path.join(db_vector_dir, CHUNK_ATTRIBUTES_FILENAME)
+                if os.path.exists(attributes_path):
+                    os.remove(attributes_path)
+                vector_index_cache.invalidate(str(knowledge_db_id))
+                save_metadata(metadata_path, metadata)
+
+                if chunk_ids is not None:
+                    self._sync_chunk_vector_ids(id_mapping)
+
+                logger.info(
+                    f"已重建知识库 {knowledge_db_id} 的索引，包含 {len(vectors_array)} 个向量"
+                )
+                return True
+
+        except Exception as e:
+            logger.error(f"重建索引失败: {str(e)}", exc_info=True)
+            return False
+
+    def has_stored_vectors(self, knowledge_db_id):
+        """知识库是否可以不重新生成embedding直接重建索引
 
-            logger.info(f"已重建知识库 {knowledge_db_id} 的索引，包含 {len(vectors_data)} 个向量")
+        原始向量文件完整，或索引本身为无损索引（Flat/HNSW/IVF）可重构出原始向量时返回True。
+        不要求索引由当前检索后端创建，重建时会建立当前后端的索引。
+        """
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        mapping_path = os.path.join(db_vector_dir, ID_MAP_FILENAME)
+        manifest = load_manifest(db_vector_dir)
+        metadata = self._read_metadata(os.path.join(db_vector_dir, "metadata.json"))
+        if manifest is None:
+            # 旧版目录没有段清单，只依据原始向量文件判断
+            if not os.path.exists(mapping_path) or not metadata.get("vector_dimension"):
+                return False
+            ntotal = len(load_id_map(mapping_path, mmap=os.name == "posix"))
+            return (
+                self._stored_vectors(
+                    db_vector_dir,
+                    None,
+                    metadata,
+                    int(metadata["vector_dimension"]),
+                    ntotal,
+                )
+                is not None
+            )
+        ntotal = manifest["base_ntotal"] + sum(
+            seg["ntotal"] for seg in manifest.get("segments", [])
+        )
+        if (
+            self._stored_vectors(
+                db_vector_dir,
+                manifest.get("base_version"),
+                metadata,
+                manifest["dimension"],
+                ntotal,
+            )
+            is not None
+        ):
             return True
+        return (
+            manifest.get("staging")
+            or normalize_index_type(manifest.get("index_type"))
+            not in COMPRESSED_INDEX_TYPES
+        )
+
+    def rebuild_from_disk(
+        self, knowledge_db_id, index_type=None, user_id=None, role_id=None
+    ):
+        """用磁盘上保存的向量重建索引，不重新生成embedding，包含权限验证
+
+        index_type不为空时同时更换索引类型；已删除的向量一并清除。
+        """
+        # 如果提供了用户信息，进行权限验证
+        if user_id is not None and role_id is not None:
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
+            if not has_permission:
+                logger.error(f"重建索引失败: {result}")
+                return False
+
+        if (
+            index_type is not None
+            and normalize_index_type(index_type) not in SUPPORTED_INDEX_TYPES
+        ):
+            logger.error(f"重建索引失败: 不支持的索引类型 {index_type}")
+            return False
+        return self.compact_index(knowledge_db_id, index_type=index_type, force=True)
 
+    def convert_metric(self, knowledge_db_id, metric=METRIC_COSINE):
+        """将已有索引离线转换为指定度量方式，向量ID和ID映射保持不变"""
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        try:
+            with get_write_lock(knowledge_db_id):
+                if not self._ensure_index(knowledge_db_id):
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                    return False
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                index, segments, id_mapping = self._read_all(db_vector_dir, manifest)
+                if index.metric == metric:
+                    logger.info(
+                        f"知识库 {knowledge_db_id} 的索引已是 {metric} 度量，无需转换"
+                    )
+                    return True
+
+                metadata = self._read_metadata(metadata_path)
+                self.vector_dimension = index.dimension
+                self.index_type = normalize_index_type(
+                    metadata.get("index_type", self.index_type)
+                )
+
+                vectors = np.array(
+                    self._load_vectors(
+                        db_vector_dir,
+                        manifest.get("base_version"),
+                        index,
+                        metadata,
+                        segments,
+                    ),
+                    dtype="float32",
+                )
+                if metric == METRIC_COSINE:
+                    normalize_rows(vectors)
+
+                new_index = self._build_index(vectors, metric)
+
+                # 增量段一并写入新版本的基础索引
+                manifest["epoch"] = int(manifest.get("epoch", 0)) + 1
+                self._commit_base(
+                    db_vector_dir,
+                    manifest,
+                    new_index,
+                    self.index_type,
+                    id_mapping,
+                    metadata,
+                    vectors=vectors,
+                )
+                vector_index_cache.invalidate(str(knowledge_db_id))
+
+                if metadata:
+                    metadata["metric"] = metric
+                    metadata["raw_vectors"] = True
+                    metadata["nlist"] = new_index.nlist
+                    metadata["last_updated"] = str(np.datetime64("now"))
+                    save_metadata(metadata_path, metadata)
+
+                logger.info(
+                    f"已将知识库 {knowledge_db_id} 的索引转换为 {metric} 度量，共 {new_index.ntotal} 个向量"
+                )
+                return True
         except Exception as e:
-            logger.error(f"重建索引失败: {str(e)}", exc_info=True)
+            logger.error(f"转换索引度量方式失败: {str(e)}", exc_info=True)
+            return False
+
+    def update_search_config(
+        self,
+        knowledge_db_id,
+        nprobe=None,
+        user_id=None,
+        role_id=None,
+        ef_search=None,
+        tuning=None,
+    ):
+        """更新知识库的检索参数，保存在metadata.json中
+
+        nprobe用于IVF索引，ef_search用于HNSW索引；tuning为自动调优的记录。
+        """
+        # 如果提供了用户信息，进行权限验证
+        if user_id is not None and role_id is not None:
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
+            if not has_permission:
+                logger.error(f"更新检索参数失败: {result}")
+                return False
+
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        try:
+            with get_write_lock(knowledge_db_id):
+                metadata = self._read_metadata(metadata_path)
+                if not metadata:
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引元数据不存在")
+                    return False
+
+                if nprobe is not None:
+                    metadata["nprobe"] = int(nprobe)
+                if ef_search is not None:
+                    metadata["ef_search"] = int(ef_search)
+                if tuning is not None:
+                    metadata["search_tuning"] = tuning
+                metadata["last_updated"] = str(np.datetime64("now"))
+                save_metadata(metadata_path, metadata)
+
+                vector_index_cache.refresh(
+                    str(knowledge_db_id),
+                    list(self._base_paths(db_vector_dir, load_manifest(db_vector_dir))),
+                    optional_paths=[
+                        metadata_path,
+                        os.path.join(db_vector_dir, MANIFEST_FILENAME),
+                    ],
+                    metadata=metadata,
+                )
+
+            logger.info(
+                f"已更新知识库 {knowledge_db_id} 的检索参数: nprobe={nprobe}, ef_search={ef_search}"
+            )
+            return True
+        except Exception as e:
+            logger.error(f"更新检索参数失败: {str(e)}", exc_info=True)
             return False
 
     def cleanup_index(self, knowledge_db_id, user_id=None, role_id=None):
         """清理索引，包含权限验证"""
         # 如果提供了用户信息，进行权限验证
         if user_id is not None and role_id is not None:
-            has_permission, result = self._verify_user_permission(knowledge_db_id, user_id, role_id)
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
             if not has_permission:
                 logger.error(f"清理索引失败: {result}")
                 return False
 
         db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
-        
+
         try:
-            if os.path.exists(db_vector_dir):
-                import shutil
-                shutil.rmtree(db_vector_dir)
-                logger.info(f"已清理知识库 {knowledge_db_id} 的索引目录")
-                return True
-            else:
-                logger.info(f"知识库 {knowledge_db_id} 的索引目录不存在")
-                return True
+            with get_write_lock(knowledge_db_id):
+                if os.path.exists(db_vector_dir):
+                    import shutil
+
+                    shutil.rmtree(db_vector_dir)
+                    vector_index_cache.invalidate(str(knowledge_db_id))
+                    logger.info(f"已清理知识库 {knowledge_db_id} 的索引目录")
+                    return True
+                else:
+                    vector_index_cache.invalidate(str(knowledge_db_id))
+                    logger.info(f"知识库 {knowledge_db_id} 的索引目录不存在")
+                    return True
         except Exception as e:
             logger.error(f"清理索引失败: {str(e)}")
             return False
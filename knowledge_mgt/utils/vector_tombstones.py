@@ -0,0 +1,258 @@
+"""
+墓碑与压缩模块
+删除向量时只在ID映射中把对应位置标记为-1（墓碑），检索时以存活向量掩码排除；
+墓碑比例超过阈值后在后台线程压缩索引，存活向量重新编号
+"""
+
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .vector_backends import COMPRESSED_INDEX_TYPES, normalize_index_type
+from .vector_files import (
+    CHUNK_ATTRIBUTES_FILENAME,
+    get_write_lock,
+    load_chunk_attributes,
+    load_id_map,
+    resize_id_map,
+    save_chunk_attributes,
+    save_id_map,
+    save_metadata,
+)
+from .vector_index_cache import vector_index_cache
+from .vector_segments import MANIFEST_FILENAME, save_manifest, segment_paths
+
+logger = logging.getLogger(__name__)
+
+# 正在后台压缩的知识库ID
+_compacting = set()
+_compacting_guard = threading.Lock()
+
+
+def count_tombstones(ntotal, id_mapping):
+    """统计索引中已标记删除（ID映射为-1）的向量数量，ntotal为基础索引与增量段的向量总数"""
+    live = int(np.count_nonzero(np.asarray(id_mapping[:ntotal]) >= 0))
+    return ntotal - live
+
+
+class TombstoneMixin:
+    """VectorStore中删除向量与压缩索引的方法"""
+
+    def delete_vectors(self, knowledge_db_id, vector_ids, user_id=None, role_id=None):
+        """删除指定的向量，包含权限验证
+
+        只在ID映射中将对应位置标记为-1（墓碑），不改写索引文件，检索时过滤；
+        墓碑比例超过 VECTOR_INDEX_COMPACT_RATIO 时在后台线程压缩索引。
+        """
+        # 如果提供了用户信息，进行权限验证
+        if user_id is not None and role_id is not None:
+            has_permission, result = self._verify_user_permission(
+                knowledge_db_id, user_id, role_id
+            )
+            if not has_permission:
+                logger.error(f"删除向量失败: {result}")
+                return False
+
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+        manifest_path = os.path.join(db_vector_dir, MANIFEST_FILENAME)
+
+        try:
+            with get_write_lock(knowledge_db_id):
+                if not self._ensure_index(knowledge_db_id):
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                    return False
+
+                # 基础索引和各增量段分别保存自己的ID映射，只改写包含被删除向量的映射文件
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                index_path, mapping_path = self._base_paths(db_vector_dir, manifest)
+                delete_ids = np.fromiter(
+                    (int(vid) for vid in vector_ids),
+                    dtype=np.int64,
+                    count=len(vector_ids),
+                )
+                parts = [(0, manifest["base_ntotal"], mapping_path)]
+                parts += [
+                    (
+                        seg["offset"],
+                        seg["ntotal"],
+                        segment_paths(db_vector_dir, seg["name"])[1],
+                    )
+                    for seg in manifest["segments"]
+                ]
+
+                deleted = 0
+                id_parts = []
+                for offset, count, path in parts:
+                    part_ids = resize_id_map(load_id_map(path), count)
+                    local_ids = (
+                        delete_ids[
+                            (delete_ids >= offset) & (delete_ids < offset + count)
+                        ]
+                        - offset
+                    )
+                    if len(local_ids):
+                        deleted += int(np.count_nonzero(part_ids[local_ids] >= 0))
+                        part_ids = part_ids.copy()
+                        part_ids[local_ids] = -1
+                        save_id_map(path, part_ids)
+                    id_parts.append(part_ids)
+                id_mapping = np.concatenate(id_parts)
+                save_manifest(db_vector_dir, manifest)
+
+                # 更新元数据
+                tombstones = int(np.count_nonzero(id_mapping < 0))
+                metadata = self._read_metadata(metadata_path)
+                if metadata:
+                    metadata["total_vectors"] = len(id_mapping) - tombstones
+                    metadata["deleted_vectors"] = tombstones
+                    metadata["last_updated"] = str(np.datetime64("now"))
+                    save_metadata(metadata_path, metadata)
+
+                # 索引文件未变化，只需刷新缓存中的映射
+                vector_index_cache.refresh(
+                    str(knowledge_db_id),
+                    [index_path, mapping_path],
+                    optional_paths=[metadata_path, manifest_path],
+                    id_mapping=id_mapping,
+                    metadata=metadata,
+                )
+
+            logger.info(
+                f"已从知识库 {knowledge_db_id} 删除 {deleted} 个向量，当前墓碑数 {tombstones}"
+            )
+
+            compact_ratio = getattr(settings, "VECTOR_INDEX_COMPACT_RATIO", 0.2)
+            if len(id_mapping) and tombstones / len(id_mapping) > compact_ratio:
+                self._schedule_compaction(knowledge_db_id)
+            return True
+
+        except Exception as e:
+            logger.error(f"删除向量失败: {str(e)}", exc_info=True)
+            return False
+
+    def _schedule_compaction(self, knowledge_db_id):
+        """在后台线程压缩知识库索引，同一知识库同时只会有一个压缩任务"""
+        key = str(knowledge_db_id)
+        with _compacting_guard:
+            if key in _compacting:
+                return
+            _compacting.add(key)
+
+        def run():
+            try:
+                from .vector_store import VectorStore
+
+                VectorStore(
+                    self.vector_dimension, self.index_type, local=True
+                ).compact_index(knowledge_db_id)
+            finally:
+                with _compacting_guard:
+                    _compacting.discard(key)
+                # 后台线程使用的数据库连接需要手动关闭
+                connection.close()
+
+        threading.Thread(target=run, name=f"vector-compact-{key}", daemon=True).start()
+        logger.info(f"知识库 {knowledge_db_id} 的墓碑比例超过阈值，已启动后台压缩")
+
+    def compact_index(self, knowledge_db_id, index_type=None, force=False):
+        """清除已标记删除的向量并重建索引
+
+        存活向量按原顺序重新编号，并同步更新分块表中的vector_id。index_type不为空时同时转换索引类型，
+        force为True时即使没有已删除的向量也重建。向量从原始向量文件读取，无需重新生成embedding。
+        从读取段清单到同步分块表的整个过程持有知识库写锁，其他进程的添加和删除会等压缩提交后按新的向量ID进行。
+        """
+        db_vector_dir = os.path.join(self.vector_dir, str(knowledge_db_id))
+        metadata_path = os.path.join(db_vector_dir, "metadata.json")
+
+        try:
+            with get_write_lock(knowledge_db_id):
+                if not self._ensure_index(knowledge_db_id):
+                    logger.warning(f"知识库 {knowledge_db_id} 的索引不存在")
+                    return False
+
+                # 增量段一并压缩进基础索引
+                manifest = self._load_manifest_for_write(db_vector_dir)
+                index, segments, id_mapping = self._read_all(db_vector_dir, manifest)
+                ntotal = len(id_mapping)
+                keep = np.flatnonzero(id_mapping >= 0)
+                if len(keep) == ntotal and not force and index_type is None:
+                    logger.info(f"知识库 {knowledge_db_id} 没有需要清除的向量")
+                    return True
+
+                metadata = self._read_metadata(metadata_path)
+                old_index_type = normalize_index_type(
+                    metadata.get("index_type", self.index_type)
+                )
+                self.vector_dimension = index.dimension
+                self.index_type = (
+                    normalize_index_type(index_type) if index_type else old_index_type
+                )
+
+                # 批量取出存活向量重建索引，向量已按原度量方式处理过，无需再次归一化
+                vectors = np.ascontiguousarray(
+                    self._load_vectors(
+                        db_vector_dir,
+                        manifest.get("base_version"),
+                        index,
+                        metadata,
+                        segments,
+                    )[keep]
+                )
+                new_index = self._build_index(vectors, index.metric)
+                new_mapping = id_mapping[keep]
+
+                # 向量重新编号后的基础索引、ID映射和原始向量写入新版本文件，提交段清单时一并切换
+                manifest["epoch"] = int(manifest.get("epoch", 0)) + 1
+                self._commit_base(
+                    db_vector_dir,
+                    manifest,
+                    new_index,
+                    self.index_type,
+                    new_mapping,
+                    metadata,
+                    vectors=vectors,
+                )
+
+                # 分块属性表只保留存活分块
+                attributes_path = os.path.join(db_vector_dir, CHUNK_ATTRIBUTES_FILENAME)
+                attributes = load_chunk_attributes(attributes_path)
+                if attributes is not None:
+                    save_chunk_attributes(
+                        attributes_path,
+                        attributes[np.isin(attributes["chunk_id"], new_mapping)],
+                    )
+                vector_index_cache.invalidate(str(knowledge_db_id))
+
+                if metadata:
+                    if self.index_type != old_index_type:
+                        # 更换索引类型时按新类型的默认值决定是否重排序，HNSW检索参数不再适用于IVF，反之亦然
+                        metadata["rerank"] = self.index_type in COMPRESSED_INDEX_TYPES
+                        metadata.pop("nprobe", None)
+                        metadata.pop("ef_search", None)
+                        metadata.pop("search_tuning", None)
+                    metadata["index_type"] = self.index_type
+                    metadata["raw_vectors"] = True
+                    metadata["total_vectors"] = new_index.ntotal
+                    metadata["deleted_vectors"] = 0
+                    metadata["nlist"] = new_index.nlist
+                    metadata["last_updated"] = str(np.datetime64("now"))
+                    save_metadata(metadata_path, metadata)
+
+                # 没有清除向量时向量ID不变，无需更新分块表
+                if len(keep) < ntotal:
+                    self._sync_chunk_vector_ids(new_mapping)
+
+            logger.info(
+                f"已重建知识库 {knowledge_db_id} 的{self.index_type}索引，"
+                f"清除 {ntotal - new_index.ntotal} 个已删除向量"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"压缩索引失败: {str(e)}", exc_info=True)
+            return False
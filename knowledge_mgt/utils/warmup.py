@@ -0,0 +1,167 @@
+"""
+启动预热模块
+按最近的会话访问量选出最常用的知识库，提前加载其向量索引和绑定的嵌入模型并执行一次空查询，
+避免进程启动后的第一批请求承担索引读盘、模型加载和首次推理的延迟。
+预热完成前 /health/ 报告未就绪，负载均衡不会把请求转发到尚未预热的实例。
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from zhiqing_server.utils.db_utils import execute_query_with_params
+
+logger = logging.getLogger(__name__)
+
+WARMUP_PENDING = 'pending'
+WARMUP_RUNNING = 'running'
+WARMUP_READY = 'ready'
+WARMUP_FAILED = 'failed'
+
+# 本进程的预热状态，供健康检查读取
+_state = {
+    'status': WARMUP_PENDING,
+    'started_at': None,
+    'finished_at': None,
+    'knowledge_bases': [],
+    'models': [],
+    'errors': [],
+}
+_lock = threading.Lock()
+_thread = None
+
+
+def warmup_enabled():
+    return getattr(settings, 'VECTOR_WARMUP_ON_START', False)
+
+
+def get_warmup_state():
+    """返回本进程预热状态的副本"""
+    with _lock:
+        return {key: list(value) if isinstance(value, list) else value for key, value in _state.items()}
+
+
+def is_warmup_ready():
+    """只有预热进行中视为未就绪；未启动预热（例如未通过gunicorn启动）或预热失败都视为就绪，只是首批请求没有被加速"""
+    with _lock:
+        return _state['status'] != WARMUP_RUNNING
+
+
+def get_hot_knowledge_bases(limit=None, days=None):
+    """按最近days天的会话数量取访问最多的知识库，返回知识库配置列表"""
+    limit = limit or getattr(settings, 'VECTOR_WARMUP_KB_LIMIT', 10)
+    days = days or getattr(settings, 'VECTOR_WARMUP_DAYS', 7)
+    sql = """
+        SELECT kb.id, kb.name, kb.vector_dimension, kb.index_type, kb.embedding_model_id,
+               COUNT(c.id) AS conversation_count
+        FROM chat_conversation c
+        JOIN knowledge_database kb ON c.knowledge_base_id = kb.id
+        WHERE c.update_time >= DATE_SUB(NOW(), INTERVAL %s DAY)
+        GROUP BY kb.id, kb.name, kb.vector_dimension, kb.index_type, kb.embedding_model_id
+        ORDER BY conversation_count DESC
+        LIMIT %s
+    """
+    return execute_query_with_params(sql, [int(days), int(limit)]) or []
+
+
+def _warmup_query_vector(dimension):
+    # 单位向量，L2与余弦度量下都能正常检索
+    vector = np.ones(dimension, dtype='float32')
+    return vector / np.sqrt(dimension)
+
+
+def warm_up_index(kb):
+    """加载知识库索引并执行一次检索，返回是否成功"""
+    from .vector_store import VectorStore
+
+    vector_store = VectorStore(vector_dimension=kb['vector_dimension'], index_type=kb['index_type'])
+    if not vector_store.has_stored_vectors(kb['id']):
+        return False
+    vector_store.search(kb['id'], _warmup_query_vector(kb['vector_dimension']), top_k=1)
+    return True
+
+
+def warm_up_embedding_model(model_id):
+    """加载本地嵌入模型并执行一次推理，在线模型无需预热，返回是否加载了模型"""
+    from .embeddings import local_embedding_manager, get_embedding_model_by_id
+
+    model_cfg = get_embedding_model_by_id(model_id)
+    if not model_cfg or model_cfg.get('api_type') != 'local':
+        return False
+    with local_embedding_manager.use_model(model_id, model_cfg) as embedding_model:
+        embedding_model.embed_text('预热')
+    return True
+
+
+def warm_up(limit=None, days=None):
+    """执行预热：加载热门知识库的索引和绑定的本地嵌入模型
+
+    本地模型按访问量从低到高加载，访问量最高的模型最后使用，超出模型池内存预算时先被卸载的是冷门模型。
+    单个知识库预热失败只记录错误，不影响其余知识库。返回预热状态。
+    """
+    with _lock:
+        _state.update(status=WARMUP_RUNNING, started_at=datetime.now().isoformat(), finished_at=None,
+                      knowledge_bases=[], models=[], errors=[])
+    start = time.time()
+    try:
+        hot_kbs = get_hot_knowledge_bases(limit, days)
+    except Exception as e:
+        logger.error(f"读取知识库访问统计失败，跳过预热: {str(e)}")
+        with _lock:
+            _state.update(status=WARMUP_FAILED, finished_at=datetime.now().isoformat(), errors=[str(e)])
+        return get_warmup_state()
+
+    model_ids = []
+    for kb in hot_kbs:
+        try:
+            if warm_up_index(kb):
+                with _lock:
+                    _state['knowledge_bases'].append(kb['id'])
+        except Exception as e:
+            logger.warning(f"预热知识库 {kb['id']} 的索引失败: {str(e)}")
+            with _lock:
+                _state['errors'].append(f"知识库 {kb['id']}: {str(e)}")
+        if kb.get('embedding_model_id') and kb['embedding_model_id'] not in model_ids:
+            model_ids.append(kb['embedding_model_id'])
+
+    for model_id in reversed(model_ids):
+        try:
+            if warm_up_embedding_model(model_id):
+                with _lock:
+                    _state['models'].append(model_id)
+        except Exception as e:
+            logger.warning(f"预热嵌入模型 {model_id} 失败: {str(e)}")
+            with _lock:
+                _state['errors'].append(f"嵌入模型 {model_id}: {str(e)}")
+
+    with _lock:
+        _state.update(status=WARMUP_READY, finished_at=datetime.now().isoformat())
+        warmed = len(_state['knowledge_bases'])
+    logger.info(f"预热完成: {warmed}/{len(hot_kbs)} 个知识库索引，耗时 {time.time() - start:.2f} 秒")
+    return get_warmup_state()
+
+
+def _run_in_background(limit, days):
+    try:
+        warm_up(limit, days)
+    finally:
+        close_old_connections()
+
+
+def start_warmup_in_background(limit=None, days=None):
+    """在后台线程中执行预热，用于gunicorn工作进程fork后的 post_worker_init 钩子，同一进程只启动一次"""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return _thread
+        # 线程启动前就标记为进行中，工作进程开始接收请求时健康检查已是未就绪
+        _state['status'] = WARMUP_RUNNING
+        _thread = threading.Thread(target=_run_in_background, args=(limit, days), name='vector-warmup',
+                                   daemon=True)
+        _thread.start()
+        return _thread
@@ -171,8 +171,14 @@ class LLMsManager:
         """为特定知识库加载embedding模型"""
         try:
             model_type = model_config.get('model_type', 'dashscope')
+            from knowledge_mgt.utils.embedding_server import embedding_server_url, remote_llamaindex_embedding
             
-            if model_type == "dashscope":
+            if model_type in ("huggingface", "sentence_transformers") and embedding_server_url() \
+                    and model_config.get('id'):
+                # 本地模型由本机嵌入服务持有，各进程共享同一份权重
+                embed_model = remote_llamaindex_embedding(model_config)
+                
+            elif model_type == "dashscope":
                 # 阿里云通义千问Embedding
                 from llama_index.embeddings.dashscope import DashScopeEmbedding, DashScopeTextEmbeddingModels
                 # 依赖环境变量 DASHSCOPE_API_KEY，由 LlamaIndex 内部读取
@@ -259,8 +265,9 @@ class LLMsManager:
                 logger.error(f"不支持的Embedding类型: {model_type}")
                 return False
             
-            # 存储知识库对应的模型
-            self.knowledge_base_models[knowledge_base_id] = embed_model
+            # 存储知识库对应的模型，文档向量经过持久化嵌入缓存，已生成过的文本不再重复请求模型
+            from knowledge_mgt.utils.embedding_cache import with_embedding_cache
+            self.knowledge_base_models[knowledge_base_id] = with_embedding_cache(embed_model, model_config)
             logger.info(f"成功为知识库 {knowledge_base_id} 加载 {model_type} Embedding模型: {model_config.get('name')}")
             return True
             
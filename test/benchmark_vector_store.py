@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储性能基准测试
+对每种索引类型及参数组合测量：构建耗时、添加吞吐、检索延迟p50/p99、相对精确检索的recall@k、
+磁盘占用和常驻内存（RSS），结果以表格打印并写入JSON文件，便于在版本之间对比回归。
+
+用法示例：
+    python test/benchmark_vector_store.py --sizes 10000,100000 --dim 384
+    python test/benchmark_vector_store.py --vectors-file embeddings.npy --index-types HNSW,IVF
+    python test/benchmark_vector_store.py --knowledge-db-id 18 --metric cosine
+
+所有索引都建在临时目录中，不会读写 media/vector_indexes 下的正式索引。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+# 添加项目路径并设置 Django 环境
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zhiqing_server.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import faiss  # noqa: E402
+import psutil  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from knowledge_mgt.utils.vector_store import (  # noqa: E402
+    VectorStore, SUPPORTED_INDEX_TYPES, COMPRESSED_INDEX_TYPES, METRIC_COSINE, reconstruct_all
+)
+from knowledge_mgt.utils.vector_index_cache import vector_index_cache  # noqa: E402
+
+DEFAULT_SIZES = "10000,100000,1000000"
+DEFAULT_NPROBES = "1,8,32,128"
+DEFAULT_EF_SEARCHES = "16,64,256"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='VectorStore 索引类型性能基准测试')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'语料规模列表，逗号分隔，默认 {DEFAULT_SIZES}')
+    parser.add_argument('--dim', type=int, default=384, help='合成语料的向量维度，默认384')
+    parser.add_argument('--index-types', default=','.join(SUPPORTED_INDEX_TYPES),
+                        help='待测试的索引类型，逗号分隔，默认全部')
+    parser.add_argument('--metric', choices=['l2', METRIC_COSINE], default='l2', help='度量方式，默认l2')
+    parser.add_argument('--nprobes', default=DEFAULT_NPROBES, help=f'IVF类索引测试的nprobe列表，默认 {DEFAULT_NPROBES}')
+    parser.add_argument('--ef-searches', default=DEFAULT_EF_SEARCHES,
+                        help=f'HNSW类索引测试的efSearch列表，默认 {DEFAULT_EF_SEARCHES}')
+    parser.add_argument('--queries', type=int, default=200, help='查询数量，默认200')
+    parser.add_argument('--top-k', type=int, default=10, help='检索数量及recall@k的k，默认10')
+    parser.add_argument('--add-batch-size', type=int, default=10000, help='每次add_vectors的向量数，默认10000')
+    parser.add_argument('--vectors-file', help='真实向量语料（.npy，形状为 (n, d) 的float32矩阵）')
+    parser.add_argument('--knowledge-db-id', type=int, help='从已有知识库索引中取出向量作为真实语料')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--output', help='JSON结果文件路径，默认写入当前目录 benchmark_vector_store_<时间>.json')
+    parser.add_argument('--keep-dir', action='store_true', help='保留临时索引目录，便于检查索引文件')
+    return parser.parse_args()
+
+
+def synthetic_corpus(num_vectors, dim, seed, num_clusters=100):
+    """生成带聚类结构的合成语料，比均匀随机向量更接近真实embedding的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype('float32')
+    vectors = np.empty((num_vectors, dim), dtype='float32')
+    block = 100000
+    for start in range(0, num_vectors, block):
+        end = min(start + block, num_vectors)
+        labels = rng.integers(0, num_clusters, size=end - start)
+        vectors[start:end] = centers[labels] + 0.5 * rng.normal(size=(end - start, dim)).astype('float32')
+    return vectors
+
+
+def load_knowledge_db_vectors(knowledge_db_id):
+    """从已有知识库的索引文件（基础索引及增量段）中取出全部向量，跳过已删除的向量"""
+    cached = VectorStore()._load_cached_index(knowledge_db_id)
+    if cached is None:
+        raise SystemExit(f'知识库 {knowledge_db_id} 的索引不存在')
+    vectors = reconstruct_all(cached.index, cached.segments)
+    return np.ascontiguousarray(vectors[np.asarray(cached.id_mapping) >= 0], dtype='float32')
+
+
+def load_corpus(args):
+    """返回 (语料名称, 完整语料, 查询向量)；真实语料按最大规模截取，查询取自语料之外的样本"""
+    if args.vectors_file or args.knowledge_db_id is not None:
+        if args.vectors_file:
+            vectors = np.load(args.vectors_file, mmap_mode='r')
+            name = os.path.basename(args.vectors_file)
+        else:
+            vectors = load_knowledge_db_vectors(args.knowledge_db_id)
+            name = f'knowledge_db_{args.knowledge_db_id}'
+        if len(vectors) <= args.queries:
+            raise SystemExit(f'真实语料只有 {len(vectors)} 个向量，不足以划分出 {args.queries} 个查询')
+        rng = np.random.default_rng(args.seed)
+        order = rng.permutation(len(vectors))
+        queries = np.ascontiguousarray(vectors[np.sort(order[:args.queries])], dtype='float32')
+        corpus = np.ascontiguousarray(vectors[np.sort(order[args.queries:])], dtype='float32')
+        return name, corpus, queries
+
+    max_size = max(int(s) for s in args.sizes.split(','))
+    data = synthetic_corpus(max_size + args.queries, args.dim, args.seed)
+    return 'synthetic', data[:max_size], data[max_size:]
+
+
+def ground_truth(corpus, queries, k, metric):
+    """用精确Flat检索计算真实近邻"""
+    if metric == METRIC_COSINE:
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        index = faiss.IndexFlatIP(corpus.shape[1])
+    else:
+        index = faiss.IndexFlatL2(corpus.shape[1])
+    index.add(np.ascontiguousarray(corpus, dtype='float32'))
+    _, labels = index.search(np.ascontiguousarray(queries, dtype='float32'), k)
+    return labels
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+def build(vector_store, knowledge_db_id, corpus, batch_size, rerank):
+    """建索引并逐批添加向量，最后强制合并增量段；返回 (添加耗时, 构建总耗时)"""
+    start = time.perf_counter()
+    if not vector_store.create_index(knowledge_db_id, rerank=rerank):
+        raise RuntimeError(f'知识库 {knowledge_db_id} 创建索引失败')
+    for offset in range(0, len(corpus), batch_size):
+        batch = corpus[offset:offset + batch_size]
+        if not vector_store.add_vectors(knowledge_db_id, list(range(offset, offset + len(batch))), batch):
+            raise RuntimeError(f'知识库 {knowledge_db_id} 添加向量失败')
+    add_seconds = time.perf_counter() - start
+    vector_store.merge_segments(knowledge_db_id, force=True)
+    return add_seconds, time.perf_counter() - start
+
+
+def measure_search(vector_store, knowledge_db_id, queries, truth, k, params):
+    """逐条检索测量延迟与recall，再用批量检索测量吞吐"""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = vector_store.search(knowledge_db_id, query, top_k=k, **params)
+        latencies.append(time.perf_counter() - start)
+        hits += len({r['chunk_id'] for r in results} & set(expected.tolist()))
+
+    start = time.perf_counter()
+    vector_store.search_batch(knowledge_db_id, queries, top_k=k, **params)
+    batch_seconds = time.perf_counter() - start
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'recall_at_k': round(hits / (len(queries) * k), 4),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'batch_qps': round(len(queries) / batch_seconds, 1) if batch_seconds > 0 else None,
+    }
+
+
+def benchmark_index_type(work_dir, knowledge_db_id, index_type, rerank, corpus, queries, truth, args, nprobes,
+                         ef_searches):
+    """测试一种索引类型（及重排序配置）在一个语料规模下的全部检索参数"""
+    metric = METRIC_COSINE if args.metric == METRIC_COSINE else None
+    vector_store = VectorStore(vector_dimension=corpus.shape[1], index_type=index_type, metric=metric)
+    vector_store.vector_dir = work_dir
+    process = psutil.Process()
+
+    add_seconds, build_seconds = build(vector_store, knowledge_db_id, corpus, args.add_batch_size, rerank)
+
+    # 从磁盘冷加载一次，加载前后的RSS差值即该索引的常驻内存
+    vector_index_cache.invalidate(str(knowledge_db_id))
+    rss_before = process.memory_info().rss
+    vector_store.search(knowledge_db_id, queries[0], top_k=args.top_k)
+    cached = vector_store._load_cached_index(knowledge_db_id)
+    for query in queries[:10]:
+        vector_store.search(knowledge_db_id, query, top_k=args.top_k)
+    rss_bytes = max(process.memory_info().rss - rss_before, 0)
+
+    common = {
+        'size': len(corpus),
+        'index_type': index_type,
+        'rerank': rerank,
+        'built_as': cached.index.description,
+        'build_seconds': round(build_seconds, 3),
+        'add_throughput': round(len(corpus) / add_seconds, 1) if add_seconds > 0 else None,
+        'disk_mb': round(dir_size(os.path.join(work_dir, str(knowledge_db_id))) / 1024 / 1024, 2),
+        'rss_mb': round(rss_bytes / 1024 / 1024, 2),
+    }
+
+    tunable = cached.index.tunable_param()
+    if tunable is not None and tunable[0] == 'nprobe':
+        param_sets = [{'nprobe': n} for n in sorted({min(n, cached.index.nlist) for n in nprobes})]
+    elif tunable is not None and tunable[0] == 'ef_search':
+        param_sets = [{'ef_search': ef} for ef in ef_searches]
+    else:
+        param_sets = [{}]
+
+    rows = []
+    for params in param_sets:
+        row = dict(common, params=params)
+        row.update(measure_search(vector_store, knowledge_db_id, queries, truth, args.top_k, params))
+        rows.append(row)
+    vector_store.cleanup_index(knowledge_db_id)
+    return rows
+
+
+def format_table(rows):
+    columns = [
+        ('size', '规模'), ('index_type', '索引类型'), ('rerank', '重排'), ('params', '参数'),
+        ('recall_at_k', 'recall@k'), ('p50_ms', 'p50(ms)'), ('p99_ms', 'p99(ms)'), ('batch_qps', '批量QPS'),
+        ('build_seconds', '构建(s)'), ('add_throughput', '添加(向量/s)'), ('disk_mb', '磁盘(MB)'), ('rss_mb', 'RSS(MB)'),
+    ]
+
+    def cell(row, key):
+        value = row.get(key)
+        if key == 'params':
+            return ','.join(f'{k}={v}' for k, v in value.items()) or '-'
+        return '-' if value is None else str(value)
+
+    table = [[title for _, title in columns]] + [[cell(row, key) for key, _ in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    lines = ['  '.join(value.ljust(width) for value, width in zip(line, widths)) for line in table]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def main():
+    args = parse_args()
+    # 基准测试只关心耗时，屏蔽向量存储逐批写入的INFO日志
+    logging.getLogger('knowledge_mgt').setLevel(logging.WARNING)
+
+    index_types = [t.strip() for t in args.index_types.split(',') if t.strip()]
+    unknown = [t for t in index_types if t not in SUPPORTED_INDEX_TYPES]
+    if unknown:
+        raise SystemExit(f'不支持的索引类型: {unknown}，可选 {SUPPORTED_INDEX_TYPES}')
+    nprobes = [int(n) for n in args.nprobes.split(',')]
+    ef_searches = [int(ef) for ef in args.ef_searches.split(',')]
+
+    corpus_name, full_corpus, queries = load_corpus(args)
+    sizes = sorted({min(int(s), len(full_corpus)) for s in args.sizes.split(',')})
+    print(f'语料: {corpus_name}，维度 {full_corpus.shape[1]}，规模 {sizes}，查询 {len(queries)} 条，k={args.top_k}，'
+          f'度量 {args.metric}')
+
+    work_dir = tempfile.mkdtemp(prefix='vector_benchmark_')
+    rows = []
+    knowledge_db_id = 0
+    try:
+        for size in sizes:
+            corpus = full_corpus[:size]
+            truth = ground_truth(corpus, queries, args.top_k, args.metric)
+            for index_type in index_types:
+                # 压缩索引分别测试开启和关闭全精度重排序
+                rerank_options = (True, False) if index_type in COMPRESSED_INDEX_TYPES else (False,)
+                for rerank in rerank_options:
+                    knowledge_db_id += 1
+                    print(f'测试 {index_type} (rerank={rerank}) @ {size} ...', flush=True)
+                    try:
+                        rows.extend(benchmark_index_type(work_dir, knowledge_db_id, index_type, rerank,
+                                                         corpus, queries, truth, args, nprobes, ef_searches))
+                    except Exception as e:
+                        print(f'  失败: {str(e)}')
+                        rows.append({'size': size, 'index_type': index_type, 'rerank': rerank, 'params': {},
+                                     'error': str(e)})
+    finally:
+        if args.keep_dir:
+            print(f'索引目录已保留: {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print(format_table(rows))
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'faiss': getattr(faiss, '__version__', 'unknown'),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'faiss_threads': faiss.omp_get_max_threads(),
+        },
+        'config': {
+            'corpus': corpus_name,
+            'dimension': int(full_corpus.shape[1]),
+            'sizes': sizes,
+            'queries': len(queries),
+            'top_k': args.top_k,
+            'metric': args.metric,
+            'add_batch_size': args.add_batch_size,
+            'ivf_train_threshold': getattr(settings, 'VECTOR_IVF_TRAIN_THRESHOLD', None),
+        },
+        'results': rows,
+    }
+    output = args.output or f"benchmark_vector_store_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'\n结果已写入: {output}')
+
+
+if __name__ == '__main__':
+    main()
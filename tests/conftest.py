@@ -0,0 +1,127 @@
+"""
+pytest公共配置
+单元测试不访问数据库：未安装pytest-django或Django尚未配置时，使用最小配置初始化Django，
+MEDIA_ROOT等目录由各测试通过fixture指向临时目录
+"""
+
+import tempfile
+
+import django
+import numpy as np
+import pytest
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY="zhiqing-tests",
+        USE_TZ=False,
+        INSTALLED_APPS=[],
+        DATABASES={},
+        MEDIA_ROOT=tempfile.mkdtemp(prefix="zhiqing-tests-"),
+    )
+    django.setup()
+
+
+class FakeCursor:
+    """记录执行的SQL与参数，fetchall/fetchone返回预置的行"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, list(params or [])))
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    """替代 django.db.connection，所有cursor()返回同一个FakeCursor"""
+
+    def __init__(self, rows=()):
+        self.cursor_obj = FakeCursor(rows)
+
+    def cursor(self):
+        return self.cursor_obj
+
+
+@pytest.fixture
+def fake_connection():
+    """构造FakeConnection，rows为查询返回的行"""
+    return FakeConnection
+
+
+@pytest.fixture
+def background_tasks():
+    """记录向量存储安排的后台任务 (任务名, 知识库ID)"""
+    return []
+
+
+@pytest.fixture(params=["numpy", "faiss"])
+def vector_env(request, tmp_path, monkeypatch, background_tasks):
+    """在临时MEDIA_ROOT中使用指定检索后端的向量存储环境
+
+    合并、压缩、迁移不启动后台线程，只记录到background_tasks，由测试显式调用；同步数据库的方法替换为空操作。
+    """
+    from knowledge_mgt.utils import vector_backends
+    from knowledge_mgt.utils.vector_index_cache import vector_index_cache
+    from knowledge_mgt.utils.vector_store import VectorStore
+
+    if request.param == "faiss" and not vector_backends.FAISS_AVAILABLE:
+        pytest.skip("FAISS未安装")
+    monkeypatch.setattr(settings, "MEDIA_ROOT", str(tmp_path), raising=False)
+    monkeypatch.setattr(settings, "VECTOR_BACKEND", request.param, raising=False)
+    monkeypatch.setattr(settings, "VECTOR_SERVICE_SOCKET", "", raising=False)
+    monkeypatch.setattr(settings, "VECTOR_SEGMENT_MERGE_RATIO", 10, raising=False)
+    monkeypatch.setattr(settings, "VECTOR_INDEX_COMPACT_RATIO", 0.99, raising=False)
+    monkeypatch.setattr(settings, "VECTOR_INDEX_MIGRATION_POLICY", "", raising=False)
+    monkeypatch.setattr(
+        VectorStore, "_sync_chunk_vector_ids", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        VectorStore, "_update_knowledge_db_index_type", lambda *args, **kwargs: None
+    )
+    for name in ("_schedule_merge", "_schedule_compaction", "schedule_migration"):
+        monkeypatch.setattr(
+            VectorStore,
+            name,
+            lambda self, knowledge_db_id, *args, _name=name, **kwargs: background_tasks.append(
+                (_name, knowledge_db_id)
+            ),
+        )
+    vector_index_cache.clear()
+    yield request.param
+    vector_index_cache.clear()
+
+
+@pytest.fixture
+def vectors():
+    """固定随机种子的 (400, 16) float32向量"""
+    return np.random.default_rng(0).standard_normal((400, 16)).astype("float32")
+
+
+@pytest.fixture
+def populated_store(vector_env, vectors):
+    """知识库1中分两批写入vectors，分块ID为1000起的连续整数"""
+    from knowledge_mgt.utils.vector_store import VectorStore
+
+    store = VectorStore(vector_dimension=16, index_type="Flat")
+    assert store.create_index(1)
+    store.add_vectors(
+        1, list(range(1000, 1200)), vectors[:200], chunk_attributes={"document_id": 1}
+    )
+    store.add_vectors(
+        1, list(range(1200, 1400)), vectors[200:], chunk_attributes={"document_id": 2}
+    )
+    return store
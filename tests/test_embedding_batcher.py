@@ -0,0 +1,83 @@
+"""
+嵌入请求合并调度测试：并发 embed_text 请求合并为一次批量推理，整批失败时逐条重试
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from knowledge_mgt.utils.embeddings import EmbeddingBatcher  # noqa: E402
+
+
+def test_batcher_merges_concurrent_requests():
+    batches = []
+
+    def encode(texts):
+        batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(encode, max_batch=16, max_wait_ms=50, name="test")
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(
+                pool.map(batcher.submit, [f"text {i:02d}" for i in range(16)])
+            )
+    finally:
+        batcher.close()
+
+    assert results == [[7.0]] * 16
+    assert sorted(text for batch in batches for text in batch) == [
+        f"text {i:02d}" for i in range(16)
+    ]
+    assert len(batches) < 16
+    assert (batcher.batches, batcher.items) == (len(batches), 16)
+
+
+def test_batcher_retries_items_of_failed_batch():
+    def encode(texts):
+        if "bad" in texts:
+            raise ValueError("无法编码")
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(encode, max_batch=8, max_wait_ms=50, name="test")
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                pool.submit(batcher.submit, text) for text in ("a", "bad", "c", "d")
+            ]
+    finally:
+        batcher.close()
+
+    assert isinstance(futures[1].exception(), ValueError)
+    assert [futures[i].result() for i in (0, 2, 3)] == [[1.0]] * 3
+    with pytest.raises(RuntimeError):
+        batcher.submit("e")
+
+
+def test_close_fails_requests_still_queued():
+    started = threading.Event()
+    release = threading.Event()
+
+    def encode(texts):
+        started.set()
+        release.wait(5)
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(encode, max_batch=1, max_wait_ms=0, name="test")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        running = pool.submit(batcher.submit, "a")
+        assert started.wait(5)
+        queued = pool.submit(batcher.submit, "b")
+        while batcher._queue.empty():
+            time.sleep(0.001)
+        batcher.close()
+        release.set()
+
+        # 正在推理的批次照常返回，队列中尚未取出的请求收到异常
+        assert running.result(5) == [1.0]
+        assert isinstance(queued.exception(5), RuntimeError)
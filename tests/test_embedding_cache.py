@@ -0,0 +1,93 @@
+"""
+嵌入向量持久化缓存测试：只为未命中的文本推理，规范化后相同的文本共用缓存，按模型区分，超过上限时淘汰
+"""
+
+import numpy as np
+import pytest
+
+from knowledge_mgt.utils import embedding_cache
+from knowledge_mgt.utils.embedding_cache import (
+    EmbeddingCache,
+    embedding_model_key,
+    text_hash,
+)
+
+
+class RecordingEncoder:
+    """记录每次被调用时的文本，向量第一维为文本长度"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.0, 0.5] for text in texts]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embedding_cache.sqlite3"), max_bytes=0)
+
+
+def test_only_misses_are_encoded(cache):
+    encoder = RecordingEncoder()
+    first = cache.embed("m1", ["alpha", "beta"], encoder)
+    second = cache.embed("m1", ["beta", "gamma", "alpha"], encoder)
+
+    assert encoder.calls == [["alpha", "beta"], ["gamma"]]
+    assert second[0] == first[1]
+    assert second[2] == first[0]
+    assert cache.stats()["entries"] == 3
+
+
+def test_normalized_duplicates_share_one_entry(cache):
+    encoder = RecordingEncoder()
+    vectors = cache.embed(
+        "m1", ["hello  world", " hello world\n", "hello world"], encoder
+    )
+
+    assert encoder.calls == [["hello  world"]]
+    assert vectors[0] == vectors[1] == vectors[2]
+    assert text_hash("\u00e1") == text_hash("a\u0301")
+
+
+def test_vectors_are_stored_as_float16(cache):
+    cache.put_many("m1", ["x"], [[0.1, 0.2, 0.3]])
+
+    assert np.allclose(cache.get_many("m1", ["x"])[0], [0.1, 0.2, 0.3], atol=1e-3)
+
+
+def test_models_do_not_share_entries(cache):
+    encoder = RecordingEncoder()
+    cache.embed("m1", ["alpha"], encoder)
+    cache.embed("m2", ["alpha"], encoder)
+    assert len(encoder.calls) == 2
+
+    cache.clear("m1")
+    assert cache.get_many("m1", ["alpha"]) == [None]
+    assert cache.get_many("m2", ["alpha"])[0] is not None
+
+
+def test_model_key_changes_with_model_config():
+    config = {"id": 3, "model_type": "sentence-transformers", "model_name": "bge-small"}
+
+    assert embedding_model_key(config).startswith("3:")
+    assert embedding_model_key(config) != embedding_model_key(
+        dict(config, model_name="bge-large")
+    )
+    assert embedding_model_key(config) == embedding_model_key(
+        dict(config, batch_size=64)
+    )
+
+
+def test_evicts_least_recently_used_over_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "SIZE_CHECK_EVERY", 1)
+    cache = EmbeddingCache(str(tmp_path / "small.sqlite3"), max_bytes=64 * 1024)
+    vector = np.ones(256, dtype="float32")
+    for start in range(0, 400, 20):
+        texts = [f"chunk {i}" for i in range(start, start + 20)]
+        cache.put_many("m1", texts, [vector] * len(texts))
+
+    assert cache.stats()["entries"] < 400
+    assert cache.get_many("m1", ["chunk 399"])[0] is not None
+    assert cache.get_many("m1", ["chunk 0"]) == [None]
@@ -0,0 +1,133 @@
+"""
+本地嵌入模型池测试：多模型常驻时的引用计数与按内存预算卸载
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.conf import settings
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from knowledge_mgt.utils import embeddings  # noqa: E402
+from knowledge_mgt.utils.embeddings import LocalEmbeddingManager  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class FakeEmbeddingModel:
+    """不加载权重的嵌入模型，记录创建次数"""
+
+    created = 0
+
+    def __init__(self, model_name, model_config=None):
+        type(self).created += 1
+        self.model_name = model_name
+        self.model_config = model_config or {}
+        self.model = None
+        self.is_loaded = False
+
+    def load_model(self):
+        self.is_loaded = True
+
+    def unload_model(self):
+        self.is_loaded = False
+
+    def batching_stats(self):
+        return None
+
+
+def model_config(name):
+    return {
+        "model_name": name,
+        "model_type": "sentence-transformers",
+        "api_type": "local",
+    }
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """预算2MB、每个模型1MB的独立模型池"""
+    monkeypatch.setattr(FakeEmbeddingModel, "created", 0)
+    monkeypatch.setattr(embeddings, "EmbeddingModel", FakeEmbeddingModel)
+    monkeypatch.setattr(embeddings, "embedding_server_url", lambda: None)
+    monkeypatch.setattr(embeddings, "_model_nbytes", lambda embedding_model: MB)
+    monkeypatch.setattr(settings, "LOCAL_EMBEDDING_MEMORY_BUDGET_MB", 2, raising=False)
+    monkeypatch.setattr(LocalEmbeddingManager, "_instance", None)
+    return LocalEmbeddingManager()
+
+
+def resident(manager):
+    return [item["model_id"] for item in manager.stats()["models"]]
+
+
+def test_models_in_use_are_not_evicted(manager):
+    current = manager.load_model(1, model_config("a"))
+    second = manager.acquire(2, model_config("b"))
+    third = manager.acquire(3, model_config("c"))
+
+    # 超出预算，但当前模型和使用中的模型都不能卸载
+    assert resident(manager) == [1, 2, 3]
+    assert manager.stats()["total_bytes"] == 3 * MB
+
+    manager.release(2)
+    assert not second.is_loaded
+    assert resident(manager) == [1, 3]
+
+    manager.release(3)
+    assert current.is_loaded and third.is_loaded
+    assert manager.get_current_model() is current
+
+
+def test_reference_counts_are_nested(manager):
+    manager.load_model(1, model_config("a"))
+    shared = manager.acquire(2, model_config("b"))
+    assert manager.acquire(2, model_config("b")) is shared
+
+    with manager.use_model(3, model_config("c")) as scoped:
+        assert scoped.is_loaded
+    # 退出with块后模型3空闲，超出预算被卸载；模型2仍有两个引用
+    assert not scoped.is_loaded
+
+    manager.release(2)
+    in_use = {item["model_id"]: item["in_use"] for item in manager.stats()["models"]}
+    assert in_use == {1: 0, 2: 1}
+    manager.release(2)
+    assert shared.is_loaded
+    assert resident(manager) == [1, 2]
+
+
+def test_concurrent_acquire_loads_once(manager):
+    barrier = threading.Barrier(8)
+
+    def acquire():
+        barrier.wait()
+        return manager.acquire(5, model_config("e"))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        models = list(pool.map(lambda _: acquire(), range(8)))
+
+    assert FakeEmbeddingModel.created == 1
+    assert all(model is models[0] for model in models)
+    assert manager.stats()["models"][0]["in_use"] == 8
+    for _ in models:
+        manager.release(5)
+    assert manager.stats()["models"][0]["in_use"] == 0
+
+
+def test_unload_current_model_waits_for_users(manager):
+    current = manager.load_model(1, model_config("a"))
+    manager.acquire(1, model_config("a"))
+
+    manager.unload_current_model()
+    assert manager.get_current_model() is None
+    assert current.is_loaded
+
+    manager.release(1)
+    manager.load_model(2, model_config("b"))
+    manager.load_model(3, model_config("c"))
+    # 模型1已不是当前模型且空闲，超出预算时最先被卸载
+    assert not current.is_loaded
+    assert resident(manager) == [2, 3]
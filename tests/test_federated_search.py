@@ -0,0 +1,63 @@
+"""
+联邦检索分块详情查询的权限过滤测试
+
+原 get_chunk_details 用 chunk_info[9]（实际是 d.chunk_size）与 user_id 比较，普通用户几乎总被判定无权限；
+get_chunk_details_bulk 改为在SQL中按 d.user_id 过滤。
+"""
+
+from datetime import datetime
+
+from knowledge_mgt.utils import federated_search
+
+
+def chunk_row(chunk_id, chunk_size=512, doc_user_id=7):
+    return (
+        chunk_id,
+        "内容",
+        0,
+        datetime(2026, 1, 1),
+        3,
+        "a.pdf",
+        "/media/a.pdf",
+        "pdf",
+        "fixed",
+        chunk_size,
+        doc_user_id,
+        "alice",
+    )
+
+
+def test_regular_user_filters_by_document_owner(monkeypatch, fake_connection):
+    connection = fake_connection([chunk_row(1)])
+    monkeypatch.setattr(federated_search, "connection", connection)
+
+    details = federated_search.get_chunk_details_bulk([1, 1], user_id=7, role_id=2)
+
+    sql, params = connection.cursor_obj.executed[0]
+    assert "AND d.user_id = %s" in sql
+    assert params == [1, 7]
+    # chunk_size与user_id不相等也不影响结果，权限只看文档所属用户
+    assert details[1]["document_info"]["chunk_size"] == 512
+    assert details[1]["document_info"]["user_id"] == 7
+
+
+def test_admin_is_not_filtered(monkeypatch, fake_connection):
+    connection = fake_connection(
+        [chunk_row(1, doc_user_id=9), chunk_row(2, doc_user_id=7)]
+    )
+    monkeypatch.setattr(federated_search, "connection", connection)
+
+    details = federated_search.get_chunk_details_bulk([1, 2], user_id=1, role_id=1)
+
+    sql, params = connection.cursor_obj.executed[0]
+    assert "d.user_id = %s" not in sql
+    assert params == [1, 2]
+    assert set(details) == {1, 2}
+
+
+def test_empty_chunk_ids_skip_query(monkeypatch, fake_connection):
+    connection = fake_connection()
+    monkeypatch.setattr(federated_search, "connection", connection)
+
+    assert federated_search.get_chunk_details_bulk([], user_id=7, role_id=2) == {}
+    assert connection.cursor_obj.executed == []
@@ -0,0 +1,75 @@
+"""
+查询向量缓存测试：进程内TTL LRU的命中、淘汰、过期，以及出错时的全零向量不被缓存
+"""
+
+import time
+
+from knowledge_mgt.utils.query_embedding_cache import QueryEmbeddingCache
+
+
+def counting_embed(calls):
+    def embed(query):
+        calls.append(query)
+        return [float(len(query)), 1.0]
+
+    return embed
+
+
+def test_hits_and_stats():
+    cache = QueryEmbeddingCache(max_entries=8, ttl=60, use_redis=False)
+    calls = []
+
+    assert cache.get_or_embed("m1", "什么是RAG", counting_embed(calls)) == [6.0, 1.0]
+    assert cache.get_or_embed("m1", " 什么是RAG ", counting_embed(calls)) == [6.0, 1.0]
+    cache.get_or_embed("m2", "什么是RAG", counting_embed(calls))
+
+    assert calls == ["什么是RAG", "什么是RAG"]
+    stats = cache.stats()
+    assert (stats["local_hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["hit_rate"] == round(1 / 3, 4)
+
+
+def test_lru_eviction():
+    cache = QueryEmbeddingCache(max_entries=2, ttl=60, use_redis=False)
+    calls = []
+    embed = counting_embed(calls)
+    for query in ("a", "b", "a", "c", "a", "b"):
+        cache.get_or_embed("m1", query, embed)
+
+    # b在c写入时最久未使用而被淘汰，a一直命中
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_entries_expire_after_ttl():
+    cache = QueryEmbeddingCache(max_entries=8, ttl=0.01, use_redis=False)
+    calls = []
+    cache.get_or_embed("m1", "q", counting_embed(calls))
+    time.sleep(0.02)
+    cache.get_or_embed("m1", "q", counting_embed(calls))
+
+    assert calls == ["q", "q"]
+
+
+def test_zero_vectors_and_empty_queries_are_not_cached():
+    cache = QueryEmbeddingCache(max_entries=8, ttl=60, use_redis=False)
+    calls = []
+
+    def failing_embed(query):
+        calls.append(query)
+        return [0.0, 0.0]
+
+    cache.get_or_embed("m1", "q", failing_embed)
+    cache.get_or_embed("m1", "q", failing_embed)
+    cache.get_or_embed("m1", "", failing_embed)
+
+    assert calls == ["q", "q", ""]
+    assert cache.stats()["entries"] == 0
+
+
+def test_disabled_when_max_entries_is_zero():
+    cache = QueryEmbeddingCache(max_entries=0, ttl=60, use_redis=False)
+    calls = []
+    cache.get_or_embed("m1", "q", counting_embed(calls))
+    cache.get_or_embed("m1", "q", counting_embed(calls))
+
+    assert calls == ["q", "q"]
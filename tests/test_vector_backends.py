@@ -0,0 +1,20 @@
+"""
+检索后端测试：按查询指定的检索参数
+"""
+
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from knowledge_mgt.utils.vector_backends import FaissBackend  # noqa: E402
+
+
+def test_ivf_nprobe_is_clamped_to_nlist(vectors):
+    quantizer = faiss.IndexFlatL2(16)
+    index = faiss.IndexIVFFlat(quantizer, 16, 4)
+    index.train(vectors)
+    backend = FaissBackend(index)
+
+    assert backend.search_params({}, nprobe=1000)[1] == {"nprobe": 4}
+    assert backend.search_params({"nprobe": 2})[1] == {"nprobe": 2}
+    assert backend.search_params({}, nprobe=3)[1] == {"nprobe": 3}
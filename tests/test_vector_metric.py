@@ -0,0 +1,50 @@
+"""
+度量方式测试：按嵌入模型推断度量方式，已有索引在l2与cosine之间转换
+"""
+
+import numpy as np
+import pytest
+
+from knowledge_mgt.utils.vector_store import (
+    METRIC_COSINE,
+    METRIC_L2,
+    VectorStore,
+    metric_for_embedding_model,
+)
+
+
+def test_metric_for_embedding_model():
+    assert metric_for_embedding_model("online", "text-embedding-v2") == METRIC_COSINE
+    assert metric_for_embedding_model("local", "DashScope-compatible") == METRIC_COSINE
+    assert metric_for_embedding_model("local", "all-MiniLM-L6-v2") == METRIC_L2
+
+
+def test_convert_l2_index_to_cosine_and_back(populated_store, vectors):
+    assert populated_store.get_index_info(1)["metric"] == METRIC_L2
+
+    assert populated_store.convert_metric(1, METRIC_COSINE)
+
+    assert populated_store.get_index_info(1)["metric"] == METRIC_COSINE
+    top = populated_store.search(1, vectors[250] * 3, top_k=2, use_cosine=True)
+    # 余弦相似度与向量长度无关，自身相似度为1
+    assert top[0]["chunk_id"] == 1250
+    assert top[0]["distance"] == pytest.approx(1.0, abs=1e-3)
+    assert top[0]["distance"] >= top[1]["distance"]
+
+    # 转换为cosine时向量已归一化，转回l2后保持归一化后的向量
+    assert populated_store.convert_metric(1, METRIC_L2)
+    assert populated_store.get_index_info(1)["metric"] == METRIC_L2
+    top = populated_store.search(
+        1, vectors[250] / np.linalg.norm(vectors[250]), top_k=1
+    )
+    assert top[0]["chunk_id"] == 1250
+    assert top[0]["distance"] == pytest.approx(0.0, abs=1e-3)
+
+
+def test_cosine_index_created_from_metric(vector_env, vectors):
+    store = VectorStore(vector_dimension=16, metric=METRIC_COSINE)
+    store.create_index(2)
+    store.add_vectors(2, list(range(50)), vectors[:50])
+
+    assert store.get_index_info(2)["metric"] == METRIC_COSINE
+    assert store.search(2, vectors[7] * 0.5, top_k=1)[0]["chunk_id"] == 7
@@ -0,0 +1,64 @@
+"""
+迁移测试：旧版id_mapping.json转换为id_mapping.npy，索引类型迁移策略解析与在线迁移
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from knowledge_mgt.utils.vector_files import ID_MAP_FILENAME, load_id_map
+from knowledge_mgt.utils.vector_migration import (
+    LEGACY_ID_MAP_FILENAME,
+    migrate_id_mapping,
+    parse_migration_policy,
+)
+from knowledge_mgt.utils.vector_segments import load_manifest
+
+
+def test_migrate_legacy_json_id_mapping(tmp_path):
+    legacy_path = tmp_path / LEGACY_ID_MAP_FILENAME
+    legacy_path.write_text(json.dumps({"0": 10, "2": 12, "3": 13}))
+
+    assert migrate_id_mapping(str(tmp_path))
+
+    id_map = load_id_map(str(tmp_path / ID_MAP_FILENAME))
+    assert id_map.dtype == np.int64
+    # 旧映射中缺失的向量ID视为墓碑
+    assert id_map.tolist() == [10, -1, 12, 13]
+    assert not legacy_path.exists()
+    assert (tmp_path / f"{LEGACY_ID_MAP_FILENAME}.bak").exists()
+    # 已迁移的目录不会重复迁移
+    assert not migrate_id_mapping(str(tmp_path))
+
+
+def test_migrate_without_legacy_file_is_noop(tmp_path):
+    assert not migrate_id_mapping(str(tmp_path))
+    assert not (tmp_path / ID_MAP_FILENAME).exists()
+
+
+def test_parse_migration_policy():
+    assert parse_migration_policy("ivfpq:2000000, hnsw:100000") == [
+        (100000, "HNSW"),
+        (2000000, "IVFPQ"),
+    ]
+    assert parse_migration_policy("") == []
+    with pytest.raises(ValueError):
+        parse_migration_policy("UNKNOWN:100")
+    with pytest.raises(ValueError):
+        parse_migration_policy("HNSW:many")
+
+
+def test_migrate_index_type_keeps_results(populated_store, vectors):
+    assert populated_store.migrate_index_type(1, "HNSW")
+
+    manifest = load_manifest(os.path.join(populated_store.vector_dir, "1"))
+    assert manifest["index_type"] == "HNSW"
+    assert manifest["segments"] == []
+    assert populated_store.get_index_info(1)["index_type"] == "HNSW"
+    for position in (3, 333):
+        assert (
+            populated_store.search(1, vectors[position], top_k=1)[0]["chunk_id"]
+            == 1000 + position
+        )
@@ -0,0 +1,154 @@
+"""
+增量段与段清单测试：每批写入一个不可变增量段并提交清单，检索覆盖基础索引与全部段，合并后并入基础索引
+"""
+
+import os
+
+import numpy as np
+import pytest
+from django.conf import settings
+
+from knowledge_mgt.utils.vector_files import (
+    fcntl,
+    get_write_lock,
+    load_id_map,
+)
+from knowledge_mgt.utils.vector_segments import (
+    load_manifest,
+    save_manifest,
+    segment_paths,
+)
+
+
+def test_each_add_commits_a_segment(populated_store):
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    manifest = load_manifest(db_vector_dir)
+
+    assert manifest["backend"] == populated_store.backend
+    assert (
+        manifest["base_ntotal"] + sum(seg["ntotal"] for seg in manifest["segments"])
+        == 400
+    )
+    assert len(manifest["segments"]) >= 1
+    # 基础索引与各段的ID映射依次拼接，覆盖全部分块
+    id_parts = [
+        load_id_map(populated_store._base_paths(db_vector_dir, manifest)[1])[
+            : manifest["base_ntotal"]
+        ]
+    ]
+    for segment in manifest["segments"]:
+        index_path, ids_path = segment_paths(db_vector_dir, segment["name"])
+        assert os.path.exists(index_path)
+        id_parts.append(load_id_map(ids_path))
+    assert np.array_equal(np.concatenate(id_parts), np.arange(1000, 1400))
+
+
+def test_save_manifest_bumps_version(tmp_path):
+    manifest = {"version": 3, "segments": []}
+    save_manifest(str(tmp_path), manifest)
+
+    assert load_manifest(str(tmp_path))["version"] == 4
+    assert load_manifest(str(tmp_path / "missing")) is None
+
+
+def test_search_covers_base_and_segments(populated_store, vectors):
+    for position in (5, 250, 399):
+        results = populated_store.search(1, vectors[position], top_k=3)
+        assert results[0]["chunk_id"] == 1000 + position
+
+
+def test_merge_folds_segments_into_base(populated_store, vectors):
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    version = load_manifest(db_vector_dir)["version"]
+
+    assert populated_store.merge_segments(1, force=True)
+
+    manifest = load_manifest(db_vector_dir)
+    assert manifest["segments"] == []
+    assert manifest["base_ntotal"] == 400
+    assert manifest["version"] > version
+    assert not os.listdir(os.path.join(db_vector_dir, "segments"))
+    assert populated_store.search(1, vectors[250], top_k=1)[0]["chunk_id"] == 1250
+
+
+def test_filtered_search_within_segments(populated_store, vectors):
+    assert (
+        populated_store.search(1, vectors[250], top_k=3, filters={"document_ids": [1]})[
+            0
+        ]["chunk_id"]
+        < 1200
+    )
+    assert (
+        populated_store.search(1, vectors[250], top_k=3, filters={"document_ids": [2]})[
+            0
+        ]["chunk_id"]
+        == 1250
+    )
+
+
+def test_filter_reloads_cached_chunk_attributes(populated_store, vectors):
+    assert not populated_store.search(
+        1, vectors[250], top_k=3, filters={"document_ids": [3]}
+    )
+
+    # 追加分块后属性表的版本戳变化，缓存的排序索引随之重建
+    populated_store.add_vectors(
+        1, [5000], vectors[250:251] * 2, chunk_attributes={"document_id": 3}
+    )
+    results = populated_store.search(
+        1, vectors[250] * 2, top_k=3, filters={"document_ids": [3]}
+    )
+    assert [item["chunk_id"] for item in results] == [5000]
+
+
+def test_add_schedules_merge_when_segments_outgrow_base(
+    populated_store, background_tasks
+):
+    # 基础索引为空时任何增量段都达到合并比例
+    assert ("_schedule_merge", 1) in background_tasks
+
+
+def _locked_by_other_process(path):
+    """用独立的文件描述符尝试加锁，flock按打开的文件区分持有者，与其他进程加锁的效果相同"""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+@pytest.mark.skipif(fcntl is None, reason="需要fcntl")
+def test_write_lock_excludes_other_processes(vector_env):
+    lock = get_write_lock(1)
+    lock_path = os.path.join(settings.MEDIA_ROOT, "vector_indexes", "1", ".lock")
+
+    with lock:
+        with lock:
+            assert _locked_by_other_process(lock_path)
+        # 内层释放后仍由外层持有
+        assert _locked_by_other_process(lock_path)
+    assert not _locked_by_other_process(lock_path)
+
+
+@pytest.mark.skipif(fcntl is None, reason="需要fcntl")
+def test_write_lock_survives_directory_cleanup(populated_store):
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    assert populated_store.cleanup_index(1)
+    assert not os.path.exists(db_vector_dir)
+
+    # 知识库目录被删除后重新加锁时创建新的锁文件
+    with get_write_lock(1):
+        assert _locked_by_other_process(os.path.join(db_vector_dir, ".lock"))
+
+
+def test_add_rejects_mismatched_dimension(populated_store, vectors):
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    before = load_manifest(db_vector_dir)
+
+    # 维度不一致的向量不做填充或截断，直接拒绝且不提交任何段
+    assert populated_store.add_vectors(1, [5000, 5001], vectors[:2, :8]) == []
+    assert populated_store.add_vectors(1, [5000], np.ones((1, 32))) == []
+    assert load_manifest(db_vector_dir)["version"] == before["version"]
@@ -0,0 +1,157 @@
+"""
+向量服务测试：消息编码与解码、socket收发、请求分发的参数白名单、客户端在服务不可用时的行为
+"""
+
+import socket
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from knowledge_mgt.utils.vector_service import (
+    HEADER,
+    PROTOCOL_MAGIC,
+    VectorServiceClient,
+    VectorServiceError,
+    VectorServiceServer,
+    decode_message,
+    encode_message,
+    recv_message,
+    send_message,
+)
+
+
+def split_message(data):
+    magic, version, body_len, blob_len = HEADER.unpack(data[: HEADER.size])
+    body = data[HEADER.size : HEADER.size + body_len]
+    blob = bytearray(data[HEADER.size + body_len :])
+    assert magic == PROTOCOL_MAGIC
+    assert len(blob) == blob_len
+    return body, blob
+
+
+def test_encode_decode_round_trip():
+    vectors = np.arange(12, dtype="float32").reshape(3, 4)
+    labels = np.array([[1, -1]], dtype=np.int64)
+    payload = {
+        "method": "search_batch",
+        "args": [7, vectors],
+        "kwargs": {
+            "top_k": np.int64(5),
+            "nested": [{"labels": labels}],
+            "since": datetime(2026, 1, 2),
+        },
+    }
+
+    decoded = decode_message(*split_message(encode_message(payload)))
+
+    assert decoded["method"] == "search_batch"
+    assert decoded["args"][0] == 7
+    assert decoded["args"][1].dtype == np.float32
+    assert np.array_equal(decoded["args"][1], vectors)
+    assert np.array_equal(decoded["kwargs"]["nested"][0]["labels"], labels)
+    assert decoded["kwargs"]["top_k"] == 5
+    assert decoded["kwargs"]["since"] == "2026-01-02T00:00:00"
+
+
+def test_arrays_are_sent_as_raw_bytes():
+    vectors = np.ones((100, 64), dtype="float32")
+    body, blob = split_message(encode_message({"vectors": vectors}))
+
+    assert len(blob) == vectors.nbytes
+    assert len(body) < 200
+
+
+def test_send_and_receive_over_socket():
+    left, right = socket.socketpair()
+    try:
+        send_message(left, {"ok": True, "result": [np.eye(2, dtype="float32")]})
+        message = recv_message(right)
+    finally:
+        left.close()
+        right.close()
+
+    assert message["ok"]
+    assert np.array_equal(message["result"][0], np.eye(2))
+    # 接收缓冲区可写，服务端可以原地归一化
+    message["result"][0] /= 2
+
+
+def test_receive_rejects_unknown_header():
+    left, right = socket.socketpair()
+    try:
+        left.sendall(HEADER.pack(b"XX", 1, 0, 0))
+        with pytest.raises(VectorServiceError):
+            recv_message(right)
+    finally:
+        left.close()
+        right.close()
+
+
+def test_dispatch_only_forwards_store_arguments(vector_env):
+    request = {
+        "method": "has_stored_vectors",
+        "store": {
+            "vector_dimension": 16,
+            "index_type": "HNSW",
+            "metric": None,
+            "vector_dir": "/etc",
+        },
+        "args": [1],
+    }
+
+    response = VectorServiceServer.dispatch(None, request)
+
+    assert response == {"ok": True, "result": False}
+
+
+def test_dispatch_rejects_unknown_method(vector_env):
+    response = VectorServiceServer.dispatch(None, {"method": "__init__"})
+
+    assert not response["ok"]
+
+
+def test_local_flag_bypasses_vector_service(vector_env, monkeypatch):
+    from django.conf import settings
+
+    from knowledge_mgt.utils.vector_store import VectorStore
+
+    monkeypatch.setattr(settings, "VECTOR_SERVICE_SOCKET", "/tmp/unused.sock")
+
+    assert isinstance(VectorStore(vector_dimension=16), VectorServiceClient)
+    store = VectorStore(vector_dimension=16, index_type="HNSW", local=True)
+    assert type(store) is VectorStore
+    assert (store.vector_dimension, store.index_type) == (16, "HNSW")
+
+
+def test_client_raises_for_writes_when_service_is_down(vector_env, tmp_path):
+    client = VectorServiceClient(
+        vector_dimension=16, socket_path=str(tmp_path / "missing.sock")
+    )
+
+    with pytest.raises(VectorServiceError):
+        client.add_vectors(1, [1], np.zeros((1, 16), dtype="float32"))
+    with pytest.raises(VectorServiceError):
+        client.delete_vectors(1, [0])
+
+
+def test_client_reads_fall_back_to_local_index(populated_store, vectors, tmp_path):
+    client = VectorServiceClient(
+        vector_dimension=16, socket_path=str(tmp_path / "missing.sock")
+    )
+
+    assert client.search(1, vectors[42], top_k=1)[0]["chunk_id"] == 1042
+    assert client.has_stored_vectors(1)
+
+
+def test_client_raises_when_service_write_fails(vector_env, monkeypatch):
+    client = VectorServiceClient(vector_dimension=16, socket_path="unused")
+    monkeypatch.setattr(
+        client, "_request", lambda payload: {"ok": False, "error": "磁盘已满"}
+    )
+
+    with pytest.raises(VectorServiceError, match="磁盘已满"):
+        client.cleanup_index(1)
+    # 只读方法返回与 VectorStore 出错时相同的值
+    assert client.search(1, np.zeros(16, dtype="float32")) == []
+    assert client.get_index_info(1) is None
@@ -0,0 +1,93 @@
+"""
+墓碑与压缩测试：删除只在ID映射中标记-1，检索排除墓碑；压缩后存活向量重新编号，墓碑清零
+"""
+
+import json
+import os
+
+import numpy as np
+
+from knowledge_mgt.utils.vector_files import load_id_map, raw_vectors_path
+from knowledge_mgt.utils.vector_segments import load_manifest
+from knowledge_mgt.utils.vector_tombstones import count_tombstones
+
+
+def read_metadata(store):
+    with open(os.path.join(store.vector_dir, "1", "metadata.json")) as f:
+        return json.load(f)
+
+
+def test_count_tombstones_only_counts_indexed_vectors():
+    id_mapping = np.array([10, -1, 12, -1, -1], dtype=np.int64)
+
+    assert count_tombstones(5, id_mapping) == 3
+    # ntotal之外的位置不计入
+    assert count_tombstones(3, id_mapping) == 1
+
+
+def test_delete_marks_tombstones_and_excludes_them(populated_store, vectors):
+    assert populated_store.delete_vectors(1, [5, 250])
+
+    results = populated_store.search(1, vectors[5], top_k=5)
+    assert len(results) == 5
+    assert 1005 not in [item["chunk_id"] for item in results]
+    assert populated_store.search(1, vectors[250], top_k=1)[0]["chunk_id"] != 1250
+    metadata = read_metadata(populated_store)
+    assert metadata["deleted_vectors"] == 2
+    assert metadata["total_vectors"] == 398
+
+
+def test_delete_over_ratio_schedules_compaction(
+    populated_store, background_tasks, monkeypatch
+):
+    from django.conf import settings
+
+    monkeypatch.setattr(settings, "VECTOR_INDEX_COMPACT_RATIO", 0.1, raising=False)
+    populated_store.delete_vectors(1, list(range(10)))
+    assert ("_schedule_compaction", 1) not in background_tasks
+
+    populated_store.delete_vectors(1, list(range(10, 60)))
+    assert ("_schedule_compaction", 1) in background_tasks
+
+
+def test_compaction_removes_tombstones(populated_store, vectors):
+    populated_store.delete_vectors(1, list(range(0, 400, 2)))
+
+    assert populated_store.compact_index(1, force=True)
+
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    manifest = load_manifest(db_vector_dir)
+    id_map = load_id_map(populated_store._base_paths(db_vector_dir, manifest)[1])
+    assert manifest["segments"] == []
+    assert manifest["base_ntotal"] == 200
+    assert np.array_equal(id_map[:200], np.arange(1001, 1400, 2))
+    assert read_metadata(populated_store)["deleted_vectors"] == 0
+    for position in (1, 201, 399):
+        assert (
+            populated_store.search(1, vectors[position], top_k=1)[0]["chunk_id"]
+            == 1000 + position
+        )
+
+
+def test_compaction_writes_a_new_base_version(populated_store):
+    db_vector_dir = os.path.join(populated_store.vector_dir, "1")
+    populated_store.merge_segments(1, force=True)
+    before = load_manifest(db_vector_dir)
+    old_paths = populated_store._base_paths(db_vector_dir, before)
+    old_raw_path = raw_vectors_path(
+        db_vector_dir, read_metadata(populated_store), before["base_version"]
+    )
+    populated_store.delete_vectors(1, list(range(0, 400, 2)))
+
+    assert populated_store.compact_index(1)
+
+    # 新的基础索引、ID映射和原始向量写入新版本文件，段清单提交后才删除旧版本
+    after = load_manifest(db_vector_dir)
+    new_paths = populated_store._base_paths(db_vector_dir, after)
+    assert after["base_version"] == before["base_version"] + 1
+    assert all(os.path.exists(path) for path in new_paths)
+    assert not any(os.path.exists(path) for path in old_paths + (old_raw_path,))
+    new_raw_path = raw_vectors_path(
+        db_vector_dir, read_metadata(populated_store), after["base_version"]
+    )
+    assert os.path.getsize(new_raw_path) == 200 * 16 * 4
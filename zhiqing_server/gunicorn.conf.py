@@ -0,0 +1,23 @@
+"""
+gunicorn配置
+启动命令: gunicorn -c zhiqing_server/gunicorn.conf.py zhiqing_server.wsgi:application
+"""
+
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+
+def post_worker_init(worker):
+    """工作进程加载完Django应用后启动预热（需开启 VECTOR_WARMUP_ON_START）
+
+    在fork之后的工作进程中执行，索引和模型加载到各工作进程自己的内存中；预热在后台线程中进行，
+    期间 /health/ 返回503。
+    """
+    from django.conf import settings
+
+    if getattr(settings, 'VECTOR_WARMUP_ON_START', False):
+        from knowledge_mgt.utils.warmup import start_warmup_in_background
+        start_warmup_in_background()
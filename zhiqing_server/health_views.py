@@ -9,6 +9,8 @@ import redis
 import os
 import logging
 
+from zhiqing_server.utils.auth_utils import jwt_required
+
 logger = logging.getLogger(__name__)
 
 
@@ -114,6 +116,26 @@ def health_check(request):
         health_status['status'] = 'unhealthy'
         logger.error(f"Media directory health check failed: {e}")
     
+    # 检查启动预热：预热完成前实例未就绪
+    try:
+        from knowledge_mgt.utils.warmup import get_warmup_state, is_warmup_ready, warmup_enabled
+        if warmup_enabled():
+            warmup_state = get_warmup_state()
+            if is_warmup_ready():
+                health_status['services']['warmup'] = {
+                    'status': 'healthy',
+                    'message': f"Warm-up {warmup_state['status']}: "
+                               f"{len(warmup_state['knowledge_bases'])} knowledge bases loaded"
+                }
+            else:
+                health_status['services']['warmup'] = {
+                    'status': 'unhealthy',
+                    'message': f"Warm-up {warmup_state['status']}"
+                }
+                health_status['status'] = 'unhealthy'
+    except Exception as e:
+        logger.error(f"Warm-up health check failed: {e}")
+
     # 根据整体状态返回相应的HTTP状态码
     if health_status['status'] == 'healthy':
         return JsonResponse(health_status, status=200)
@@ -132,3 +154,36 @@ def simple_health_check(request):
         'message': 'Service is running',
         'timestamp': datetime.now().isoformat()
     })
+
+
+@jwt_required(admin_only=True)
+def metrics(request):
+    """
+    缓存指标端点，仅管理员可访问
+    返回本工作进程的查询向量缓存、嵌入缓存、向量索引缓存统计以及常驻的本地嵌入模型；
+    查询向量缓存开启Redis时，cluster字段为全部工作进程的汇总命中率
+    """
+    from datetime import datetime
+    from knowledge_mgt.utils.query_embedding_cache import query_embedding_cache
+    from knowledge_mgt.utils.vector_index_cache import vector_index_cache
+    from knowledge_mgt.utils.embedding_cache import get_embedding_cache
+
+    result = {
+        'pid': os.getpid(),
+        'timestamp': datetime.now().isoformat(),
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'vector_index_cache': vector_index_cache.stats(),
+    }
+    try:
+        embedding_cache = get_embedding_cache()
+        result['embedding_cache'] = embedding_cache.stats() if embedding_cache else None
+    except Exception as e:
+        logger.error(f"Embedding cache metrics failed: {e}")
+        result['embedding_cache'] = None
+    try:
+        from knowledge_mgt.utils.embeddings import local_embedding_manager
+        result['local_embedding_models'] = local_embedding_manager.stats()
+    except Exception as e:
+        logger.error(f"Local embedding model metrics failed: {e}")
+        result['local_embedding_models'] = None
+    return JsonResponse(result)
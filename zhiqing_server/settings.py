@@ -188,6 +188,73 @@ JWT_CONF = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+# 向量索引配置
+# 进程内FAISS索引缓存的内存上限（MB），超出后按LRU淘汰
+VECTOR_INDEX_CACHE_MAX_BYTES = int(os.getenv('VECTOR_INDEX_CACHE_MAX_MB', '1024')) * 1024 * 1024
+# 以内存映射方式只读加载索引，多个gunicorn工作进程共享同一份页缓存
+VECTOR_INDEX_MMAP = os.getenv('VECTOR_INDEX_MMAP', 'True').lower() in ('true', '1', 'yes')
+# 已删除向量（墓碑）占比超过该值时在后台压缩索引
+VECTOR_INDEX_COMPACT_RATIO = float(os.getenv('VECTOR_INDEX_COMPACT_RATIO', '0.2'))
+# IVF知识库向量数达到该值后才训练IVF索引，之前使用Flat暂存索引
+VECTOR_IVF_TRAIN_THRESHOLD = int(os.getenv('VECTOR_IVF_TRAIN_THRESHOLD', '10000'))
+# 增量段向量数达到基础索引的该比例时，后台把增量段合并到基础索引
+VECTOR_SEGMENT_MERGE_RATIO = float(os.getenv('VECTOR_SEGMENT_MERGE_RATIO', '0.1'))
+# 增量段数量超过该值时，后台把增量段合并为一个段
+VECTOR_SEGMENT_MAX_COUNT = int(os.getenv('VECTOR_SEGMENT_MAX_COUNT', '8'))
+# 跨知识库联邦检索的并发线程数
+VECTOR_FEDERATED_MAX_WORKERS = int(os.getenv('VECTOR_FEDERATED_MAX_WORKERS', '8'))
+# 原始向量文件的存储精度（float32或float16），重建、压缩和更换索引类型时直接读取，无需重新生成embedding
+VECTOR_RAW_VECTORS_DTYPE = os.getenv('VECTOR_RAW_VECTORS_DTYPE', 'float32')
+# 索引类型自动迁移策略，格式为 "索引类型:向量数阈值"，逗号分隔，例如 "HNSW:100000,IVFPQ:2000000"；为空时不自动迁移
+VECTOR_INDEX_MIGRATION_POLICY = os.getenv('VECTOR_INDEX_MIGRATION_POLICY', '')
+# 缓存索引校验文件版本戳的最小间隔（秒），其他进程的写入最多延迟该时间可见
+VECTOR_INDEX_VERSION_CHECK_INTERVAL = float(os.getenv('VECTOR_INDEX_VERSION_CHECK_INTERVAL', '1.0'))
+# 通过Redis发布/订阅广播索引变更，各进程收到后立即重新校验缓存
+VECTOR_INDEX_NOTIFY_REDIS = os.getenv('VECTOR_INDEX_NOTIFY_REDIS', 'False').lower() in ('true', '1', 'yes')
+VECTOR_INDEX_NOTIFY_CHANNEL = os.getenv('VECTOR_INDEX_NOTIFY_CHANNEL', 'zhiqing:vector_index_changed')
+# 向量检索后端：faiss、numpy或auto（已安装FAISS时使用FAISS，否则使用纯NumPy精确检索）
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'auto')
+# NumPy后端每次参与矩阵乘法的向量行数，决定检索时的峰值内存
+VECTOR_NUMPY_BLOCK_SIZE = int(os.getenv('VECTOR_NUMPY_BLOCK_SIZE', '65536'))
+# 本机向量服务的Unix socket路径（manage.py run_vector_service），配置后web工作进程通过该服务访问索引；为空时各进程自行加载索引
+VECTOR_SERVICE_SOCKET = os.getenv('VECTOR_SERVICE_SOCKET', '')
+# 访问向量服务的超时时间（秒），需覆盖重建、压缩等耗时的写操作
+VECTOR_SERVICE_TIMEOUT = float(os.getenv('VECTOR_SERVICE_TIMEOUT', '300'))
+# 工作进程启动后按最近的会话访问量预热热门知识库的索引和嵌入模型，预热完成前 /health/ 返回503
+VECTOR_WARMUP_ON_START = os.getenv('VECTOR_WARMUP_ON_START', 'False').lower() in ('true', '1', 'yes')
+# 预热的知识库数量，以及统计会话访问量的天数
+VECTOR_WARMUP_KB_LIMIT = int(os.getenv('VECTOR_WARMUP_KB_LIMIT', '10'))
+VECTOR_WARMUP_DAYS = int(os.getenv('VECTOR_WARMUP_DAYS', '7'))
+# 嵌入向量持久化缓存：按 (模型, 规范化文本哈希) 保存已生成的向量，重新入库和重建索引时只为变化的分块生成向量
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+# 缓存文件路径，为空时使用 MEDIA_ROOT/embedding_cache/embeddings.sqlite3
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
+# 缓存大小上限（MB），超过后按最近使用时间淘汰
+EMBEDDING_CACHE_MAX_MB = int(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048'))
+# 查询向量缓存：对话检索、召回测试和查重中相同查询直接复用向量，条目数上限和过期时间（秒）
+QUERY_EMBEDDING_CACHE_ENABLED = os.getenv('QUERY_EMBEDDING_CACHE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+# 以Redis作为各工作进程共享的第二级查询向量缓存
+QUERY_EMBEDDING_CACHE_REDIS = os.getenv('QUERY_EMBEDDING_CACHE_REDIS', 'False').lower() in ('true', '1', 'yes')
+QUERY_EMBEDDING_CACHE_PREFIX = os.getenv('QUERY_EMBEDDING_CACHE_PREFIX', 'zhiqing:query_embedding')
+# 本地嵌入模型池的内存预算（MB），多个本地模型同时常驻，超出后按最近使用顺序卸载空闲模型
+LOCAL_EMBEDDING_MEMORY_BUDGET_MB = int(os.getenv('LOCAL_EMBEDDING_MEMORY_BUDGET_MB', '4096'))
+# 本地嵌入模型合并并发的单条请求做批量推理：每批最多条数，以及收到第一条后最多等待的毫秒数
+EMBEDDING_BATCHING_ENABLED = os.getenv('EMBEDDING_BATCHING_ENABLED', 'True').lower() in ('true', '1', 'yes')
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv('EMBEDDING_BATCH_MAX_WAIT_MS', '5'))
+# 本机嵌入服务地址（manage.py run_embedding_server），如 http://127.0.0.1:8100 或 unix:///run/zhiqing/embedding.sock；
+# 配置后本地嵌入模型只由服务进程加载，各工作进程通过OpenAI兼容的 /v1/embeddings 接口推理；为空时各进程自行加载模型
+EMBEDDING_SERVER_URL = os.getenv('EMBEDDING_SERVER_URL', '')
+# 访问嵌入服务的超时时间（秒）
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv('EMBEDDING_SERVER_TIMEOUT', '60'))
+
+# Redis配置
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
+
 # 日志基础路径
 LOG_BASE_DIR = os.path.join(BASE_DIR, 'logs')
 # 确保日志基础目录存在
@@ -30,6 +30,8 @@ urlpatterns = [
     # 健康检查端点
     path('health/', health_views.health_check, name='health_check'),
     path('health/simple/', health_views.simple_health_check, name='simple_health_check'),
+    # 缓存命中率等运行指标
+    path('metrics/', health_views.metrics, name='metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)